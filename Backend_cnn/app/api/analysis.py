@@ -1,33 +1,60 @@
 # app/api/analysis.py
+import asyncio
 import json
-import os
-import shutil
+import time
+from datetime import date, datetime
 from decimal import Decimal
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from uuid import uuid4
 
 from fastapi import (
     APIRouter,
+    Request,
     UploadFile,
     File,
     Form,
     Depends,
+    Query,
     HTTPException,
 )
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.db.mysql_connection import get_db
 from app.db import models as db_models
-from app.core.security import get_current_user
-from app.ml.models.cnn_model import copper_model
-from app.ml.utils.report_generator import generate_pdf_report
+from app.core.events import event_bus
+from app.core.http_files import cached_file_response, virtual_file_response
+from app.core.security import get_current_user, get_current_user_stream
+from app.core.executors import (
+    StageUnavailable,
+    db_stage,
+    decode_stage,
+    io_stage,
+    stages_stats,
+)
+from app.ml.inference.batcher import QueueFullError, copper_batcher
+from app.ml.inference.cache import content_hash, prediction_cache
+from app.ml.inference.drift import drift_monitor
+from app.ml.inference.embeddings import embedding_store
+from app.ml.inference.explain import embed_in_report, explanation_service
+from app.ml.models.cnn_model import MODEL_VERSION_MAX_LENGTH, copper_model
+from app.ml.utils.decoding import DECODE_ERRORS, decode_image, decode_tiles
+from app.services.analysis_service import (
+    analysis_event,
+    build_detail_payload,
+    save_reporte,
+)
+from app.services.export import ExportFilter, ExportTooLarge, prepare_merged, prepare_zip
+from app.services.ingest import UploadRejected, discard_upload, ingest_upload
+from app.services.report_cache import cache_path, render_key, report_renderer
+from app.services.storage import upload_store
+from app.services.thumbnails import thumbnail_service
+from app.services.job_queue import enqueue_job, queue_position, queue_stats
 
 router = APIRouter(prefix="/api/analysis", tags=["analysis"])
 
-UPLOAD_DIR = "uploads"
-REPORTS_DIR = "reports"
 
 
 # --------- SCHEMAS DE RESPUESTA (alineados con el front) ---------
@@ -40,6 +67,7 @@ class AnalysisSummaryResponse(BaseModel):
     riskLevel: str
     copperGrade: str
     status: str
+    thumbnailUrl: Optional[str] = None
 
 
 class AnalysisDetailResponse(BaseModel):
@@ -54,6 +82,196 @@ class AnalysisDetailResponse(BaseModel):
     metadata: Dict[str, Any]
     imageUrl: str
     status: str
+    heatmap: Optional[Dict[str, Any]] = None
+    # Grad-CAM ya generado (se pide en /{id}/explanation)
+    explanationUrl: Optional[str] = None
+    thumbnailUrl: Optional[str] = None
+
+
+class ExplanationResponse(BaseModel):
+    id: int
+    status: str
+    url: Optional[str] = None
+    modelVersion: Optional[str] = None
+    error: Optional[str] = None
+
+
+class JobAcceptedResponse(BaseModel):
+    jobId: int
+    status: str
+    statusUrl: str
+
+
+class JobStatusResponse(BaseModel):
+    jobId: int
+    status: str
+    imageStatus: str
+    attempts: int
+    queuePosition: Optional[int] = None
+    error: Optional[str] = None
+    createdAt: Optional[str] = None
+    startedAt: Optional[str] = None
+    finishedAt: Optional[str] = None
+    analysisId: Optional[int] = None
+    analysis: Optional[AnalysisDetailResponse] = None
+
+
+class SimilarAnalysisResponse(BaseModel):
+    id: int
+    similarity: float
+    date: str
+    zone: str
+    category: str
+    copperGrade: str
+    status: str
+    imageUrl: str
+    thumbnailUrl: Optional[str] = None
+
+
+class SimilarAnalysesResponse(BaseModel):
+    id: int
+    modelVersion: str
+    searchMs: float
+    results: List[SimilarAnalysisResponse]
+
+
+class BatchItemResponse(BaseModel):
+    filename: str
+    ok: bool
+    error: Optional[str] = None
+    analysis: Optional[AnalysisDetailResponse] = None
+
+
+class BatchUploadResponse(BaseModel):
+    batchId: str
+    total: int
+    processed: int
+    failed: int
+    seconds: float
+    imagesPerSecond: float
+    results: List[BatchItemResponse]
+# ---------------------------------------------------------------
+
+
+# --------- ETAPAS BLOQUEANTES (corren en app.core.executors) ---------
+
+def _hash_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return content_hash(f.read())
+
+
+def _save_clasificacion(
+    db: Session,
+    id_usuario: int,
+    disk_path: str,
+    tamano: int,
+    formato: str,
+    hash_contenido: str,
+    predicted_class: str,
+    confidence: float,
+    modelo_usado: str,
+):
+    imagen = db_models.Imagen(
+        id_usuario=id_usuario,
+        ruta_archivo=disk_path,
+        hash_contenido=hash_contenido,
+        tamano=tamano,
+        formato=formato,
+        estado="procesada",
+    )
+    db.add(imagen)
+    db.commit()
+    db.refresh(imagen)
+
+    clasificacion = db_models.Clasificacion(
+        id_imagen=imagen.id_imagen,
+        resultado=predicted_class,
+        confianza=Decimal(str(confidence)),
+        es_correcto=None,
+        modelo_usado=modelo_usado[:MODEL_VERSION_MAX_LENGTH],
+    )
+    db.add(clasificacion)
+    db.commit()
+    db.refresh(clasificacion)
+    return imagen, clasificacion
+
+
+def _save_batch_clasificaciones(
+    db: Session, id_usuario: int, items: List[Dict[str, Any]]
+) -> List[int]:
+    """
+    Inserta en bloque las imágenes y clasificaciones de una subida múltiple
+    (un solo commit). Devuelve los id_clasificacion en el mismo orden.
+    """
+    ahora = datetime.now()
+    imagenes = [
+        db_models.Imagen(
+            id_usuario=id_usuario,
+            ruta_archivo=item["disk_path"],
+            hash_contenido=item["hash"],
+            tamano=item["size"],
+            formato=item["formato"],
+            estado="procesada",
+        )
+        for item in items
+    ]
+    db.add_all(imagenes)
+    db.flush()
+
+    clasificaciones = [
+        db_models.Clasificacion(
+            id_imagen=imagen.id_imagen,
+            resultado=item["predicted_class"],
+            confianza=Decimal(str(item["confidence"])),
+            es_correcto=None,
+            modelo_usado=item["version"][:MODEL_VERSION_MAX_LENGTH],
+            # Fijada aquí para no releer cada fila después del commit
+            fecha_clasificacion=ahora,
+        )
+        for imagen, item in zip(imagenes, items)
+    ]
+    db.add_all(clasificaciones)
+    db.flush()
+    ids = [c.id_clasificacion for c in clasificaciones]
+    db.commit()
+    return ids
+
+
+def _save_batch_reportes(db: Session, payloads: List[Dict[str, Any]]) -> None:
+    db.add_all(
+        [
+            db_models.Reporte(
+                id_clasificacion=payload["id"],
+                contenido=json.dumps(payload, ensure_ascii=False),
+                formato_reporte="pdf",
+            )
+            for payload in payloads
+        ]
+    )
+    db.commit()
+
+
+def _parse_batch_metadata(metadata: str, count: int) -> List[Dict[str, Any]]:
+    """
+    La metadata de una subida múltiple es una lista JSON (una entrada por
+    archivo, en el mismo orden) o un solo objeto que aplica a todos.
+    """
+    try:
+        parsed = json.loads(metadata)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Metadata inválida")
+    if isinstance(parsed, dict):
+        return [dict(parsed) for _ in range(count)]
+    if (
+        isinstance(parsed, list)
+        and len(parsed) == count
+        and all(isinstance(m, dict) for m in parsed)
+    ):
+        return parsed
+    raise HTTPException(
+        status_code=400,
+        detail="La metadata debe ser un objeto o una lista con una entrada por archivo",
+    )
 # ---------------------------------------------------------------
 
 
@@ -61,12 +279,20 @@ class AnalysisDetailResponse(BaseModel):
 async def upload_analysis(
     file: UploadFile = File(...),
     metadata: str = Form(...),
+    tiled: Optional[bool] = Form(None),
+    async_mode: Optional[bool] = Form(None),
     db: Session = Depends(get_db),
     current_user: db_models.Usuario = Depends(get_current_user),
 ):
     """
     Recibe archivo + metadata desde el front, ejecuta la IA, guarda en BD
-    y genera un reporte + PDF.
+    y genera el reporte (el PDF se renderiza al descargarlo).
+
+    Con `tiled=true` la imagen se clasifica por tiles solapados de 224x224
+    y el reporte incluye un mapa de calor de probabilidad de cobre.
+
+    Con `async_mode=true` solo se guarda la imagen y se encola el trabajo:
+    responde 202 con el id del trabajo, que se consulta en /jobs/{id}.
     """
     # 1) Parsear metadata (JSON)
     try:
@@ -76,138 +302,621 @@ async def upload_analysis(
     except Exception:
         raise HTTPException(status_code=400, detail="Metadata inválida")
 
-    # 2) Validar tipo de archivo
-    if file.content_type not in ("image/jpeg", "image/png"):
-        raise HTTPException(status_code=400, detail="Solo se aceptan PNG o JPEG")
+    use_tiles = settings.TILED_INFERENCE_DEFAULT if tiled is None else tiled
+    use_queue = settings.ANALYSIS_ASYNC_DEFAULT if async_mode is None else async_mode
+    heatmap = None
+
+    # 2) Ingesta por streaming: se valida el tipo real (magic bytes) y la
+    #    cabecera con los primeros bloques, y se hashea mientras se escribe.
+    #    Si se analiza aquí mismo, los bytes quedan en memoria para
+    #    decodificar sin releer el archivo
+    try:
+        upload = await ingest_upload(file, keep_bytes=not use_queue)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    disk_path, web_url = upload.path, upload.web_url
+    hash_imagen, tamano, formato = upload.hash, upload.size, upload.content_type
 
-    # 3) Guardar archivo en disco
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
-    ext = os.path.splitext(file.filename)[1].lower() or ".jpg"
-    unique_name = f"{uuid4().hex}{ext}"
-    disk_path = os.path.join(UPLOAD_DIR, unique_name)
-    web_url = f"/uploads/{unique_name}"
+    if use_queue:
+        # El archivo ya está en disco: el worker lo lee desde ahí
+        trabajo = await db_stage.run(
+            enqueue_job,
+            db,
+            current_user.id_usuario,
+            disk_path,
+            web_url,
+            tamano,
+            formato,
+            hash_imagen,
+            meta_dict,
+            use_tiles,
+        )
+        event_bus.publish(
+            current_user.id_usuario,
+            "job.queued",
+            {"jobId": trabajo.id_trabajo, "status": trabajo.estado, "filename": file.filename},
+        )
+        thumbnail_service.schedule(hash_imagen, disk_path)
+        return JSONResponse(
+            status_code=202,
+            content=JobAcceptedResponse(
+                jobId=trabajo.id_trabajo,
+                status=trabajo.estado,
+                statusUrl=f"{router.prefix}/jobs/{trabajo.id_trabajo}",
+            ).model_dump(),
+        )
 
-    with open(disk_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Caché (solo modo imagen completa): misma imagen + misma versión del
+    # modelo => sin inferencia. Si además es un reintento del mismo usuario
+    # con la misma metadata, se devuelve el análisis ya guardado sin crear
+    # filas nuevas.
+    model_version = copper_model.version
+    cached = None
+    use_cache = settings.PREDICTION_CACHE_ENABLED and not use_tiles
+    if use_cache:
+        cached = await db_stage.run(prediction_cache.get, hash_imagen, model_version)
+        if cached is not None and cached.id_clasificacion is not None:
+            existing = await db_stage.run(
+                _find_duplicate,
+                db,
+                cached.id_clasificacion,
+                current_user.id_usuario,
+                meta_dict,
+            )
+            if existing is not None:
+                prediction_cache.mark_deduplicated()
+                await discard_upload(db, upload)
+                return existing
 
-    # 4) Ejecutar IA
-    predicted_class, confidence = copper_model.predict(disk_path)
+    # 4) Ejecutar IA: se decodifica desde los bytes de la ingesta (sin
+    #    releer el archivo) en el pool de procesos; luego la red (se agrupa
+    #    con otras subidas concurrentes en un lote). Si falla, el archivo se
+    #    borra: no queda huérfano
+    embedding = None
+    decoded = False
+    error: Optional[Exception] = None
+    try:
+        if cached is not None:
+            predicted_class, confidence = cached.resultado, cached.confianza
+            used_version = model_version
+        elif use_tiles:
+            tiles, rows, cols = await decode_stage.run(
+                decode_tiles,
+                upload.data,
+                copper_model.img_width,
+                settings.TILED_OVERLAP,
+                settings.TILED_MAX_TILES,
+                copper_model.fast_decode,
+            )
+            decoded = True
+            (
+                predicted_class,
+                confidence,
+                heatmap,
+                used_version,
+                embedding,
+            ) = await copper_batcher.classify_tiles(
+                tiles, rows, cols, settings.TILED_MIN_COPPER_FRACTION
+            )
+        else:
+            processed_image = await decode_stage.run(
+                decode_image,
+                upload.data,
+                (copper_model.img_width, copper_model.img_height),
+                copper_model.fast_decode,
+            )
+            decoded = True
+            (
+                predicted_class,
+                confidence,
+                used_version,
+                embedding,
+            ) = await copper_batcher.classify(processed_image)
+    except QueueFullError:
+        await discard_upload(db, upload)
+        raise HTTPException(
+            status_code=503,
+            detail="Servicio de inferencia saturado, intente nuevamente",
+        )
+    except Exception as e:
+        print(f"❌ Error procesando {disk_path}: {e!r}")
+        predicted_class, confidence, error = None, None, e
     if predicted_class is None:
+        await discard_upload(db, upload)
+        if not decoded and isinstance(error, DECODE_ERRORS):
+            # La cabecera era válida pero el resto del archivo no
+            raise HTTPException(status_code=400, detail="La imagen está dañada o incompleta")
+        if isinstance(error, StageUnavailable):
+            raise HTTPException(
+                status_code=503,
+                detail="Servicio de procesamiento no disponible, intente nuevamente",
+            )
         raise HTTPException(
             status_code=500,
             detail="Error al procesar la imagen con el modelo",
         )
 
     # 5) Guardar imagen y clasificación en BD
-    tamano = os.path.getsize(disk_path)
+    imagen, clasificacion = await db_stage.run(
+        _save_clasificacion,
+        db,
+        current_user.id_usuario,
+        disk_path,
+        tamano,
+        formato,
+        hash_imagen,
+        predicted_class,
+        confidence,
+        used_version,
+    )
+    drift_monitor.record(used_version, meta_dict.get("location"), predicted_class, confidence)
+    thumbnail_service.schedule(hash_imagen, disk_path)
+    if use_cache and cached is None:
+        await db_stage.run(
+            prediction_cache.put,
+            hash_imagen,
+            used_version,
+            predicted_class,
+            confidence,
+            clasificacion.id_clasificacion,
+        )
+    # Embedding para /similar; con caché se reutiliza el del análisis original
+    if embedding is not None:
+        await io_stage.run(
+            embedding_store.add,
+            used_version,
+            [(clasificacion.id_clasificacion, current_user.id_usuario, embedding)],
+        )
+    elif cached is not None and cached.id_clasificacion is not None:
+        await io_stage.run(
+            embedding_store.add_from,
+            used_version,
+            cached.id_clasificacion,
+            clasificacion.id_clasificacion,
+            current_user.id_usuario,
+        )
 
-    imagen = db_models.Imagen(
-        id_usuario=current_user.id_usuario,
-        ruta_archivo=disk_path,
-        tamano=tamano,
-        formato=file.content_type,
-        estado="procesada",
+    # 6) Construir textos según metadata + resultado IA
+    detail_payload = build_detail_payload(
+        meta_dict,
+        predicted_class,
+        confidence,
+        clasificacion.id_clasificacion,
+        clasificacion.fecha_clasificacion,
+        web_url,
+        heatmap=heatmap,
     )
-    db.add(imagen)
-    db.commit()
-    db.refresh(imagen)
 
-    clasificacion = db_models.Clasificacion(
-        id_imagen=imagen.id_imagen,
-        resultado=predicted_class,
-        confianza=Decimal(str(confidence)),
-        es_correcto=None,
-        modelo_usado="CNN",
+    # 7) Guardar el reporte; el PDF se renderiza al descargarse
+    #    (app.services.report_cache)
+    await db_stage.run(
+        save_reporte, db, clasificacion.id_clasificacion, detail_payload
     )
-    db.add(clasificacion)
-    db.commit()
-    db.refresh(clasificacion)
+    report_renderer.schedule(detail_payload)
 
-    # 6) Construir textos según metadata + resultado IA
-    category = str(meta_dict.get("category") or "No especificada")
-    risk_level = str(meta_dict.get("riskLevel") or "No especificado")
-    zone = str(meta_dict.get("location") or "Zona no especificada")
-    gps = str(meta_dict.get("coordinates") or "")
-    responsable = str(meta_dict.get("responsible") or "")
-    personal = meta_dict.get("personnel")
-
-    conf_pct = round(confidence * 100, 2)
-    hay_cobre = predicted_class == "con_cobre"
-
-    if hay_cobre:
-        copper_grade_text = f"Presencia de cobre detectada ({conf_pct} % de confianza)"
-        ai_summary = (
-            f"Se detecta PRESENCIA de vetas de cobre en la imagen con una "
-            f"confianza de {conf_pct}%. Zona: {zone}. Nivel de riesgo declarado: {risk_level}. "
-            f"Responsable del registro: {responsable or 'N/D'}. "
-            f"Personal involucrado: {personal or 'N/D'}."
-        )
-        recommendations = [
-            "Derivar el registro al área de geología para evaluación detallada.",
-            "Actualizar el modelo geológico de la zona con esta evidencia.",
-            "Priorizar esta zona en el plan de explotación según los lineamientos de la faena.",
-        ]
-        status = "con_cobre"
-    else:
-        copper_grade_text = f"Sin evidencia significativa de cobre ({conf_pct} % de confianza)"
-        ai_summary = (
-            f"No se detecta presencia significativa de vetas de cobre en la imagen "
-            f"(confianza {conf_pct}%). Zona: {zone}. Nivel de riesgo declarado: {risk_level}. "
-            f"Responsable del registro: {responsable or 'N/D'}. "
-            f"Personal involucrado: {personal or 'N/D'}."
-        )
-        recommendations = [
-            "Archivar el registro como caso sin presencia de cobre.",
-            "Utilizar esta imagen como ejemplo negativo para seguir entrenando el modelo.",
+    event_bus.publish(
+        current_user.id_usuario, "analysis.completed", analysis_event(detail_payload)
+    )
+    return AnalysisDetailResponse(
+        **detail_payload, thumbnailUrl=thumbnail_service.url_for(hash_imagen, "md")
+    )
+
+
+@router.post("/upload-batch", response_model=BatchUploadResponse)
+async def upload_analysis_batch(
+    files: List[UploadFile] = File(...),
+    metadata: str = Form("{}"),
+    db: Session = Depends(get_db),
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """
+    Subida múltiple (p. ej. las fotos de un turno). Decodifica los archivos
+    en paralelo, los clasifica en lotes llenos del modelo, inserta todas las
+    filas en bloque y devuelve un resultado por archivo, en el mismo orden.
+    """
+    started = time.perf_counter()
+    batch_id = uuid4().hex
+    if not files:
+        raise HTTPException(status_code=400, detail="No se enviaron archivos")
+    if len(files) > settings.BATCH_UPLOAD_MAX_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {settings.BATCH_UPLOAD_MAX_FILES} archivos por subida",
+        )
+    metas = _parse_batch_metadata(metadata, len(files))
+
+    results: List[Optional[BatchItemResponse]] = [None] * len(files)
+
+    def fail(item: Dict[str, Any], error: str) -> None:
+        results[item["index"]] = BatchItemResponse(
+            filename=item["filename"], ok=False, error=error
+        )
+
+    # 1) Ingerir cada archivo por streaming (validación de tipo y cabecera,
+    #    hash y escritura en disco a la vez); un archivo inválido solo falla
+    #    su propia entrada
+    items: List[Dict[str, Any]] = []
+    for index, file in enumerate(files):
+        item = {"index": index, "filename": file.filename or f"archivo_{index}"}
+        try:
+            upload = await ingest_upload(file)
+        except UploadRejected as e:
+            fail(item, e.detail)
+            continue
+        item.update(
+            upload=upload,
+            hash=upload.hash,
+            size=upload.size,
+            formato=upload.content_type,
+            meta=metas[index],
+            disk_path=upload.path,
+            web_url=upload.web_url,
+        )
+        items.append(item)
+
+    # 2) Caché (una consulta)
+    model_version = copper_model.version
+    cached = {}
+    if settings.PREDICTION_CACHE_ENABLED and items:
+        cached = await db_stage.run(
+            prediction_cache.get_many, [item["hash"] for item in items], model_version
+        )
+
+    # 3) Decodificar en paralelo solo las imágenes únicas sin caché y
+    #    clasificarlas juntas para que el modelo vea lotes completos
+    pending: Dict[str, Dict[str, Any]] = {}
+    for item in items:
+        if item["hash"] not in cached:
+            pending.setdefault(item["hash"], item)
+    decoded = await asyncio.gather(
+        *(
+            decode_stage.run(
+                decode_image,
+                item["disk_path"],
+                (copper_model.img_width, copper_model.img_height),
+                copper_model.fast_decode,
+            )
+            for item in pending.values()
+        ),
+        return_exceptions=True,
+    )
+    predictions: Dict[str, Any] = {}
+    valid = [
+        (hash_imagen, image)
+        for hash_imagen, image in zip(pending, decoded)
+        if not isinstance(image, BaseException)
+    ]
+    try:
+        classified = await copper_batcher.classify_many([image for _, image in valid])
+    except QueueFullError:
+        for item in items:
+            await discard_upload(db, item["upload"])
+        raise HTTPException(
+            status_code=503,
+            detail="Servicio de inferencia saturado, intente nuevamente",
+        )
+    except Exception as e:
+        # El fallo del modelo se reporta por archivo, no tumba la subida
+        print(f"❌ Error en la clasificación por lotes: {e}")
+        classified = []
+    for (hash_imagen, _), prediction in zip(valid, classified):
+        if prediction[0] is not None:
+            predictions[hash_imagen] = prediction
+    for hash_imagen, cached_prediction in cached.items():
+        predictions[hash_imagen] = (
+            cached_prediction.resultado,
+            cached_prediction.confianza,
+            model_version,
+            None,
+        )
+
+    # 4) Guardar en bloque las imágenes clasificadas; los archivos de las
+    #    que fallaron se borran
+    decode_errors = {
+        hash_imagen: image
+        for hash_imagen, image in zip(pending, decoded)
+        if isinstance(image, BaseException)
+    }
+    ok_items: List[Dict[str, Any]] = []
+    for item in items:
+        if item["hash"] not in predictions:
+            decode_error = decode_errors.get(item["hash"])
+            if isinstance(decode_error, DECODE_ERRORS):
+                fail(item, "La imagen está dañada o incompleta")
+            elif isinstance(decode_error, StageUnavailable):
+                fail(item, "Servicio de procesamiento no disponible, intente nuevamente")
+            else:
+                fail(item, "Error al procesar la imagen con el modelo")
+            await discard_upload(db, item["upload"])
+        else:
+            (
+                item["predicted_class"],
+                item["confidence"],
+                item["version"],
+                item["embedding"],
+            ) = predictions[item["hash"]]
+            ok_items.append(item)
+    event_bus.publish(
+        current_user.id_usuario,
+        "batch.progress",
+        {
+            "batchId": batch_id,
+            "stage": "clasificado",
+            "total": len(files),
+            "classified": len(ok_items),
+            "failed": len(files) - len(ok_items),
+        },
+    )
+
+    if ok_items:
+        ids = await db_stage.run(
+            _save_batch_clasificaciones, db, current_user.id_usuario, ok_items
+        )
+        for item in ok_items:
+            drift_monitor.record(
+                item["version"],
+                item["meta"].get("location"),
+                item["predicted_class"],
+                item["confidence"],
+            )
+            thumbnail_service.schedule(item["hash"], item["disk_path"])
+        if settings.PREDICTION_CACHE_ENABLED:
+            # Agrupadas por versión: un hot-swap puede caer a mitad del lote
+            new_entries: Dict[str, Dict[str, Any]] = {}
+            for item, id_clasificacion in zip(ok_items, ids):
+                if item["hash"] not in cached:
+                    new_entries.setdefault(item["version"], {}).setdefault(
+                        item["hash"],
+                        (item["hash"], item["predicted_class"], item["confidence"], id_clasificacion),
+                    )
+            for version, entries in new_entries.items():
+                await db_stage.run(
+                    prediction_cache.put_many, version, list(entries.values())
+                )
+
+        # Embeddings para /similar, también agrupados por versión
+        new_embeddings: Dict[str, List[Any]] = {}
+        for item, id_clasificacion in zip(ok_items, ids):
+            if item["embedding"] is not None:
+                new_embeddings.setdefault(item["version"], []).append(
+                    (id_clasificacion, current_user.id_usuario, item["embedding"])
+                )
+            elif item["hash"] in cached and cached[item["hash"]].id_clasificacion is not None:
+                await io_stage.run(
+                    embedding_store.add_from,
+                    item["version"],
+                    cached[item["hash"]].id_clasificacion,
+                    id_clasificacion,
+                    current_user.id_usuario,
+                )
+        for version, rows in new_embeddings.items():
+            await io_stage.run(embedding_store.add, version, rows)
+
+        # 5) Reportes (los PDFs se renderizan al descargarse)
+        ahora = datetime.now()
+        payloads = [
+            build_detail_payload(
+                item["meta"],
+                item["predicted_class"],
+                item["confidence"],
+                id_clasificacion,
+                ahora,
+                item["web_url"],
+            )
+            for item, id_clasificacion in zip(ok_items, ids)
         ]
-        status = "sin_cobre"
+        await db_stage.run(_save_batch_reportes, db, payloads)
+        for payload in payloads:
+            report_renderer.schedule(payload)
+
+        for item, payload in zip(ok_items, payloads):
+            results[item["index"]] = BatchItemResponse(
+                filename=item["filename"],
+                ok=True,
+                analysis=AnalysisDetailResponse(
+                    **payload, thumbnailUrl=thumbnail_service.url_for(item["hash"], "md")
+                ),
+            )
+            event_bus.publish(
+                current_user.id_usuario,
+                "analysis.completed",
+                {"batchId": batch_id, "filename": item["filename"], **analysis_event(payload)},
+            )
 
-    meta_out: Dict[str, Any] = dict(meta_dict)
-    meta_out.update(
+    seconds = time.perf_counter() - started
+    event_bus.publish(
+        current_user.id_usuario,
+        "batch.completed",
         {
-            "coordinates": gps,
-            "responsible": responsable,
-            "personnel": personal,
-            "modelo": "CopperCNN",
-            "confianza_porcentaje": conf_pct,
-        }
+            "batchId": batch_id,
+            "total": len(files),
+            "processed": len(ok_items),
+            "failed": len(files) - len(ok_items),
+        },
+    )
+    return BatchUploadResponse(
+        batchId=batch_id,
+        total=len(files),
+        processed=len(ok_items),
+        failed=len(files) - len(ok_items),
+        seconds=round(seconds, 3),
+        imagesPerSecond=round(len(ok_items) / seconds, 2) if seconds > 0 else 0.0,
+        results=results,
     )
 
-    detail_payload: Dict[str, Any] = {
-        "id": clasificacion.id_clasificacion,
-        "date": clasificacion.fecha_clasificacion.isoformat()
-        if clasificacion.fecha_clasificacion
-        else "",
-        "zone": zone,
-        "category": category,
-        "riskLevel": risk_level,
-        "copperGrade": copper_grade_text,
-        "aiSummary": ai_summary,
-        "recommendations": recommendations,
-        "metadata": meta_out,
-        "imageUrl": web_url,
-        "status": status,
-    }
 
-    # 7) Generar PDF + guardar en reportes
-    os.makedirs(REPORTS_DIR, exist_ok=True)
-    pdf_filename = f"reporte_{clasificacion.id_clasificacion}.pdf"
-    pdf_path = os.path.join(REPORTS_DIR, pdf_filename)
+def _sse_message(event: Dict[str, Any]) -> str:
+    data = json.dumps(event, ensure_ascii=False, default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
 
-    generate_pdf_report(detail_payload, pdf_path)
 
-    # Guardar ruta del PDF dentro del JSON
-    detail_payload["pdfPath"] = pdf_path
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    current_user: db_models.Usuario = Depends(get_current_user_stream),
+):
+    """
+    Canal Server-Sent Events con el progreso de los análisis del usuario
+    (subidas síncronas, por lote y trabajos en cola). Reemplaza el polling
+    de /history y /jobs/{id}: una conexión abierta por cliente.
+    """
+    subscription = event_bus.subscribe(current_user.id_usuario)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                event = await subscription.get(settings.EVENTS_KEEPALIVE_SECONDS)
+                if event is None:
+                    # Comentario SSE: mantiene viva la conexión en proxies
+                    yield ": ping\n\n"
+                else:
+                    yield _sse_message(event)
+        finally:
+            event_bus.unsubscribe(subscription)
 
-    reporte = db_models.Reporte(
-        id_clasificacion=clasificacion.id_clasificacion,
-        contenido=json.dumps(detail_payload, ensure_ascii=False),
-        formato_reporte="pdf",
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    db.add(reporte)
-    db.commit()
 
-    return AnalysisDetailResponse(**detail_payload)
+
+@router.get("/jobs/stats")
+async def get_jobs_stats(
+    db: Session = Depends(get_db),
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """Profundidad y antigüedad de la cola de trabajos y uso de los workers."""
+    return await db_stage.run(queue_stats, db)
+
+
+def _job_status(db: Session, job_id: int, id_usuario: int) -> Optional[JobStatusResponse]:
+    trabajo = (
+        db.query(db_models.Trabajo)
+        .filter(
+            db_models.Trabajo.id_trabajo == job_id,
+            db_models.Trabajo.id_usuario == id_usuario,
+        )
+        .first()
+    )
+    if trabajo is None:
+        return None
+
+    analysis = None
+    if trabajo.estado == "completado" and trabajo.id_clasificacion is not None:
+        clasif = db.get(db_models.Clasificacion, trabajo.id_clasificacion)
+        if clasif is not None:
+            analysis = _detail_from_row(clasif, trabajo.imagen, clasif.reporte)
+
+    return JobStatusResponse(
+        jobId=trabajo.id_trabajo,
+        status=trabajo.estado,
+        imageStatus=trabajo.imagen.estado,
+        attempts=trabajo.intentos,
+        queuePosition=queue_position(db, trabajo),
+        error=trabajo.error if trabajo.estado == "error" else None,
+        createdAt=trabajo.fecha_creacion.isoformat() if trabajo.fecha_creacion else None,
+        startedAt=trabajo.fecha_inicio.isoformat() if trabajo.fecha_inicio else None,
+        finishedAt=trabajo.fecha_fin.isoformat() if trabajo.fecha_fin else None,
+        analysisId=trabajo.id_clasificacion,
+        analysis=analysis,
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """Estado de un análisis encolado con `async_mode=true`."""
+    status = await db_stage.run(_job_status, db, job_id, current_user.id_usuario)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return status
+
+
+@router.get("/inference/stats")
+def get_inference_stats(
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """
+    Ocupación de los lotes de inferencia y de las etapas del pipeline,
+    para ajustar tamaños de lote, esperas y límites de concurrencia.
+    """
+    stats = copper_batcher.stats()
+    stats["stages"] = stages_stats()
+    stats["cache"] = prediction_cache.stats()
+    stats["events"] = event_bus.stats()
+    stats["embeddings"] = embedding_store.stats()
+    stats["explanations"] = explanation_service.stats()
+    stats["thumbnails"] = thumbnail_service.stats()
+    stats["reports"] = report_renderer.stats()
+    return stats
+
+
+@router.get("/export")
+async def export_reports(
+    request: Request,
+    format: str = Query("zip", pattern="^(zip|pdf)$"),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None),
+    zone: Optional[str] = Query(None),
+    status: Optional[str] = Query(None, pattern="^(con_cobre|sin_cobre)$"),
+    all_users: bool = Query(False),
+    db: Session = Depends(get_db),
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """
+    Exporta los reportes que cumplen el filtro como un ZIP de PDFs
+    (`format=zip`) o un solo PDF unido (`format=pdf`). La descarga admite
+    Range/If-Range para reanudarse. Con `all_users=true` (solo los cargos
+    de EXPORT_ALL_USERS_CARGOS) incluye los análisis de todos los usuarios.
+    """
+    if all_users and (current_user.cargo or "").strip().lower() not in settings.EXPORT_ALL_USERS_CARGOS:
+        raise HTTPException(status_code=403, detail="No puede exportar análisis de otros usuarios")
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from es posterior a date_to")
+    filters = ExportFilter(
+        id_usuario=None if all_users else current_user.id_usuario,
+        date_from=date_from,
+        date_to=date_to,
+        zone=zone.strip() if zone and zone.strip() else None,
+        status=status,
+    )
+    period = "_".join(d.isoformat() for d in (date_from, date_to) if d) or "todos"
+    try:
+        if format == "zip":
+            resume_etag = request.headers.get("if-range") if "range" in request.headers else None
+            layout = await prepare_zip(db, filters, resume_etag)
+        else:
+            merged = await prepare_merged(db, filters)
+    except ExportTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    if format == "zip":
+        if layout is None:
+            raise HTTPException(status_code=404, detail="No hay reportes para el filtro")
+        return virtual_file_response(
+            request,
+            layout.size,
+            layout.read_range,
+            "application/zip",
+            layout.etag,
+            filename=f"reportes_{period}.zip",
+        )
+    if merged is None:
+        raise HTTPException(status_code=404, detail="No hay reportes para el filtro")
+    path, etag = merged
+    return cached_file_response(
+        request,
+        path,
+        "application/pdf",
+        etag,
+        cache_control="private, no-cache",
+        filename=f"reportes_{period}.pdf",
+    )
 
 
 @router.get("/history", response_model=List[AnalysisSummaryResponse])
@@ -264,22 +973,15 @@ def get_history(
                     if clasif.resultado == "con_cobre"
                     else "sin_cobre",
                 ),
+                thumbnailUrl=thumbnail_service.url_for(imagen.hash_contenido, "sm"),
             )
         )
 
     return items
 
 
-@router.get("/{clasificacion_id}", response_model=AnalysisDetailResponse)
-def get_analysis_detail(
-    clasificacion_id: int,
-    db: Session = Depends(get_db),
-    current_user: db_models.Usuario = Depends(get_current_user),
-):
-    """
-    Devuelve el detalle completo de un análisis (para AnalysisDetailPage).
-    """
-    row = (
+def _query_user_analysis(db: Session, clasificacion_id: int, id_usuario: int):
+    return (
         db.query(db_models.Clasificacion, db_models.Imagen, db_models.Reporte)
         .join(
             db_models.Imagen,
@@ -292,21 +994,23 @@ def get_analysis_detail(
         )
         .filter(
             db_models.Clasificacion.id_clasificacion == clasificacion_id,
-            db_models.Imagen.id_usuario == current_user.id_usuario,
+            db_models.Imagen.id_usuario == id_usuario,
         )
         .first()
     )
 
-    if not row:
-        raise HTTPException(status_code=404, detail="Análisis no encontrado")
 
-    clasif, imagen, reporte = row
-    payload: Dict[str, Any] = {}
+def _load_payload(reporte) -> Dict[str, Any]:
     if reporte and reporte.contenido:
         try:
-            payload = json.loads(reporte.contenido)
+            return json.loads(reporte.contenido)
         except Exception:
-            payload = {}
+            return {}
+    return {}
+
+
+def _detail_from_row(clasif, imagen, reporte) -> AnalysisDetailResponse:
+    payload = _load_payload(reporte)
 
     date = payload.get(
         "date",
@@ -326,9 +1030,12 @@ def get_analysis_detail(
         "con_cobre" if clasif.resultado == "con_cobre" else "sin_cobre",
     )
 
-    image_url = payload.get(
-        "imageUrl",
-        f"/uploads/{os.path.basename(imagen.ruta_archivo)}" if imagen else "",
+    # Desde la ruta actual: migrate (app.services.storage) puede haber
+    # movido el archivo después de guardar el reporte
+    image_url = (
+        upload_store.url_for(imagen.ruta_archivo)
+        if imagen
+        else payload.get("imageUrl", "")
     )
 
     return AnalysisDetailResponse(
@@ -343,19 +1050,188 @@ def get_analysis_detail(
         metadata=metadata,
         imageUrl=image_url,
         status=status,
+        heatmap=payload.get("heatmap"),
+        explanationUrl=(
+            explanation_service.url_for(imagen.hash_contenido, clasif.modelo_usado)
+            if imagen
+            else None
+        ),
+        thumbnailUrl=(
+            thumbnail_service.url_for(imagen.hash_contenido, "md") if imagen else None
+        ),
     )
 
 
-@router.get("/{clasificacion_id}/pdf")
-def download_pdf(
+def _find_duplicate(
+    db: Session, clasificacion_id: int, id_usuario: int, meta_dict: Dict[str, Any]
+):
+    """
+    Análisis ya existente del mismo usuario para la misma imagen y la misma
+    metadata (reintentos / re-subidas). Devuelve None si no aplica.
+    """
+    row = _query_user_analysis(db, clasificacion_id, id_usuario)
+    if not row or row[2] is None:
+        return None
+    stored_meta = _load_payload(row[2]).get("metadata") or {}
+    if any(stored_meta.get(k) != v for k, v in meta_dict.items()):
+        return None
+    return _detail_from_row(*row)
+
+
+@router.get("/{clasificacion_id}", response_model=AnalysisDetailResponse)
+def get_analysis_detail(
     clasificacion_id: int,
     db: Session = Depends(get_db),
     current_user: db_models.Usuario = Depends(get_current_user),
 ):
     """
-    Devuelve el PDF del reporte asociado a una clasificación.
+    Devuelve el detalle completo de un análisis (para AnalysisDetailPage).
+    """
+    row = _query_user_analysis(db, clasificacion_id, current_user.id_usuario)
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Análisis no encontrado")
+
+    return _detail_from_row(*row)
+
+
+@router.get("/{clasificacion_id}/similar", response_model=SimilarAnalysesResponse)
+def get_similar_analyses(
+    clasificacion_id: int,
+    k: int = Query(10, ge=1),
+    db: Session = Depends(get_db),
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """
+    Los `k` análisis del usuario más parecidos a uno dado, por similitud
+    coseno de los embeddings del modelo (solo entre análisis hechos con la
+    misma versión del modelo).
+    """
+    row = _query_user_analysis(db, clasificacion_id, current_user.id_usuario)
+    if not row:
+        raise HTTPException(status_code=404, detail="Análisis no encontrado")
+    version = row[0].modelo_usado
+
+    started = time.perf_counter()
+    matches = embedding_store.similar(
+        version,
+        clasificacion_id,
+        min(k, settings.SIMILAR_MAX_K),
+        user=current_user.id_usuario,
+    )
+    search_ms = (time.perf_counter() - started) * 1000.0
+    if matches is None:
+        raise HTTPException(
+            status_code=404, detail="El análisis no tiene embedding para buscar similares"
+        )
+
+    similarity = dict(matches)
+    rows = (
+        db.query(db_models.Clasificacion, db_models.Imagen, db_models.Reporte)
+        .join(
+            db_models.Imagen,
+            db_models.Clasificacion.id_imagen == db_models.Imagen.id_imagen,
+        )
+        .outerjoin(
+            db_models.Reporte,
+            db_models.Reporte.id_clasificacion
+            == db_models.Clasificacion.id_clasificacion,
+        )
+        .filter(
+            db_models.Clasificacion.id_clasificacion.in_(list(similarity)),
+            db_models.Imagen.id_usuario == current_user.id_usuario,
+        )
+        .all()
+    )
+    details = {row[0].id_clasificacion: _detail_from_row(*row) for row in rows}
+    imagen_hashes = {row[0].id_clasificacion: row[1].hash_contenido for row in rows}
+
+    results = []
+    for id_clasificacion, score in matches:
+        detail = details.get(id_clasificacion)
+        if detail is None:
+            # Borrado después de guardar el embedding
+            continue
+        results.append(
+            SimilarAnalysisResponse(
+                id=detail.id,
+                similarity=round(score, 4),
+                date=detail.date,
+                zone=detail.zone,
+                category=detail.category,
+                copperGrade=detail.copperGrade,
+                status=detail.status,
+                imageUrl=detail.imageUrl,
+                thumbnailUrl=(
+                    thumbnail_service.url_for(imagen_hashes.get(detail.id), "sm")
+                ),
+            )
+        )
+    return SimilarAnalysesResponse(
+        id=clasificacion_id,
+        modelVersion=version,
+        searchMs=round(search_ms, 3),
+        results=results,
+    )
+
+
+@router.get("/{clasificacion_id}/explanation", response_model=ExplanationResponse)
+async def get_explanation(
+    clasificacion_id: int,
+    db: Session = Depends(get_db),
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """
+    Mapa Grad-CAM del análisis superpuesto a la foto. Si todavía no existe
+    se encola (se calcula por lotes en segundo plano) y responde 202: volver
+    a consultar hasta que `status` sea "listo".
     """
-    row = (
+    if not settings.EXPLANATIONS_ENABLED:
+        raise HTTPException(status_code=404, detail="Explicaciones desactivadas")
+    row = await db_stage.run(
+        _query_user_analysis, db, clasificacion_id, current_user.id_usuario
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Análisis no encontrado")
+    clasif, imagen, reporte = row
+
+    hash_imagen = imagen.hash_contenido
+    if not hash_imagen:
+        try:
+            hash_imagen = await io_stage.run(_hash_file, imagen.ruta_archivo)
+        except OSError:
+            raise HTTPException(status_code=404, detail="Imagen no disponible")
+
+    found = await io_stage.run(explanation_service.find, hash_imagen, clasif.modelo_usado)
+    if found is not None:
+        version, path = found
+        if settings.EXPLANATIONS_IN_PDF and _load_payload(reporte).get("explanationPath") != path:
+            await db_stage.run(embed_in_report, clasif.id_clasificacion, path)
+        return ExplanationResponse(
+            id=clasificacion_id,
+            status="listo",
+            url=explanation_service.url(version, hash_imagen),
+            modelVersion=version,
+        )
+
+    error = explanation_service.error(hash_imagen)
+    if error is not None:
+        return ExplanationResponse(id=clasificacion_id, status="error", error=error)
+    try:
+        explanation_service.request(hash_imagen, imagen.ruta_archivo, clasif.id_clasificacion)
+    except QueueFullError:
+        raise HTTPException(
+            status_code=503,
+            detail="Cola de explicaciones llena, intente nuevamente",
+        )
+    return JSONResponse(
+        status_code=202,
+        content=ExplanationResponse(id=clasificacion_id, status="pendiente").model_dump(),
+    )
+
+
+def _query_report(db: Session, clasificacion_id: int, id_usuario: int):
+    return (
         db.query(db_models.Reporte, db_models.Clasificacion, db_models.Imagen)
         .join(
             db_models.Clasificacion,
@@ -368,29 +1244,48 @@ def download_pdf(
         )
         .filter(
             db_models.Clasificacion.id_clasificacion == clasificacion_id,
-            db_models.Imagen.id_usuario == current_user.id_usuario,
+            db_models.Imagen.id_usuario == id_usuario,
         )
         .first()
     )
 
+
+@router.get("/{clasificacion_id}/pdf")
+async def download_pdf(
+    clasificacion_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """
+    Devuelve el PDF del reporte asociado a una clasificación.
+    """
+    row = await db_stage.run(_query_report, db, clasificacion_id, current_user.id_usuario)
     if not row:
         raise HTTPException(status_code=404, detail="Reporte no encontrado")
 
-    reporte, clasif, imagen = row
-    payload = {}
-    if reporte.contenido:
-        try:
-            payload = json.loads(reporte.contenido)
-        except Exception:
-            payload = {}
-
-    pdf_path = payload.get("pdfPath")
-    if not pdf_path or not os.path.exists(pdf_path):
+    payload = _load_payload(row[0])
+    if not payload:
         raise HTTPException(status_code=404, detail="PDF no disponible")
 
-    filename = os.path.basename(pdf_path)
-    return FileResponse(
+    # Desde la caché de renderizado: si falta (nunca se pidió, se borró o
+    # cambió la plantilla) se renderiza ahora desde el JSON del reporte.
+    # Con el ETag vigente en If-None-Match se responde 304 sin renderizar
+    etag = f'"{render_key(payload)}"'
+    if request.headers.get("if-none-match") == etag:
+        pdf_path = cache_path(payload)
+    else:
+        try:
+            pdf_path = await report_renderer.ensure(payload)
+        except Exception as e:
+            print(f"❌ Error generando el PDF del análisis {clasificacion_id}: {e}")
+            raise HTTPException(status_code=500, detail="No se pudo generar el PDF")
+
+    return cached_file_response(
+        request,
         pdf_path,
-        media_type="application/pdf",
-        filename=filename,
+        "application/pdf",
+        etag,
+        cache_control="private, no-cache",
+        filename=f"reporte_{clasificacion_id}.pdf",
     )
@@ -0,0 +1,95 @@
+# app/api/media.py
+"""
+Imágenes subidas y sus miniaturas, con caché HTTP.
+
+Los originales del almacén por contenido (/uploads/ab/cd/<sha256>.jpg) y
+las miniaturas (/thumbnails/<tamaño>/<sha256>.webp) no cambian nunca para
+una misma URL: se sirven con ETag fuerte, Cache-Control inmutable de un
+año y soporte de Range. Los archivos planos anteriores a la migración los
+sigue sirviendo el StaticFiles montado en /uploads.
+"""
+import os
+import re
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+
+from app.core.executors import db_stage
+from app.core.http_files import cached_file_response
+from app.db import models as db_models
+from app.db.mysql_connection import get_db
+from app.services.storage import URL_PREFIX as UPLOADS_URL_PREFIX
+from app.services.storage import upload_store
+from app.services.thumbnails import URL_PREFIX as THUMBNAILS_URL_PREFIX
+from app.services.thumbnails import thumbnail_service
+
+router = APIRouter(tags=["media"])
+
+HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+ORIGINAL_MEDIA_TYPES = {".jpg": "image/jpeg", ".png": "image/png"}
+
+
+def _legacy_source(db: Session, hash_imagen: str) -> Optional[str]:
+    """Original todavía en el layout plano (sin migrar), buscado por hash."""
+    rows = (
+        db.query(db_models.Imagen.ruta_archivo)
+        .filter(db_models.Imagen.hash_contenido == hash_imagen)
+        .limit(5)
+        .all()
+    )
+    return next((path for (path,) in rows if os.path.exists(path)), None)
+
+
+@router.get(UPLOADS_URL_PREFIX + "/{shard1}/{shard2}/{name}")
+def get_upload(shard1: str, shard2: str, name: str, request: Request):
+    hash_imagen, ext = os.path.splitext(name)
+    if (
+        not HASH_RE.match(hash_imagen)
+        or shard1 != hash_imagen[:2]
+        or shard2 != hash_imagen[2:4]
+        or ext not in ORIGINAL_MEDIA_TYPES
+    ):
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    path = upload_store.path_for(hash_imagen, ext)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    return cached_file_response(
+        request, path, ORIGINAL_MEDIA_TYPES[ext], f'"{hash_imagen}"'
+    )
+
+
+@router.get(THUMBNAILS_URL_PREFIX + "/{size}/{name}")
+async def get_thumbnail(
+    size: str,
+    name: str,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    """
+    Miniatura de una imagen por hash de contenido; se genera la primera vez
+    que se pide si no se generó al subirla.
+    """
+    hash_imagen, _, ext = name.partition(".")
+    if (
+        size not in thumbnail_service.sizes
+        or not HASH_RE.match(hash_imagen)
+        or ext != thumbnail_service.format
+    ):
+        raise HTTPException(status_code=404, detail="Miniatura no encontrada")
+
+    path = thumbnail_service.path_for(hash_imagen, size)
+    etag = thumbnail_service.etag(hash_imagen, size)
+    if not os.path.exists(path) and request.headers.get("if-none-match") != etag:
+        source = thumbnail_service.source_for(hash_imagen) or await db_stage.run(
+            _legacy_source, db, hash_imagen
+        )
+        if source is None:
+            raise HTTPException(status_code=404, detail="Miniatura no encontrada")
+        try:
+            await thumbnail_service.ensure(hash_imagen, source, [size])
+        except Exception as e:
+            print(f"❌ Error generando la miniatura de {source}: {e}")
+            raise HTTPException(status_code=500, detail="No se pudo generar la miniatura")
+
+    return cached_file_response(request, path, thumbnail_service.media_type, etag)
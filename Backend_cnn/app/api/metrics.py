@@ -0,0 +1,139 @@
+# app/api/metrics.py
+import hmac
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from app.core.config import settings
+from app.core.events import event_bus
+from app.core.executors import STAGES
+from app.core.metrics import metrics_registry
+from app.db.mysql_connection import engine
+from app.ml.inference.batcher import copper_batcher
+from app.ml.inference.cache import prediction_cache
+from app.ml.models.cnn_model import copper_model
+
+router = APIRouter(tags=["metrics"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --------- Collectors (estado que ya llevan otros módulos) ---------
+
+def _collect_cache():
+    stats = prediction_cache.stats()
+    yield (
+        "mineria_prediction_cache_lookups_total",
+        "counter",
+        "Búsquedas en la caché de predicciones por resultado",
+        [
+            ({"result": "hit_memory"}, stats["hits_memory"]),
+            ({"result": "hit_db"}, stats["hits_db"]),
+            ({"result": "miss"}, stats["misses"]),
+        ],
+    )
+    yield (
+        "mineria_prediction_cache_evictions_total",
+        "counter",
+        "Entradas expulsadas de la caché en memoria",
+        [({}, stats["evictions"])],
+    )
+    yield (
+        "mineria_prediction_cache_deduplicated_total",
+        "counter",
+        "Subidas repetidas resueltas con el análisis ya guardado",
+        [({}, stats["deduplicated"])],
+    )
+    yield (
+        "mineria_prediction_cache_entries",
+        "gauge",
+        "Entradas en la caché en memoria",
+        [({}, stats["size"])],
+    )
+
+
+def _collect_db_pool():
+    pool = engine.pool
+    samples = []
+    for state, method in (
+        ("checked_out", "checkedout"),
+        ("checked_in", "checkedin"),
+        ("overflow", "overflow"),
+    ):
+        if hasattr(pool, method):
+            # overflow() es negativo mientras el pool no se llena
+            samples.append(({"state": state}, max(0, getattr(pool, method)())))
+    yield ("mineria_db_pool_connections", "gauge", "Conexiones del pool de SQLAlchemy", samples)
+    if hasattr(pool, "size"):
+        yield ("mineria_db_pool_size", "gauge", "Tamaño configurado del pool", [({}, pool.size())])
+
+
+def _collect_runtime():
+    yield (
+        "mineria_stage_in_flight",
+        "gauge",
+        "Tareas en vuelo por etapa del pipeline",
+        [({"stage": stage.name}, stage.stats()["in_flight"]) for stage in STAGES],
+    )
+    yield (
+        "mineria_stage_concurrency",
+        "gauge",
+        "Cupo de concurrencia por etapa del pipeline",
+        [({"stage": stage.name}, stage.concurrency) for stage in STAGES],
+    )
+    yield (
+        "mineria_inference_queued",
+        "gauge",
+        "Imágenes esperando en la cola del micro-batcher",
+        [({}, copper_batcher.stats()["queued"])],
+    )
+    status = copper_model.status()
+    yield (
+        "mineria_model_info",
+        "gauge",
+        "Versión y motor del modelo en servicio (valor 1 si está listo)",
+        [
+            (
+                {"version": status["version"] or "", "backend": status["backend"]},
+                1 if status["ready"] else 0,
+            )
+        ],
+    )
+    yield (
+        "mineria_model_swaps_total",
+        "counter",
+        "Cambios de versión en caliente",
+        [({}, status["swaps"])],
+    )
+    events = event_bus.stats()
+    yield (
+        "mineria_event_subscriptions",
+        "gauge",
+        "Conexiones SSE abiertas",
+        [({}, events["subscriptions"])],
+    )
+    yield (
+        "mineria_events_published_total",
+        "counter",
+        "Eventos de análisis publicados",
+        [({}, events["published"])],
+    )
+
+
+metrics_registry.add_collector(_collect_cache)
+metrics_registry.add_collector(_collect_db_pool)
+metrics_registry.add_collector(_collect_runtime)
+
+
+# --------- Endpoint ---------
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics(request: Request):
+    """Métricas en formato de texto de Prometheus."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.headers.get("authorization", ""), expected):
+            raise HTTPException(status_code=401, detail="No autorizado")
+    return PlainTextResponse(metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,142 @@
+# app/api/models.py
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.executors import db_stage
+from app.core.security import get_current_user
+from app.db.mysql_connection import get_db
+from app.db import models as db_models
+from app.ml.inference.drift import drift_monitor
+from app.ml.inference.shadow import shadow_report, shadow_runner
+from app.ml.models.cnn_model import copper_model
+from app.ml.models.registry import model_registry
+
+router = APIRouter(prefix="/api/models", tags=["models"])
+
+
+# --------- Schemas ---------
+
+class ShadowRequest(BaseModel):
+    version: str
+    sampleRate: float = Field(settings.MODEL_SHADOW_SAMPLE_RATE, ge=0.0, le=1.0)
+
+
+class ModelsResponse(BaseModel):
+    serving: Dict[str, Any]
+    active: Optional[str] = None
+    shadow: Optional[Dict[str, Any]] = None
+    versions: List[Dict[str, Any]]
+
+
+def get_model_admin(
+    current_user: db_models.Usuario = Depends(get_current_user),
+) -> db_models.Usuario:
+    if (current_user.cargo or "").strip().lower() not in settings.MODEL_ADMIN_CARGOS:
+        raise HTTPException(status_code=403, detail="Requiere rol de administrador")
+    return current_user
+
+
+def _models_state() -> ModelsResponse:
+    active = model_registry.active()
+    shadow = model_registry.shadow()
+    return ModelsResponse(
+        serving=copper_model.status(),
+        active=active["version"] if active else None,
+        shadow={
+            "version": shadow["meta"]["version"],
+            "sampleRate": shadow["sample_rate"],
+            "live": shadow_runner.stats(),
+        }
+        if shadow
+        else None,
+        versions=model_registry.list_versions(),
+    )
+
+
+# --------- Endpoints ---------
+
+@router.get("", response_model=ModelsResponse)
+def list_models(current_user: db_models.Usuario = Depends(get_current_user)):
+    """Versiones registradas, la que se está sirviendo y la que corre en sombra."""
+    return _models_state()
+
+
+@router.post("/{version}/activate", response_model=ModelsResponse)
+async def activate_model(
+    version: str,
+    current_user: db_models.Usuario = Depends(get_model_admin),
+):
+    """
+    Activa una versión: se escribe el puntero del registro (los demás
+    procesos lo aplican al verlo cambiar) y este proceso hace el hot-swap
+    antes de responder.
+    """
+    try:
+        model_registry.activate(version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not await asyncio.to_thread(copper_model.sync_with_registry):
+        raise HTTPException(
+            status_code=500,
+            detail=f"No se pudo cargar la versión {version}: {copper_model.last_error}",
+        )
+    return _models_state()
+
+
+@router.put("/shadow", response_model=ModelsResponse)
+async def set_shadow_model(
+    body: ShadowRequest,
+    current_user: db_models.Usuario = Depends(get_model_admin),
+):
+    """Ejecuta `version` en sombra sobre una fracción muestreada del tráfico."""
+    try:
+        model_registry.set_shadow(body.version, body.sampleRate)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    await asyncio.to_thread(shadow_runner.sync_with_registry)
+    return _models_state()
+
+
+@router.delete("/shadow", response_model=ModelsResponse)
+async def clear_shadow_model(
+    current_user: db_models.Usuario = Depends(get_model_admin),
+):
+    model_registry.set_shadow(None)
+    await asyncio.to_thread(shadow_runner.sync_with_registry)
+    return _models_state()
+
+
+@router.get("/shadow/report")
+async def get_shadow_report(
+    db: Session = Depends(get_db),
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """Concordancia, diferencia de probabilidad y latencia por par de versiones."""
+    return {
+        "live": shadow_runner.stats(),
+        "comparisons": await db_stage.run(shadow_report, db),
+    }
+
+
+@router.get("/drift")
+async def get_drift_report(
+    version: Optional[str] = None,
+    zone: Optional[str] = None,
+    hours: float = Query(24, gt=0),
+    db: Session = Depends(get_db),
+    current_user: db_models.Usuario = Depends(get_current_user),
+):
+    """
+    Distribución de confianza y balance de clases por zona en las últimas
+    `hours` horas, con el PSI frente a la distribución de validación. Con
+    `zone` incluye la serie por ventana (para ubicar cuándo cambió).
+    """
+    hours = min(hours, settings.DRIFT_RETENTION_DAYS * 24)
+    return await db_stage.run(
+        drift_monitor.report, db, version or copper_model.version, zone, hours
+    )
@@ -18,4 +18,244 @@ class Settings:
         os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
     )
 
+    # Modelo CNN: carga anticipada y warm-up al arrancar
+    MODEL_PATH: str = os.getenv("MODEL_PATH", "model_data/model_copper_fixed.h5")
+    MODEL_EAGER_LOAD: bool = os.getenv("MODEL_EAGER_LOAD", "true").lower() == "true"
+    MODEL_WARMUP_RUNS: int = int(os.getenv("MODEL_WARMUP_RUNS", "2"))
+    # Motor de inferencia: "keras", "tflite" u "onnx". Sin ruta explícita se
+    # usa el archivo exportado junto a MODEL_PATH (.tflite / .onnx).
+    INFERENCE_BACKEND: str = os.getenv("INFERENCE_BACKEND", "keras").lower()
+    INFERENCE_BACKEND_MODEL_PATH: str | None = (
+        os.getenv("INFERENCE_BACKEND_MODEL_PATH") or None
+    )
+    # "local": cada proceso carga su modelo. "remote": un solo proceso
+    # (python -m app.ml.inference.model_server) lo carga y los workers de la
+    # API y de la cola le piden inferencias por un socket Unix, sin importar
+    # TensorFlow
+    INFERENCE_MODE: str = os.getenv("INFERENCE_MODE", "local").lower()
+    MODEL_SERVER_SOCKET: str = os.getenv("MODEL_SERVER_SOCKET", "/tmp/mineria-model.sock")
+    MODEL_SERVER_TIMEOUT: float = float(os.getenv("MODEL_SERVER_TIMEOUT", "30"))
+    # Caída máxima de exactitud aceptada al elegir una variante cuantizada
+    QUANTIZATION_ACCURACY_TOLERANCE: float = float(
+        os.getenv("QUANTIZATION_ACCURACY_TOLERANCE", "0.01")
+    )
+
+    # Registro de versiones del modelo (hot-swap y modo sombra)
+    MODEL_REGISTRY_DIR: str = os.getenv("MODEL_REGISTRY_DIR", "model_data/registry")
+    MODEL_REGISTRY_WATCH_SECONDS: float = float(
+        os.getenv("MODEL_REGISTRY_WATCH_SECONDS", "5")
+    )
+    MODEL_SHADOW_SAMPLE_RATE: float = float(os.getenv("MODEL_SHADOW_SAMPLE_RATE", "0.05"))
+    MODEL_SHADOW_QUEUE: int = int(os.getenv("MODEL_SHADOW_QUEUE", "32"))
+    MODEL_SHADOW_THREADS: int = int(os.getenv("MODEL_SHADOW_THREADS", "1"))
+    # Cargos (Usuario.cargo) que pueden activar versiones y el modo sombra
+    MODEL_ADMIN_CARGOS: list[str] = [
+        c.strip().lower()
+        for c in os.getenv("MODEL_ADMIN_CARGOS", "admin").split(",")
+        if c.strip()
+    ]
+
+    # Preprocesamiento: decodificación JPEG reducida (draft) cerca de 224x224
+    PREPROCESS_FAST_DECODE: bool = (
+        os.getenv("PREPROCESS_FAST_DECODE", "true").lower() == "true"
+    )
+
+    # Inferencia por tiles para fotos de alta resolución (mapa de calor)
+    TILED_INFERENCE_DEFAULT: bool = (
+        os.getenv("TILED_INFERENCE_DEFAULT", "false").lower() == "true"
+    )
+    TILED_MAX_TILES: int = int(os.getenv("TILED_MAX_TILES", "48"))
+    TILED_OVERLAP: float = float(os.getenv("TILED_OVERLAP", "0.25"))
+    # Fracción mínima de tiles con cobre para declarar la imagen "con_cobre"
+    TILED_MIN_COPPER_FRACTION: float = float(
+        os.getenv("TILED_MIN_COPPER_FRACTION", "0.05")
+    )
+
+    # Micro-batching de inferencia (CopperCNN)
+    INFERENCE_BATCHING_ENABLED: bool = (
+        os.getenv("INFERENCE_BATCHING_ENABLED", "true").lower() == "true"
+    )
+    INFERENCE_MAX_BATCH_SIZE: int = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+    # Hilos del motor (intra-op / inter-op de TensorFlow, OMP). Sin definir se
+    # toman del perfil de runtime (benchmarks/tune_threads.py) y, sin perfil,
+    # quedan los del runtime (todos los núcleos por proceso)
+    INFERENCE_INTRA_OP_THREADS: int | None = (
+        int(os.getenv("INFERENCE_INTRA_OP_THREADS")) if os.getenv("INFERENCE_INTRA_OP_THREADS") else None
+    )
+    INFERENCE_INTER_OP_THREADS: int | None = (
+        int(os.getenv("INFERENCE_INTER_OP_THREADS")) if os.getenv("INFERENCE_INTER_OP_THREADS") else None
+    )
+    RUNTIME_PROFILE_ENABLED: bool = (
+        os.getenv("RUNTIME_PROFILE_ENABLED", "true").lower() == "true"
+    )
+    RUNTIME_PROFILE_PATH: str = os.getenv(
+        "RUNTIME_PROFILE_PATH", "model_data/runtime_profile.json"
+    )
+    INFERENCE_MAX_WAIT_MS: float = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+    INFERENCE_QUEUE_DEPTH: int = int(os.getenv("INFERENCE_QUEUE_DEPTH", "256"))
+
+    # Ingesta de subidas (app.services.ingest): se lee por bloques, se
+    # valida la cabecera de la imagen con los primeros bloques y se rechaza
+    # antes de escribir el resto. Se guardan por contenido en UPLOAD_DIR
+    # (app.services.storage: <UPLOAD_DIR>/ab/cd/<sha256>.jpg)
+    UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "uploads")
+    UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+    UPLOAD_CHUNK_BYTES: int = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+    UPLOAD_MAX_PIXELS: int = int(os.getenv("UPLOAD_MAX_PIXELS", "80000000"))
+    UPLOAD_MIN_SIDE: int = int(os.getenv("UPLOAD_MIN_SIDE", "32"))
+
+    # Miniaturas (app.services.thumbnails): tamaños fijos "nombre:lado
+    # mayor", servidas en /thumbnails con ETag y caché de un año. Los de
+    # THUMBNAILS_EAGER se generan tras la subida; el resto al pedirse
+    THUMBNAILS_DIR: str = os.getenv("THUMBNAILS_DIR", "thumbnails")
+    THUMBNAIL_SIZES: dict[str, int] = {
+        name.strip(): int(side)
+        for name, _, side in (
+            entry.partition(":")
+            for entry in os.getenv("THUMBNAIL_SIZES", "sm:160,md:480,lg:1024").split(",")
+            if entry.strip()
+        )
+    }
+    # "webp" o "jpg"
+    THUMBNAILS_FORMAT: str = os.getenv("THUMBNAILS_FORMAT", "webp").lower()
+    THUMBNAILS_QUALITY: int = int(os.getenv("THUMBNAILS_QUALITY", "80"))
+    THUMBNAILS_EAGER: list[str] = [
+        s.strip() for s in os.getenv("THUMBNAILS_EAGER", "sm,md").split(",") if s.strip()
+    ]
+
+    # Subida múltiple (/api/analysis/upload-batch)
+    BATCH_UPLOAD_MAX_FILES: int = int(os.getenv("BATCH_UPLOAD_MAX_FILES", "200"))
+    # Tamaño máximo del cuerpo completo (Content-Length) de una subida múltiple
+    BATCH_UPLOAD_MAX_BYTES: int = int(
+        os.getenv("BATCH_UPLOAD_MAX_BYTES", str(512 * 1024 * 1024))
+    )
+
+    # Subida asíncrona: cola de trabajos en BD + workers
+    # (python -m app.workers.analysis_worker)
+    ANALYSIS_ASYNC_DEFAULT: bool = (
+        os.getenv("ANALYSIS_ASYNC_DEFAULT", "false").lower() == "true"
+    )
+    ANALYSIS_WORKER_PROCESSES: int = int(os.getenv("ANALYSIS_WORKER_PROCESSES", "2"))
+    ANALYSIS_WORKER_BATCH_SIZE: int = int(os.getenv("ANALYSIS_WORKER_BATCH_SIZE", "8"))
+    ANALYSIS_WORKER_POLL_SECONDS: float = float(
+        os.getenv("ANALYSIS_WORKER_POLL_SECONDS", "1.0")
+    )
+    ANALYSIS_WORKER_HEARTBEAT_SECONDS: float = float(
+        os.getenv("ANALYSIS_WORKER_HEARTBEAT_SECONDS", "5")
+    )
+    # Sin latido por este tiempo el worker se da por muerto y sus trabajos
+    # vuelven a la cola
+    ANALYSIS_WORKER_STALE_SECONDS: float = float(
+        os.getenv("ANALYSIS_WORKER_STALE_SECONDS", "30")
+    )
+    ANALYSIS_JOB_MAX_ATTEMPTS: int = int(os.getenv("ANALYSIS_JOB_MAX_ATTEMPTS", "3"))
+
+    # Eventos de progreso (SSE). Con varios procesos (uvicorn --workers,
+    # workers de la cola) se comparten a través de app.core.event_broker
+    EVENTS_BROKER_URL: str | None = os.getenv("EVENTS_BROKER_URL") or None
+    EVENTS_SUBSCRIBER_QUEUE: int = int(os.getenv("EVENTS_SUBSCRIBER_QUEUE", "100"))
+    EVENTS_KEEPALIVE_SECONDS: float = float(
+        os.getenv("EVENTS_KEEPALIVE_SECONDS", "15")
+    )
+
+    # Caché de predicciones por hash de contenido + versión del modelo
+    PREDICTION_CACHE_ENABLED: bool = (
+        os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+    )
+    PREDICTION_CACHE_MAX_ENTRIES: int = int(
+        os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "10000")
+    )
+    PREDICTION_CACHE_TTL_SECONDS: float = float(
+        os.getenv("PREDICTION_CACHE_TTL_SECONDS", "3600")
+    )
+
+    # Embeddings (GlobalAveragePooling de MobileNetV2) y búsqueda de análisis
+    # similares. Hasta EMBEDDINGS_IVF_MIN_VECTORS vectores por versión se
+    # busca por fuerza bruta; desde ahí con un índice IVF
+    EMBEDDINGS_ENABLED: bool = (
+        os.getenv("EMBEDDINGS_ENABLED", "true").lower() == "true"
+    )
+    EMBEDDINGS_DIR: str = os.getenv("EMBEDDINGS_DIR", "model_data/embeddings")
+    EMBEDDINGS_IVF_MIN_VECTORS: int = int(
+        os.getenv("EMBEDDINGS_IVF_MIN_VECTORS", "20000")
+    )
+    EMBEDDINGS_IVF_NPROBE: int = int(os.getenv("EMBEDDINGS_IVF_NPROBE", "8"))
+    SIMILAR_MAX_K: int = int(os.getenv("SIMILAR_MAX_K", "50"))
+
+    # Explicaciones Grad-CAM (app.ml.inference.explain): se calculan en
+    # segundo plano, por lotes, la primera vez que se piden (o en bloque con
+    # el CLI) y quedan en disco por hash de imagen + versión del modelo
+    EXPLANATIONS_ENABLED: bool = (
+        os.getenv("EXPLANATIONS_ENABLED", "true").lower() == "true"
+    )
+    EXPLANATIONS_DIR: str = os.getenv("EXPLANATIONS_DIR", "explanations")
+    EXPLANATIONS_BATCH_SIZE: int = int(os.getenv("EXPLANATIONS_BATCH_SIZE", "8"))
+    EXPLANATIONS_MAX_WAIT_MS: float = float(os.getenv("EXPLANATIONS_MAX_WAIT_MS", "200"))
+    EXPLANATIONS_QUEUE: int = int(os.getenv("EXPLANATIONS_QUEUE", "256"))
+    # Lado mayor de la imagen superpuesta (px)
+    EXPLANATIONS_MAX_SIDE: int = int(os.getenv("EXPLANATIONS_MAX_SIDE", "768"))
+    # Al generarse, agregar la explicación al PDF del reporte
+    EXPLANATIONS_IN_PDF: bool = (
+        os.getenv("EXPLANATIONS_IN_PDF", "false").lower() == "true"
+    )
+
+    # PDFs de reportes (app.services.report_cache): se renderizan al
+    # descargarse y quedan en caché por hash del contenido + versión de la
+    # plantilla. Con REPORTS_PRERENDER los reportes nuevos se renderizan en
+    # segundo plano cuando el pool de renderizado está libre
+    REPORTS_CACHE_DIR: str = os.getenv("REPORTS_CACHE_DIR", "reports/cache")
+    REPORTS_PRERENDER: bool = (
+        os.getenv("REPORTS_PRERENDER", "false").lower() == "true"
+    )
+    REPORTS_PRERENDER_QUEUE: int = int(os.getenv("REPORTS_PRERENDER_QUEUE", "1000"))
+
+    # Exportación en bloque (GET /api/analysis/export): ZIP de PDFs armado
+    # al vuelo o un PDF unido. Los PDFs de cada ZIP (enlazados) y los PDF
+    # unidos quedan en EXPORTS_DIR y se borran tras EXPORT_RETENTION_HOURS
+    # sin descargas. Los cargos de EXPORT_ALL_USERS_CARGOS pueden exportar
+    # los análisis de todos los usuarios
+    EXPORTS_DIR: str = os.getenv("EXPORTS_DIR", "reports/exports")
+    EXPORT_MAX_REPORTS: int = int(os.getenv("EXPORT_MAX_REPORTS", "5000"))
+    EXPORT_MAX_MERGED: int = int(os.getenv("EXPORT_MAX_MERGED", "500"))
+    EXPORT_RETENTION_HOURS: float = float(os.getenv("EXPORT_RETENTION_HOURS", "24"))
+    EXPORT_ALL_USERS_CARGOS: list[str] = [
+        c.strip().lower()
+        for c in os.getenv("EXPORT_ALL_USERS_CARGOS", "admin,supervisor").split(",")
+        if c.strip()
+    ]
+
+    # Monitor de distribución de confianza y drift (app.ml.inference.drift).
+    # Cada proceso acumula por (versión, zona, ventana) y suma sus acumulados
+    # en `estadisticas_prediccion` cada DRIFT_FLUSH_SECONDS. La referencia es
+    # la distribución de validación (DRIFT_BASELINE_PATH o `metrics.
+    # drift_baseline` en el registro); el PSI la compara por zona
+    DRIFT_ENABLED: bool = os.getenv("DRIFT_ENABLED", "true").lower() == "true"
+    DRIFT_WINDOW_MINUTES: int = int(os.getenv("DRIFT_WINDOW_MINUTES", "60"))
+    DRIFT_FLUSH_SECONDS: float = float(os.getenv("DRIFT_FLUSH_SECONDS", "10"))
+    DRIFT_RETENTION_DAYS: int = int(os.getenv("DRIFT_RETENTION_DAYS", "90"))
+    DRIFT_BASELINE_PATH: str = os.getenv(
+        "DRIFT_BASELINE_PATH", "model_data/drift_baseline.json"
+    )
+    DRIFT_MIN_SAMPLES: int = int(os.getenv("DRIFT_MIN_SAMPLES", "50"))
+    DRIFT_PSI_WARN: float = float(os.getenv("DRIFT_PSI_WARN", "0.1"))
+    DRIFT_PSI_ALERT: float = float(os.getenv("DRIFT_PSI_ALERT", "0.25"))
+
+    # Métricas Prometheus (/metrics) y header Server-Timing por petición.
+    # Con METRICS_TOKEN definido, /metrics exige "Authorization: Bearer <token>"
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_SERVER_TIMING: bool = (
+        os.getenv("METRICS_SERVER_TIMING", "true").lower() == "true"
+    )
+    METRICS_TOKEN: str | None = os.getenv("METRICS_TOKEN") or None
+
+    # Etapas del pipeline de subida (executors acotados fuera del event loop)
+    STAGE_IO_WORKERS: int = int(os.getenv("STAGE_IO_WORKERS", "4"))
+    STAGE_IO_CONCURRENCY: int = int(os.getenv("STAGE_IO_CONCURRENCY", "8"))
+    STAGE_DECODE_WORKERS: int = int(os.getenv("STAGE_DECODE_WORKERS", "2"))
+    STAGE_DECODE_CONCURRENCY: int = int(os.getenv("STAGE_DECODE_CONCURRENCY", "4"))
+    STAGE_DB_WORKERS: int = int(os.getenv("STAGE_DB_WORKERS", "4"))
+    STAGE_DB_CONCURRENCY: int = int(os.getenv("STAGE_DB_CONCURRENCY", "4"))
+    STAGE_RENDER_WORKERS: int = int(os.getenv("STAGE_RENDER_WORKERS", "1"))
+    STAGE_RENDER_CONCURRENCY: int = int(os.getenv("STAGE_RENDER_CONCURRENCY", "2"))
+
 settings = Settings()
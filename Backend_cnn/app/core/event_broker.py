@@ -0,0 +1,80 @@
+# app/core/event_broker.py
+"""
+Broker local de eventos: reenvía cada línea JSON recibida de un proceso a
+todos los demás procesos conectados (workers de uvicorn y de la cola de
+análisis). Reemplazo mínimo de Redis pub/sub para un solo servidor.
+
+Uso (desde Backend_cnn/):
+    python -m app.core.event_broker
+    EVENTS_BROKER_URL=tcp://127.0.0.1:8765 uvicorn app.main:app --workers 4
+"""
+import argparse
+import asyncio
+import sys
+from typing import Set
+
+from app.core.config import settings
+from app.core.events import parse_broker_url
+
+# Una línea = un evento; se corta cualquier mensaje más grande
+MAX_LINE_BYTES = 1024 * 1024
+
+
+class EventBroker:
+    def __init__(self):
+        self.clients: Set[asyncio.StreamWriter] = set()
+        self.relayed = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info("peername")
+        self.clients.add(writer)
+        print(f"🔌 Proceso conectado {peer} ({len(self.clients)} en total)")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.relayed += 1
+                for client in list(self.clients):
+                    if client is writer:
+                        continue
+                    client.write(line)
+                    # Un proceso que no lee no debe frenar al resto
+                    if client.transport.get_write_buffer_size() > 4 * MAX_LINE_BYTES:
+                        print("⚠️ Proceso sin leer eventos; se desconecta")
+                        self.clients.discard(client)
+                        client.close()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+            print(f"🔌 Proceso desconectado {peer} ({len(self.clients)} en total)")
+
+
+async def serve(host: str, port: int) -> None:
+    broker = EventBroker()
+    server = await asyncio.start_server(
+        broker.handle, host, port, limit=MAX_LINE_BYTES
+    )
+    print(f"📡 Broker de eventos escuchando en tcp://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--url", default=settings.EVENTS_BROKER_URL or "tcp://127.0.0.1:8765"
+    )
+    args = parser.parse_args(argv)
+    host, port = parse_broker_url(args.url)
+    try:
+        asyncio.run(serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
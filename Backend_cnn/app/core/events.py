@@ -0,0 +1,223 @@
+# app/core/events.py
+"""
+Pub/sub de eventos de análisis por usuario (progreso y resultados).
+
+Dentro de un proceso los eventos se entregan a las suscripciones (colas
+asyncio de cada conexión SSE) con `call_soon_threadsafe`, así se puede
+publicar desde el event loop, desde hilos o desde los executors.
+
+Con EVENTS_BROKER_URL configurado, cada proceso (workers de uvicorn y de
+la cola de análisis) se conecta además a `app.core.event_broker`, que
+reenvía cada evento al resto de los procesos. La entrega es "best effort":
+si el broker no está disponible los eventos solo llegan localmente y el
+cliente puede recuperar el estado con /jobs/{id} o /history.
+"""
+import asyncio
+import itertools
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+from urllib.parse import urlparse
+from uuid import uuid4
+
+from app.core.config import settings
+
+
+def parse_broker_url(url: str) -> Tuple[str, int]:
+    """tcp://host:puerto -> (host, puerto)."""
+    parsed = urlparse(url)
+    if parsed.scheme != "tcp" or not parsed.hostname or not parsed.port:
+        raise ValueError(f"URL de broker inválida: {url}")
+    return parsed.hostname, parsed.port
+
+
+class Subscription:
+    """Cola de eventos de una conexión, atada a su event loop."""
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def _put(self, event: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Cliente lento: se descarta lo más antiguo, nunca se bloquea
+            self.queue.get_nowait()
+            self.queue.put_nowait(event)
+            self.dropped += 1
+
+    def deliver(self, event: Dict[str, Any]) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Loop cerrado: la conexión ya terminó
+            pass
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    def __init__(self, broker_url: Optional[str] = None, subscriber_queue: int = 100):
+        self.broker_url = broker_url
+        self.subscriber_queue = subscriber_queue
+        # Identifica los eventos propios que el broker no debe devolver
+        self.origin = uuid4().hex
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._outbox: "queue.Queue[bytes]" = queue.Queue(maxsize=10000)
+        self._sock: Optional[socket.socket] = None
+        self._started = False
+        self._counters = {"published": 0, "delivered": 0, "from_broker": 0, "broker_dropped": 0}
+
+    # --------- suscripciones ---------
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(
+            user_id, asyncio.get_running_loop(), self.subscriber_queue
+        )
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+        self._ensure_broker()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    # --------- publicación ---------
+
+    def publish(self, user_id: int, event_type: str, data: Dict[str, Any]) -> None:
+        """Publica un evento para `user_id` (seguro desde cualquier hilo)."""
+        event = {
+            "id": f"{self.origin[:8]}-{next(self._ids)}",
+            "type": event_type,
+            "userId": user_id,
+            "time": time.time(),
+            "data": data,
+        }
+        with self._lock:
+            self._counters["published"] += 1
+        self._dispatch(event)
+        if self.broker_url:
+            self._ensure_broker()
+            message = json.dumps({"origin": self.origin, "event": event}, default=str)
+            try:
+                self._outbox.put_nowait(message.encode("utf-8") + b"\n")
+            except queue.Full:
+                with self._lock:
+                    self._counters["broker_dropped"] += 1
+
+    def _dispatch(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(event["userId"], ()))
+            self._counters["delivered"] += len(subscriptions)
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+    # --------- broker entre procesos ---------
+
+    def _ensure_broker(self) -> None:
+        if not self.broker_url or self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._broker_loop, name="events-broker", daemon=True).start()
+
+    def _broker_loop(self) -> None:
+        host, port = parse_broker_url(self.broker_url)
+        backoff = 0.5
+        while True:
+            try:
+                sock = socket.create_connection((host, port), timeout=5)
+                sock.settimeout(None)
+            except OSError as e:
+                print(f"⚠️ Broker de eventos no disponible ({e}); reintentando")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+
+            backoff = 0.5
+            self._sock = sock
+            print(f"📡 Conectado al broker de eventos {host}:{port} (pid {os.getpid()})")
+            sender = threading.Thread(
+                target=self._send_loop, args=(sock,), name="events-sender", daemon=True
+            )
+            sender.start()
+            try:
+                for line in sock.makefile("rb"):
+                    self._on_broker_message(line)
+            except OSError:
+                pass
+            finally:
+                self._sock = None
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+                # Despierta al hilo emisor para que termine
+                self._outbox.put(b"")
+                sender.join()
+            print("⚠️ Conexión con el broker de eventos perdida; reconectando")
+
+    def _send_loop(self, sock: socket.socket) -> None:
+        while True:
+            message = self._outbox.get()
+            if not message:
+                # Marca de reconexión (o sobrante de una conexión anterior)
+                if self._sock is not sock:
+                    return
+                continue
+            try:
+                sock.sendall(message)
+            except OSError:
+                with self._lock:
+                    self._counters["broker_dropped"] += 1
+                return
+
+    def _on_broker_message(self, line: bytes) -> None:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return
+        if message.get("origin") == self.origin:
+            return
+        event = message.get("event") or {}
+        if "userId" not in event:
+            return
+        with self._lock:
+            self._counters["from_broker"] += 1
+        self._dispatch(event)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "broker_url": self.broker_url,
+                "broker_connected": self._sock is not None,
+                "users": len(self._subscriptions),
+                "subscriptions": sum(len(s) for s in self._subscriptions.values()),
+                **self._counters,
+            }
+
+
+event_bus = EventBus(
+    broker_url=settings.EVENTS_BROKER_URL,
+    subscriber_queue=settings.EVENTS_SUBSCRIBER_QUEUE,
+)
@@ -0,0 +1,159 @@
+# app/core/executors.py
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Dict, List
+
+from app.core.config import settings
+from app.core.metrics import record_span, stage_wait_seconds
+
+
+class StageUnavailable(RuntimeError):
+    """El pool de la etapa se rompió (proceso hijo caído) durante la tarea."""
+
+
+class Stage:
+    """
+    Etapa del pipeline con su propio executor acotado.
+
+    `workers` fija el tamaño del pool y `concurrency` cuántas tareas pueden
+    estar en vuelo (ejecutándose o esperando en el pool) a la vez; el resto
+    espera en un semáforo sin ocupar memoria del executor. El pool se crea
+    en el primer uso y se vuelve a crear si un proceso hijo muere (OOM,
+    segfault de PIL/ReportLab), que deja el ProcessPoolExecutor inutilizable.
+    """
+
+    def __init__(self, name: str, kind: str, workers: int, concurrency: int):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Tipo de executor desconocido: {kind}")
+        self.name = name
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.concurrency = max(1, concurrency)
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self._in_flight = 0
+
+    def _get_executor(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "thread":
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix=f"stage-{self.name}",
+                    )
+                else:
+                    # "spawn": TensorFlow no es seguro tras un fork
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+            return self._executor
+
+    def _discard_executor(self, broken: Executor) -> None:
+        """Descarta `broken`; la próxima llamada crea un pool nuevo."""
+        with self._lock:
+            # Otra tarea pudo haberlo reemplazado ya
+            if self._executor is not broken:
+                return
+            self._executor = None
+        print(f"⚠️ Pool de la etapa {self.name} roto: se creará uno nuevo")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Ejecuta `fn` en el executor de la etapa sin bloquear el event loop.
+        Cada llamada queda medida como el span `<etapa>.<función>`.
+
+        Si el pool ya estaba roto al encolar, la tarea no llegó a correr: se
+        reintenta una vez en un pool nuevo. Si se rompe mientras corre (la
+        tarea pudo ser la causa) no se reintenta y se lanza StageUnavailable.
+        """
+        requested = time.perf_counter()
+        async with self._get_semaphore():
+            started = time.perf_counter()
+            stage_wait_seconds.observe(started - requested, stage=self.name)
+            self._in_flight += 1
+            try:
+                loop = asyncio.get_running_loop()
+                call = partial(fn, *args, **kwargs)
+                executor = self._get_executor()
+                try:
+                    future = loop.run_in_executor(executor, call)
+                except BrokenProcessPool:
+                    self._discard_executor(executor)
+                    executor = self._get_executor()
+                    future = loop.run_in_executor(executor, call)
+                try:
+                    return await future
+                except BrokenProcessPool as e:
+                    self._discard_executor(executor)
+                    raise StageUnavailable(
+                        f"Un proceso de la etapa {self.name} terminó de forma abrupta"
+                    ) from e
+            finally:
+                self._in_flight -= 1
+                task = getattr(fn, "__qualname__", None) or type(fn).__name__
+                record_span(f"{self.name}.{task}", time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "concurrency": self.concurrency,
+            "in_flight": self._in_flight,
+        }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+# Escritura de archivos subidos
+io_stage = Stage(
+    "io", "thread", settings.STAGE_IO_WORKERS, settings.STAGE_IO_CONCURRENCY
+)
+# Decodificación PIL + redimensionado (CPU, fuera del GIL del servidor)
+decode_stage = Stage(
+    "decode",
+    "process",
+    settings.STAGE_DECODE_WORKERS,
+    settings.STAGE_DECODE_CONCURRENCY,
+)
+# Commits síncronos de SQLAlchemy
+db_stage = Stage(
+    "db", "thread", settings.STAGE_DB_WORKERS, settings.STAGE_DB_CONCURRENCY
+)
+# Renderizado de PDFs con ReportLab
+render_stage = Stage(
+    "render",
+    "process",
+    settings.STAGE_RENDER_WORKERS,
+    settings.STAGE_RENDER_CONCURRENCY,
+)
+
+STAGES: List[Stage] = [io_stage, decode_stage, db_stage, render_stage]
+
+
+def stages_stats() -> Dict[str, Any]:
+    return {stage.name: stage.stats() for stage in STAGES}
+
+
+def shutdown_stages() -> None:
+    for stage in STAGES:
+        stage.shutdown()
@@ -0,0 +1,183 @@
+# app/core/http_files.py
+"""
+Respuestas de archivos con caché HTTP: ETag fuerte, Cache-Control,
+If-None-Match (304) y Range/If-Range (206 de un solo rango).
+
+FileResponse de Starlette 0.38 no atiende Range; los archivos que sirve
+la API (miniaturas, originales por contenido, PDFs en caché) no cambian
+para un mismo ETag, que se calcula del contenido y no de mtime/tamaño.
+virtual_file_response hace lo mismo con contenido armado al vuelo (ZIP de
+exportación) sin escribirlo a disco.
+"""
+import os
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+CHUNK_SIZE = 64 * 1024
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match compara en forma débil (RFC 9110 13.1.2)
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or any(
+        value.removeprefix("W/") == etag for value in candidates
+    )
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (inicio, fin) inclusivos de un header `Range: bytes=...` de un solo
+    rango. None si no aplica (otra unidad, varios rangos o mal formado: se
+    responde el archivo completo); ValueError si no es satisfacible.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, sep, end_text = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_text == "":
+            # Sufijo: los últimos N bytes
+            length = int(end_text)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise ValueError("Rango fuera del archivo")
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _iter_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _not_modified(request: Request, etag: str, headers: Dict[str, str]) -> Optional[Response]:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+def _requested_range(
+    request: Request, etag: str, size: int, headers: Dict[str, str]
+) -> Tuple[Optional[Response], Optional[Tuple[int, int]]]:
+    """(respuesta 416, None), (None, rango) o (None, None) = archivo completo."""
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if not range_header or (if_range is not None and if_range.strip() != etag):
+        return None, None
+    try:
+        return None, parse_range(range_header, size)
+    except ValueError:
+        return (
+            Response(
+                status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"}
+            ),
+            None,
+        )
+
+
+def _partial(
+    chunks: Iterator[bytes],
+    start: int,
+    end: int,
+    size: int,
+    media_type: str,
+    headers: Dict[str, str],
+) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        status_code=206,
+        media_type=media_type,
+        headers={
+            **headers,
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1),
+        },
+    )
+
+
+def _attachment(filename: str) -> str:
+    return f'attachment; filename="{filename}"'
+
+
+def cached_file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    etag: str,
+    cache_control: str = IMMUTABLE,
+    filename: Optional[str] = None,
+) -> Response:
+    """
+    Sirve `path` con ETag fuerte (`etag`, ya entre comillas) y
+    `cache_control`, respondiendo 304 / 206 / 416 según los headers.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    not_modified = _not_modified(request, etag, headers)
+    if not_modified is not None:
+        return not_modified
+
+    size = os.path.getsize(path)
+    error, byte_range = _requested_range(request, etag, size, headers)
+    if error is not None:
+        return error
+    if byte_range is not None:
+        if filename:
+            headers["Content-Disposition"] = _attachment(filename)
+        start, end = byte_range
+        return _partial(_iter_range(path, start, end), start, end, size, media_type, headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers, filename=filename)
+
+
+def virtual_file_response(
+    request: Request,
+    size: int,
+    read_range: Callable[[int, int], Iterator[bytes]],
+    media_type: str,
+    etag: str,
+    cache_control: str = "private, no-cache",
+    filename: Optional[str] = None,
+) -> Response:
+    """
+    Como cached_file_response, para contenido que se arma al vuelo con
+    tamaño conocido: `read_range(inicio, fin)` genera esos bytes
+    (inclusivos) sin tener el contenido completo en memoria.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if filename:
+        headers["Content-Disposition"] = _attachment(filename)
+    not_modified = _not_modified(request, etag, headers)
+    if not_modified is not None:
+        return not_modified
+
+    error, byte_range = _requested_range(request, etag, size, headers)
+    if error is not None:
+        return error
+    start, end = byte_range if byte_range is not None else (0, size - 1)
+    if byte_range is not None:
+        return _partial(read_range(start, end), start, end, size, media_type, headers)
+    return StreamingResponse(
+        read_range(start, end),
+        media_type=media_type,
+        headers={**headers, "Content-Length": str(size)},
+    )
@@ -4,7 +4,7 @@ from typing import Optional
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
@@ -16,6 +16,10 @@ from app.db import models as db_models
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+# Para endpoints de streaming: EventSource no permite cabeceras propias
+oauth2_scheme_optional = OAuth2PasswordBearer(
+    tokenUrl="/api/auth/login", auto_error=False
+)
 
 
 class TokenData(BaseModel):
@@ -51,16 +55,15 @@ def get_user_by_email(db: Session, email: str) -> Optional[db_models.Usuario]:
     return db.query(db_models.Usuario).filter(db_models.Usuario.email == email).first()
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-) -> db_models.Usuario:
+def _user_from_token(token: Optional[str], db: Session) -> db_models.Usuario:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudo validar el token",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    if not token:
+        raise credentials_exception
     try:
         payload = jwt.decode(
             token,
@@ -78,3 +81,21 @@ async def get_current_user(
     if user is None:
         raise credentials_exception
     return user
+
+
+# Síncrona a propósito: FastAPI la ejecuta en su threadpool y la consulta
+# a BD no bloquea el event loop.
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+) -> db_models.Usuario:
+    return _user_from_token(token, db)
+
+
+def get_current_user_stream(
+    token: Optional[str] = Depends(oauth2_scheme_optional),
+    access_token: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+) -> db_models.Usuario:
+    """Como `get_current_user`, aceptando también el token en `?access_token=`."""
+    return _user_from_token(token or access_token, db)
@@ -9,6 +9,8 @@ from sqlalchemy import (
     Text,
     ForeignKey,
     Numeric,
+    Float,
+    UniqueConstraint,
     func,
 )
 from sqlalchemy.orm import relationship
@@ -40,7 +42,11 @@ class Imagen(Base):
         ForeignKey("usuarios.id_usuario", ondelete="CASCADE", onupdate="CASCADE"),
         nullable=False,
     )
-    ruta_archivo = Column(String(255), nullable=False)
+    # Ruta por contenido (app.services.storage): varias filas pueden
+    # compartir el mismo archivo; el índice sirve para contar referencias
+    ruta_archivo = Column(String(255), index=True, nullable=False)
+    # SHA-256 del contenido subido (caché de predicciones / deduplicación)
+    hash_contenido = Column(String(64), index=True, nullable=True)
     tamano = Column(Integer, nullable=False)
     formato = Column(String(50), nullable=False)
     fecha_carga = Column(DateTime(timezone=True), server_default=func.now())
@@ -189,3 +195,127 @@ class Prediccion(Base):
     fecha_almacenamiento = Column(DateTime(timezone=True), server_default=func.now())
 
     clasificacion = relationship("Clasificacion", back_populates="predicciones")
+
+
+class PrediccionCache(Base):
+    __tablename__ = "predicciones_cache"
+    __table_args__ = (
+        UniqueConstraint("hash_imagen", "version_modelo", name="uq_cache_hash_version"),
+    )
+
+    id_cache = Column(Integer, primary_key=True, autoincrement=True)
+    hash_imagen = Column(String(64), nullable=False)
+    version_modelo = Column(String(100), nullable=False)
+    resultado = Column(String(100), nullable=False)
+    confianza = Column(Float, nullable=False)
+    id_clasificacion = Column(
+        Integer,
+        ForeignKey("clasificaciones.id_clasificacion", ondelete="SET NULL", onupdate="CASCADE"),
+        nullable=True,
+    )
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class Trabajo(Base):
+    """Trabajo de análisis en cola (subida asíncrona)."""
+
+    __tablename__ = "trabajos"
+
+    id_trabajo = Column(Integer, primary_key=True, autoincrement=True)
+    id_imagen = Column(
+        Integer,
+        ForeignKey("imagenes.id_imagen", ondelete="CASCADE", onupdate="CASCADE"),
+        nullable=False,
+    )
+    id_usuario = Column(
+        Integer,
+        ForeignKey("usuarios.id_usuario", ondelete="CASCADE", onupdate="CASCADE"),
+        nullable=False,
+    )
+    metadata_json = Column(Text, nullable=False)
+    web_url = Column(String(255), nullable=False)
+    tiled = Column(Boolean, nullable=False, default=False)
+    estado = Column(
+        Enum("pendiente", "en_proceso", "completado", "error", name="estado_trabajo"),
+        nullable=False,
+        default="pendiente",
+        index=True,
+    )
+    intentos = Column(Integer, nullable=False, default=0)
+    worker = Column(String(100), nullable=True)
+    error = Column(Text, nullable=True)
+    id_clasificacion = Column(
+        Integer,
+        ForeignKey("clasificaciones.id_clasificacion", ondelete="SET NULL", onupdate="CASCADE"),
+        nullable=True,
+    )
+    fecha_creacion = Column(DateTime(timezone=True), server_default=func.now())
+    fecha_inicio = Column(DateTime(timezone=True), nullable=True)
+    fecha_fin = Column(DateTime(timezone=True), nullable=True)
+
+    imagen = relationship("Imagen")
+
+
+class WorkerAnalisis(Base):
+    """Latido de cada proceso worker de análisis (observabilidad de la cola)."""
+
+    __tablename__ = "workers_analisis"
+
+    nombre = Column(String(100), primary_key=True)
+    pid = Column(Integer, nullable=False)
+    fecha_inicio = Column(DateTime(timezone=True), nullable=False)
+    ultimo_latido = Column(DateTime(timezone=True), nullable=False)
+    ocupado = Column(Boolean, nullable=False, default=False)
+    segundos_ocupado = Column(Float, nullable=False, default=0.0)
+    trabajos_procesados = Column(Integer, nullable=False, default=0)
+    trabajos_fallidos = Column(Integer, nullable=False, default=0)
+
+
+class ComparacionModelo(Base):
+    """Salida del modelo en sombra frente a la del modelo activo (misma imagen)."""
+
+    __tablename__ = "comparaciones_modelo"
+
+    id_comparacion = Column(Integer, primary_key=True, autoincrement=True)
+    version_activa = Column(String(100), nullable=False, index=True)
+    version_sombra = Column(String(100), nullable=False, index=True)
+    resultado_activo = Column(String(100), nullable=False)
+    confianza_activa = Column(Float, nullable=False)
+    resultado_sombra = Column(String(100), nullable=False)
+    confianza_sombra = Column(Float, nullable=False)
+    coincide = Column(Boolean, nullable=False)
+    # |P(cobre) activo - P(cobre) sombra|
+    diferencia = Column(Float, nullable=False)
+    # Latencia de la pasada en sombra, por imagen
+    latencia_ms = Column(Float, nullable=False)
+    fecha = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class EstadisticaPrediccion(Base):
+    """
+    Estadísticas agregadas de las predicciones servidas por versión del
+    modelo, zona y ventana de tiempo (app.ml.inference.drift). Cada fila
+    se actualiza sumando los acumulados de cada proceso: consultar la
+    distribución no recorre `clasificaciones`.
+    """
+
+    __tablename__ = "estadisticas_prediccion"
+    __table_args__ = (
+        UniqueConstraint("version_modelo", "zona", "ventana", name="uq_estadistica_ventana"),
+    )
+
+    id_estadistica = Column(Integer, primary_key=True, autoincrement=True)
+    version_modelo = Column(String(100), nullable=False)
+    zona = Column(String(100), nullable=False)
+    # Inicio de la ventana (DRIFT_WINDOW_MINUTES)
+    ventana = Column(DateTime, nullable=False, index=True)
+    total = Column(Integer, nullable=False, default=0)
+    con_cobre = Column(Integer, nullable=False, default=0)
+    # Media y suma de cuadrados de desvíos (Welford) de la confianza, 0-1
+    media_confianza = Column(Float, nullable=False, default=0.0)
+    m2_confianza = Column(Float, nullable=False, default=0.0)
+    # Conteos por intervalo de P(cobre) en [0, 1] (JSON)
+    histograma = Column(Text, nullable=False)
+    fecha_actualizacion = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
@@ -0,0 +1,69 @@
+# app/db/schema.py
+"""
+Cambios de esquema sobre tablas que ya existen.
+
+`Base.metadata.create_all` crea las tablas nuevas pero nunca altera una
+existente: las columnas e índices agregados a tablas previas se aplican
+aquí, antes de que algo consulte esos modelos. Cada paso revisa el
+esquema real y solo actúa si falta, así se puede correr en cada arranque.
+
+Pasos:
+    imagenes.hash_contenido  ALTER TABLE imagenes ADD COLUMN hash_contenido VARCHAR(64) NULL
+    ix_imagenes_hash_contenido, ix_imagenes_ruta_archivo
+
+Uso (desde Backend_cnn/):
+    python -m app.db.schema
+"""
+import sys
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.db import models as db_models
+
+# (tabla, columna, definición SQL) agregadas a tablas existentes
+ADDED_COLUMNS = [
+    ("imagenes", "hash_contenido", "VARCHAR(64) NULL"),
+]
+# Tablas existentes con índices nuevos
+INDEXED_TABLES = [db_models.Imagen.__table__]
+
+
+def ensure_schema(engine: Engine) -> List[str]:
+    """Aplica los pasos que falten. Devuelve lo que se cambió."""
+    applied = []
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, column, definition in ADDED_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table)}
+            if column not in columns:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                applied.append(f"{table}.{column}")
+    inspector = inspect(engine)
+    for table in INDEXED_TABLES:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                applied.append(index.name)
+    return applied
+
+
+def main(argv=None):
+    from app.db.mysql_connection import engine
+
+    applied = ensure_schema(engine)
+    if applied:
+        print(f"✅ Esquema actualizado: {', '.join(applied)}")
+    else:
+        print("✅ El esquema ya está al día")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
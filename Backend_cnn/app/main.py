@@ -1,15 +1,43 @@
+import os
+import threading
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from app.core.config import settings
+from app.core.executors import shutdown_stages
+from app.core.metrics import MetricsMiddleware
+from app.services.ingest import UploadSizeLimitMiddleware
+from app.services.storage import URL_PREFIX as URL_PREFIX_UPLOADS
 from app.db.mysql_connection import Base, engine
-from app.api import auth, analysis  # nuestros routers
+from app.db.schema import ensure_schema
+from app.api import auth, analysis, media, metrics, models  # nuestros routers
+from app.ml.inference.batcher import copper_batcher
+from app.ml.inference.drift import drift_monitor
+from app.ml.inference.explain import URL_PREFIX
+from app.ml.inference.shadow import shadow_runner
+from app.ml.models.cnn_model import copper_model
+from app.ml.models.registry import model_registry, start_registry_watcher
 
 app = FastAPI(title=settings.APP_NAME)
 
-# Crear tablas (solo para desarrollo)
+# Crear tablas (solo para desarrollo) y aplicar las columnas/índices
+# nuevos de tablas existentes, antes de cualquier consulta
 Base.metadata.create_all(bind=engine)
+ensure_schema(engine)
+
+# Subidas con Content-Length por encima del límite: 413 sin leer el cuerpo
+# (se agrega antes que CORS para que la respuesta lleve sus headers)
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    limits={
+        # Margen para la metadata y los separadores del multipart
+        f"{analysis.router.prefix}/upload": settings.UPLOAD_MAX_BYTES + 1024 * 1024,
+        f"{analysis.router.prefix}/upload-batch": settings.BATCH_UPLOAD_MAX_BYTES,
+    },
+)
 
 # CORS para que el frontend (Vite) pueda llamar al backend
 app.add_middleware(
@@ -18,17 +46,99 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Conteo y duración por ruta + header Server-Timing con las etapas
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Rutas
 app.include_router(auth.router)
 app.include_router(analysis.router)
+# Antes del montaje de /uploads: sus rutas tienen prioridad
+app.include_router(media.router)
+app.include_router(models.router)
+app.include_router(metrics.router)
+
+
+@app.on_event("startup")
+def start_model_warmup():
+    """
+    Carga el modelo y hace el warm-up en segundo plano: la API arranca
+    de inmediato y /ready responde 503 hasta que el modelo esté listo.
+    """
+    if not settings.MODEL_EAGER_LOAD or copper_model.remote is not None:
+        return
+    threading.Thread(
+        target=copper_model.warmup,
+        args=(settings.MODEL_WARMUP_RUNS, sorted({1, copper_batcher.max_batch_size})),
+        name="model-warmup",
+        daemon=True,
+    ).start()
+
 
+def sync_models():
+    """Aplica en caliente la versión activa y el modelo en sombra del registro."""
+    copper_model.sync_with_registry()
+    shadow_runner.sync_with_registry()
 
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+
+@app.on_event("startup")
+def start_registry_watch():
+    """
+    Vigila los punteros del registro de modelos: una activación hecha
+    desde otro proceso (CLI u otro worker de uvicorn) se aplica aquí sin
+    reiniciar. En modo remoto el servidor de modelo hace el swap y aquí
+    solo se refresca la versión que sirve.
+    """
+    if copper_model.remote is not None:
+        if settings.MODEL_REGISTRY_WATCH_SECONDS > 0:
+            start_registry_watcher(
+                model_registry,
+                copper_model.refresh_served_version,
+                settings.MODEL_REGISTRY_WATCH_SECONDS,
+            )
+        return
+    threading.Thread(
+        target=shadow_runner.sync_with_registry, name="model-shadow-load", daemon=True
+    ).start()
+    if settings.MODEL_REGISTRY_WATCH_SECONDS > 0:
+        start_registry_watcher(
+            model_registry, sync_models, settings.MODEL_REGISTRY_WATCH_SECONDS
+        )
+
+
+@app.on_event("shutdown")
+def stop_executors():
+    shutdown_stages()
+    # Lo acumulado desde el último flush periódico
+    try:
+        drift_monitor.flush()
+    except Exception as e:
+        print(f"⚠️ No se pudieron guardar las estadísticas de predicción: {e}")
+
+
+# Subidas por contenido (app.services.storage: /uploads/ab/cd/<sha256>.jpg)
+os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+app.mount(URL_PREFIX_UPLOADS, StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
 app.mount("/reports", StaticFiles(directory="reports"), name="reports")
+# Mapas Grad-CAM (app.ml.inference.explain)
+os.makedirs(settings.EXPLANATIONS_DIR, exist_ok=True)
+app.mount(
+    URL_PREFIX, StaticFiles(directory=settings.EXPLANATIONS_DIR), name="explanations"
+)
 
 @app.get("/")
 def root():
     return {"message": "Backend MinerIA OK"}
 
+
+@app.get("/ready")
+def ready():
+    status = copper_model.status()
+    # En modo remoto el estado es el del servidor de modelo
+    if (settings.MODEL_EAGER_LOAD or status["mode"] == "remote") and not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
@@ -0,0 +1,291 @@
+# app/ml/inference/batcher.py
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.metrics import metrics_registry, span
+from app.ml.inference.shadow import ShadowRunner, shadow_runner
+from app.ml.models.cnn_model import CopperCNN, copper_model
+from app.ml.models.runtime_profile import runtime_settings
+from app.ml.utils.decoding import normalize_into
+
+
+batch_size_histogram = metrics_registry.histogram(
+    "mineria_inference_batch_size",
+    "Imágenes por lote de model.predict",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+batch_seconds = metrics_registry.histogram(
+    "mineria_inference_batch_seconds", "Duración de model.predict por lote"
+)
+queue_wait_seconds = metrics_registry.histogram(
+    "mineria_inference_queue_wait_seconds",
+    "Espera de cada imagen en la cola del micro-batcher",
+)
+inference_errors = metrics_registry.counter(
+    "mineria_inference_errors_total", "Lotes de inferencia que fallaron"
+)
+
+
+class QueueFullError(RuntimeError):
+    """La cola de inferencia alcanzó su profundidad máxima."""
+
+
+class MicroBatcher:
+    """
+    Agrupa peticiones concurrentes de inferencia en un solo `model.predict`.
+
+    Un hilo dedicado espera la primera imagen de la cola y luego sigue
+    juntando imágenes hasta llenar `max_batch_size` o hasta que pasen
+    `max_wait_ms`. Cada llamador recibe un Future con su propia fila de
+    salida del modelo, la versión que la produjo (puede cambiar por un
+    hot-swap entre dos lotes) y su embedding (None si el motor no lo da).
+    """
+
+    def __init__(
+        self,
+        model: CopperCNN,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10.0,
+        queue_depth: int = 256,
+        shadow: ShadowRunner | None = None,
+    ):
+        self.model = model
+        self.shadow = shadow
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[np.ndarray, Future, float]]" = queue.Queue(
+            maxsize=max(1, queue_depth)
+        )
+        self._thread: threading.Thread | None = None
+        # Buffer float32 (max_batch, H, W, 3) reutilizado en cada lote; solo
+        # lo toca el hilo de inferencia
+        self._buffer: np.ndarray | None = None
+        self._start_lock = threading.Lock()
+
+        # Métricas de ocupación por lote
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._images = 0
+        self._batch_sizes = [0] * (self.max_batch_size + 1)
+        self._queue_wait_total = 0.0
+        self._inference_total = 0.0
+
+    # --------- ciclo de vida ---------
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="copper-batcher", daemon=True
+            )
+            self._thread.start()
+
+    # --------- API pública ---------
+
+    def submit(self, image: np.ndarray) -> Future:
+        """
+        Encola una imagen decodificada, uint8 (H, W, 3) o float (1, H, W, 3)
+        ya normalizada, y devuelve un Future que se resuelve con
+        (fila de salida cruda del modelo, versión, embedding) o None.
+        """
+        self.start()
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((image, future, time.perf_counter()))
+        except queue.Full:
+            raise QueueFullError("Cola de inferencia llena")
+        return future
+
+    async def classify(self, processed_image: np.ndarray) -> Tuple[Any, Any, Any, Any]:
+        """
+        Clasifica una imagen ya decodificada. La espera del lote no bloquea
+        el event loop, así las subidas concurrentes del mismo worker
+        alcanzan a juntarse en un lote. Devuelve (clase, confianza, versión,
+        embedding).
+        """
+        with span("inference"):
+            result = await asyncio.wrap_future(self.submit(processed_image))
+        if result is None:
+            return None, None, None, None
+        return (*self.model.interpret(result[0]), result[1], result[2])
+
+    async def classify_many(self, images: List[np.ndarray]) -> List[Tuple[Any, Any, Any, Any]]:
+        """
+        Clasifica muchas imágenes ya decodificadas. Se encolan de a
+        `max_batch_size` para formar lotes llenos sin acaparar la cola
+        compartida con otras peticiones. Devuelve (clase, confianza, versión,
+        embedding) por imagen.
+        """
+        return [
+            (None, None, None, None)
+            if result is None
+            else (*self.model.interpret(result[0]), result[1], result[2])
+            for result in await self._submit_chunked(images)
+        ]
+
+    async def _submit_chunked(self, images) -> List[Any]:
+        """
+        Resultados crudos de `submit` para cada imagen, encolando de a
+        `max_batch_size` y esperando cada tanda antes de la siguiente: una
+        sola petición nunca llena la cola compartida.
+        """
+        outputs: List[Any] = []
+        for start in range(0, len(images), self.max_batch_size):
+            futures: List[Future] = []
+            try:
+                for image in images[start:start + self.max_batch_size]:
+                    futures.append(self.submit(image))
+            except QueueFullError:
+                for future in futures:
+                    future.cancel()
+                raise
+            with span("inference"):
+                outputs.extend(
+                    await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+                )
+        return outputs
+
+    async def classify_tiles(self, tiles: np.ndarray, rows: int, cols: int,
+                             min_copper_fraction: float = 0.05):
+        """
+        Clasifica todos los tiles de una imagen (se encolan de a
+        `max_batch_size`, como en `classify_many`) y los agrega en (clase,
+        confianza, heatmap, versión, embedding). Si un hot-swap cae entre
+        lotes se informa la última versión. El embedding es el promedio de
+        los de cada tile.
+        """
+        outputs = await self._submit_chunked(tiles)
+        if any(result is None for result in outputs):
+            return None, None, None, None, None
+        embeddings = [embedding for _, _, embedding in outputs]
+        return (
+            *self.model.aggregate_tiles(
+                [row for row, _, _ in outputs], rows, cols, min_copper_fraction
+            ),
+            outputs[-1][1],
+            None if any(e is None for e in embeddings) else np.mean(embeddings, axis=0),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            batches = self._batches
+            images = self._images
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.maxsize,
+                "queued": self._queue.qsize(),
+                "batches": batches,
+                "images": images,
+                "avg_batch_size": round(images / batches, 3) if batches else 0.0,
+                "avg_occupancy": (
+                    round(images / (batches * self.max_batch_size), 4)
+                    if batches
+                    else 0.0
+                ),
+                "batch_size_histogram": {
+                    str(size): count
+                    for size, count in enumerate(self._batch_sizes)
+                    if count
+                },
+                "avg_queue_wait_ms": (
+                    round(self._queue_wait_total / images * 1000.0, 3)
+                    if images
+                    else 0.0
+                ),
+                "avg_inference_ms": (
+                    round(self._inference_total / batches * 1000.0, 3)
+                    if batches
+                    else 0.0
+                ),
+            }
+
+    # --------- hilo de inferencia ---------
+
+    def _collect(self) -> List[Tuple[np.ndarray, Future, float]]:
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _fill_buffer(self, images: List[np.ndarray]) -> np.ndarray:
+        shape = images[0].shape[-3:]
+        if self._buffer is None or self._buffer.shape[1:] != shape:
+            self._buffer = np.empty((self.max_batch_size, *shape), dtype=np.float32)
+        for i, image in enumerate(images):
+            normalize_into(image.reshape(shape), self._buffer[i])
+        return self._buffer[: len(images)]
+
+    def _run(self) -> None:
+        while True:
+            items = self._collect()
+            # Los Future cancelados no ocupan lugar en el lote
+            items = [item for item in items if item[1].set_running_or_notify_cancel()]
+            if not items:
+                continue
+
+            started = time.perf_counter()
+            try:
+                batch = self._fill_buffer([image for image, _, _ in items])
+                prediction, embeddings, version = self.model.predict_batch_embedded(batch)
+            except Exception as e:
+                print(f"❌ Error en lote de inferencia: {e}")
+                inference_errors.inc()
+                for _, future, _ in items:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            # Copia por fila: la salida no debe apuntar al buffer reutilizado
+            for i, (_, future, _) in enumerate(items):
+                future.set_result(
+                    None
+                    if prediction is None
+                    else (
+                        np.array(prediction[i]),
+                        version,
+                        None if embeddings is None else np.array(embeddings[i]),
+                    )
+                )
+            if self.shadow is not None and prediction is not None:
+                self.shadow.offer(batch, prediction, version)
+
+            batch_size_histogram.observe(len(items))
+            batch_seconds.observe(finished - started)
+            for _, _, queued in items:
+                queue_wait_seconds.observe(started - queued)
+            with self._stats_lock:
+                self._batches += 1
+                self._images += len(items)
+                self._batch_sizes[len(items)] += 1
+                self._queue_wait_total += sum(started - queued for _, _, queued in items)
+                self._inference_total += finished - started
+
+
+# Con el batching desactivado cada petición viaja sola (lote de 1, sin espera)
+copper_batcher = MicroBatcher(
+    copper_model,
+    max_batch_size=(
+        runtime_settings["batch_size"] if settings.INFERENCE_BATCHING_ENABLED else 1
+    ),
+    max_wait_ms=(
+        settings.INFERENCE_MAX_WAIT_MS if settings.INFERENCE_BATCHING_ENABLED else 0
+    ),
+    queue_depth=settings.INFERENCE_QUEUE_DEPTH,
+    shadow=shadow_runner,
+)
@@ -0,0 +1,234 @@
+# app/ml/inference/cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.db.mysql_connection import SessionLocal
+from app.db import models as db_models
+
+
+class CachedPrediction(NamedTuple):
+    resultado: str
+    confianza: float
+    id_clasificacion: Optional[int]
+
+
+def content_hash(data: bytes) -> str:
+    """SHA-256 hexadecimal de los bytes de la imagen."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+    """
+    Caché de predicciones por (hash del contenido, versión del modelo).
+
+    Capa LRU en memoria con límite de entradas y TTL, respaldada por la
+    tabla `predicciones_cache`; un acierto en BD se promueve a memoria.
+    Los métodos tocan la BD de forma síncrona: desde endpoints async se
+    llaman a través de `db_stage`.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[CachedPrediction, float]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits_memory": 0,
+            "hits_db": 0,
+            "misses": 0,
+            "evictions": 0,
+            "deduplicated": 0,
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def _remember(self, key: Tuple[str, str], value: CachedPrediction) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def _get_memory(self, key: Tuple[str, str]) -> Optional[CachedPrediction]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._counters["evictions"] += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def get(self, hash_imagen: str, version_modelo: str) -> Optional[CachedPrediction]:
+        key = (hash_imagen, version_modelo)
+        value = self._get_memory(key)
+        if value is not None:
+            self._count("hits_memory")
+            return value
+
+        db = SessionLocal()
+        try:
+            row = (
+                db.query(db_models.PrediccionCache)
+                .filter(
+                    db_models.PrediccionCache.hash_imagen == hash_imagen,
+                    db_models.PrediccionCache.version_modelo == version_modelo,
+                )
+                .first()
+            )
+        finally:
+            db.close()
+
+        if row is None:
+            self._count("misses")
+            return None
+
+        value = CachedPrediction(row.resultado, float(row.confianza), row.id_clasificacion)
+        self._remember(key, value)
+        self._count("hits_db")
+        return value
+
+    def get_many(
+        self, hashes: List[str], version_modelo: str
+    ) -> Dict[str, CachedPrediction]:
+        """Como `get` para varios hashes, con una sola consulta a BD."""
+        found: Dict[str, CachedPrediction] = {}
+        pending = []
+        for hash_imagen in dict.fromkeys(hashes):
+            value = self._get_memory((hash_imagen, version_modelo))
+            if value is not None:
+                found[hash_imagen] = value
+                self._count("hits_memory")
+            else:
+                pending.append(hash_imagen)
+
+        if pending:
+            db = SessionLocal()
+            try:
+                rows = (
+                    db.query(db_models.PrediccionCache)
+                    .filter(
+                        db_models.PrediccionCache.hash_imagen.in_(pending),
+                        db_models.PrediccionCache.version_modelo == version_modelo,
+                    )
+                    .all()
+                )
+            finally:
+                db.close()
+            for row in rows:
+                value = CachedPrediction(
+                    row.resultado, float(row.confianza), row.id_clasificacion
+                )
+                self._remember((row.hash_imagen, version_modelo), value)
+                found[row.hash_imagen] = value
+                self._count("hits_db")
+            for _ in range(len(pending) - len(rows)):
+                self._count("misses")
+        return found
+
+    def put(
+        self,
+        hash_imagen: str,
+        version_modelo: str,
+        resultado: str,
+        confianza: float,
+        id_clasificacion: Optional[int] = None,
+    ) -> None:
+        value = CachedPrediction(resultado, float(confianza), id_clasificacion)
+        self._remember((hash_imagen, version_modelo), value)
+
+        db = SessionLocal()
+        try:
+            db.add(
+                db_models.PrediccionCache(
+                    hash_imagen=hash_imagen,
+                    version_modelo=version_modelo,
+                    resultado=resultado,
+                    confianza=float(confianza),
+                    id_clasificacion=id_clasificacion,
+                )
+            )
+            db.commit()
+        except IntegrityError:
+            # Otra subida concurrente de la misma imagen ya la guardó
+            db.rollback()
+        finally:
+            db.close()
+
+    def put_many(
+        self,
+        version_modelo: str,
+        entries: List[Tuple[str, str, float, Optional[int]]],
+    ) -> None:
+        """
+        Guarda varias predicciones (hash, resultado, confianza,
+        id_clasificacion) en un solo commit.
+        """
+        if not entries:
+            return
+        for hash_imagen, resultado, confianza, id_clasificacion in entries:
+            self._remember(
+                (hash_imagen, version_modelo),
+                CachedPrediction(resultado, float(confianza), id_clasificacion),
+            )
+
+        db = SessionLocal()
+        try:
+            db.add_all(
+                [
+                    db_models.PrediccionCache(
+                        hash_imagen=hash_imagen,
+                        version_modelo=version_modelo,
+                        resultado=resultado,
+                        confianza=float(confianza),
+                        id_clasificacion=id_clasificacion,
+                    )
+                    for hash_imagen, resultado, confianza, id_clasificacion in entries
+                ]
+            )
+            db.commit()
+        except IntegrityError:
+            # Alguna ya existía: se reintenta una por una
+            db.rollback()
+            for hash_imagen, resultado, confianza, id_clasificacion in entries:
+                self.put(hash_imagen, version_modelo, resultado, confianza, id_clasificacion)
+        finally:
+            db.close()
+
+    def mark_deduplicated(self) -> None:
+        self._count("deduplicated")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        lookups = counters["hits_memory"] + counters["hits_db"] + counters["misses"]
+        hits = counters["hits_memory"] + counters["hits_db"]
+        return {
+            "enabled": settings.PREDICTION_CACHE_ENABLED,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            **counters,
+        }
+
+
+prediction_cache = PredictionCache(
+    max_entries=settings.PREDICTION_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.PREDICTION_CACHE_TTL_SECONDS,
+)
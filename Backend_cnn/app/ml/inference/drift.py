@@ -0,0 +1,518 @@
+# app/ml/inference/drift.py
+"""
+Distribución de confianza de las predicciones servidas y detección de
+drift (p. ej. una cámara o una iluminación nueva en una faena).
+
+Cada predicción guardada suma, en O(1) y memoria constante, a un
+acumulado por (versión del modelo, zona, ventana de tiempo):
+
+- conteo total y de `con_cobre` (balance de clases);
+- media y varianza de la confianza con el algoritmo de Welford;
+- histograma de P(cobre) en HISTOGRAM_BINS intervalos fijos.
+
+Los acumulados de cada proceso se suman a `estadisticas_prediccion` cada
+DRIFT_FLUSH_SECONDS (combinación de Chan et al. para media y varianza),
+así las consultas leen unas pocas filas agregadas y nunca `clasificaciones`.
+
+El drift se mide con el PSI (population stability index) del histograma de
+cada zona frente a la referencia: la distribución sobre el conjunto de
+validación (comando `baseline`) o, si no hay, el historial de la misma
+versión anterior al período consultado.
+
+Uso (desde Backend_cnn/):
+    python -m app.ml.inference.drift baseline --images dataset/validacion
+    python -m app.ml.inference.drift report --hours 48
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.core.metrics import metrics_registry
+from app.db.mysql_connection import SessionLocal
+from app.db import models as db_models
+
+HISTOGRAM_BINS = 20
+DEFAULT_ZONE = "Zona no especificada"
+ZONE_MAX_LENGTH = 100
+# Piso de las proporciones en el PSI: un intervalo vacío no lo hace infinito
+PSI_EPSILON = 1e-4
+
+PREDICTIONS_TOTAL = metrics_registry.counter(
+    "mineria_predictions_total",
+    "Predicciones guardadas por versión del modelo y clase",
+    ("version", "clase"),
+)
+PREDICTION_CONFIDENCE = metrics_registry.histogram(
+    "mineria_prediction_confidence",
+    "Confianza (0-1) de las predicciones guardadas",
+    ("version",),
+    buckets=(0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 0.99, 1.0),
+)
+
+
+class RunningStats:
+    """Acumulado incremental de un grupo de predicciones."""
+
+    __slots__ = ("count", "copper", "mean", "m2", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.copper = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.histogram = [0] * HISTOGRAM_BINS
+
+    def add(self, copper_probability: float, confidence: float, is_copper: bool) -> None:
+        self.count += 1
+        self.copper += int(is_copper)
+        delta = confidence - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (confidence - self.mean)
+        index = min(max(int(copper_probability * HISTOGRAM_BINS), 0), HISTOGRAM_BINS - 1)
+        self.histogram[index] += 1
+
+    def merge(self, other: "RunningStats") -> "RunningStats":
+        if other.count == 0:
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.copper += other.copper
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        return self
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    @property
+    def copper_rate(self) -> Optional[float]:
+        return self.copper / self.count if self.count else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "copper": self.copper,
+            "mean": self.mean,
+            "m2": self.m2,
+            "histogram": list(self.histogram),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunningStats":
+        stats = cls()
+        stats.count = int(data.get("count", 0))
+        stats.copper = int(data.get("copper", 0))
+        stats.mean = float(data.get("mean", 0.0))
+        stats.m2 = float(data.get("m2", 0.0))
+        histogram = [int(v) for v in data.get("histogram") or []]
+        if len(histogram) != HISTOGRAM_BINS:
+            raise ValueError(f"El histograma debe tener {HISTOGRAM_BINS} intervalos")
+        stats.histogram = histogram
+        return stats
+
+    @classmethod
+    def from_row(cls, row: db_models.EstadisticaPrediccion) -> "RunningStats":
+        return cls.from_dict(
+            {
+                "count": row.total,
+                "copper": row.con_cobre,
+                "mean": row.media_confianza,
+                "m2": row.m2_confianza,
+                "histogram": json.loads(row.histograma),
+            }
+        )
+
+
+def psi(current: RunningStats, reference: RunningStats) -> Optional[float]:
+    """Population stability index entre dos histogramas de P(cobre)."""
+    if not current.count or not reference.count:
+        return None
+    total = 0.0
+    for observed, expected in zip(current.histogram, reference.histogram):
+        a = max(observed / current.count, PSI_EPSILON)
+        e = max(expected / reference.count, PSI_EPSILON)
+        total += (a - e) * math.log(a / e)
+    return total
+
+
+def normalize_zone(zone: Any) -> str:
+    return (str(zone or "").strip() or DEFAULT_ZONE)[:ZONE_MAX_LENGTH]
+
+
+def drift_status(stats: RunningStats, value: Optional[float]) -> str:
+    if value is None:
+        return "sin_referencia"
+    if stats.count < settings.DRIFT_MIN_SAMPLES:
+        return "insuficiente"
+    if value >= settings.DRIFT_PSI_ALERT:
+        return "drift"
+    if value >= settings.DRIFT_PSI_WARN:
+        return "alerta"
+    return "ok"
+
+
+class DriftMonitor:
+    """
+    Acumula las predicciones del proceso y las suma periódicamente a la BD.
+
+    `record` solo toca un dict bajo un lock; un hilo propio (se inicia con
+    la primera predicción) hace los flush. Si la BD falla, los acumulados
+    vuelven a la espera y se suman en el siguiente intento.
+    """
+
+    def __init__(self, window_minutes: int, flush_seconds: float, retention_days: int,
+                 baseline_path: str, enabled: bool = True):
+        self.window = timedelta(minutes=max(1, window_minutes))
+        self.flush_seconds = flush_seconds
+        self.retention = timedelta(days=max(1, retention_days))
+        self.baseline_path = baseline_path
+        self.enabled = enabled
+        self._pending: Dict[Tuple[str, str, datetime], RunningStats] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_purge = 0.0
+
+    def window_start(self, moment: datetime) -> datetime:
+        epoch = datetime(2000, 1, 1)
+        return moment - (moment - epoch) % self.window
+
+    # --------- registro ---------
+
+    def record(self, version: str, zone: Any, predicted_class: str, confidence: float,
+               moment: Optional[datetime] = None) -> None:
+        """Suma una predicción; `confidence` en porcentaje, como se guarda."""
+        if not self.enabled or predicted_class is None or confidence is None:
+            return
+        conf = min(max(float(confidence) / 100.0, 0.0), 1.0)
+        is_copper = predicted_class == "con_cobre"
+        copper_probability = conf if is_copper else 1.0 - conf
+        key = (
+            str(version),
+            normalize_zone(zone),
+            self.window_start(moment or datetime.now()),
+        )
+        with self._lock:
+            stats = self._pending.get(key)
+            if stats is None:
+                stats = self._pending[key] = RunningStats()
+            stats.add(copper_probability, conf, is_copper)
+        PREDICTIONS_TOTAL.inc(version=version, clase=predicted_class)
+        PREDICTION_CONFIDENCE.observe(conf, version=version)
+        self._start()
+
+    def _start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="drift-flush", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ No se pudieron guardar las estadísticas de predicción: {e}")
+
+    # --------- persistencia ---------
+
+    def _merge_rows(self, db, pending: Dict[Tuple[str, str, datetime], RunningStats]) -> None:
+        E = db_models.EstadisticaPrediccion
+        # Orden fijo de claves: dos procesos no se bloquean en cruz
+        for (version, zone, window), stats in sorted(pending.items()):
+            row = (
+                db.query(E)
+                .filter(E.version_modelo == version, E.zona == zone, E.ventana == window)
+                .with_for_update()
+                .one_or_none()
+            )
+            if row is None:
+                merged = RunningStats().merge(stats)
+                row = E(version_modelo=version, zona=zone, ventana=window)
+                db.add(row)
+            else:
+                merged = RunningStats.from_row(row).merge(stats)
+            row.total = merged.count
+            row.con_cobre = merged.copper
+            row.media_confianza = merged.mean
+            row.m2_confianza = merged.m2
+            row.histograma = json.dumps(merged.histogram)
+            db.flush()
+
+    def flush(self, db=None) -> int:
+        """Suma a la BD los acumulados pendientes. Devuelve cuántos grupos."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            own_session = db is None
+            db = db or SessionLocal()
+            try:
+                for attempt in (1, 2):
+                    try:
+                        self._merge_rows(db, pending)
+                        db.commit()
+                        break
+                    except IntegrityError:
+                        # Otro proceso creó la misma fila: se reintenta sumando
+                        db.rollback()
+                        if attempt == 2:
+                            raise
+                self._purge(db)
+            except Exception:
+                db.rollback()
+                with self._lock:
+                    for key, stats in pending.items():
+                        newer = self._pending.get(key)
+                        self._pending[key] = stats.merge(newer) if newer else stats
+                raise
+            finally:
+                if own_session:
+                    db.close()
+            return len(pending)
+
+    def _purge(self, db) -> None:
+        if time.monotonic() - self._last_purge < 3600:
+            return
+        self._last_purge = time.monotonic()
+        E = db_models.EstadisticaPrediccion
+        db.query(E).filter(E.ventana < datetime.now() - self.retention).delete(
+            synchronize_session=False
+        )
+        db.commit()
+
+    # --------- referencia ---------
+
+    def _read_baselines(self) -> Dict[str, Any]:
+        try:
+            with open(self.baseline_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_baseline(self, version: str, stats: RunningStats, source: str) -> None:
+        baselines = self._read_baselines()
+        baselines[version] = {
+            **stats.to_dict(),
+            "source": source,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        os.makedirs(os.path.dirname(self.baseline_path) or ".", exist_ok=True)
+        tmp_path = f"{self.baseline_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.baseline_path)
+
+    def baseline(self, version: str) -> Optional[Dict[str, Any]]:
+        """Distribución de validación de `version` (registro o DRIFT_BASELINE_PATH)."""
+        from app.ml.models.registry import model_registry
+
+        candidates = []
+        try:
+            meta = model_registry.get(version)
+        except ValueError:
+            meta = None
+        if meta:
+            candidates.append(((meta.get("metrics") or {}).get("drift_baseline"), "registro"))
+        candidates.append((self._read_baselines().get(version), "validacion"))
+        for data, source in candidates:
+            if not data:
+                continue
+            try:
+                return {"stats": RunningStats.from_dict(data), "source": data.get("source") or source}
+            except (TypeError, ValueError) as e:
+                print(f"⚠️ Referencia de drift inválida para {version}: {e}")
+        return None
+
+    # --------- consulta ---------
+
+    def _describe(self, stats: RunningStats, reference: Optional[RunningStats]) -> Dict[str, Any]:
+        value = psi(stats, reference) if reference is not None else None
+        return {
+            "count": stats.count,
+            "copperRate": round(stats.copper_rate, 4) if stats.count else None,
+            "confidenceMean": round(stats.mean, 4) if stats.count else None,
+            "confidenceStd": round(stats.std, 4) if stats.count else None,
+            "copperRateDelta": (
+                round(stats.copper_rate - reference.copper_rate, 4)
+                if stats.count and reference is not None and reference.count
+                else None
+            ),
+            "confidenceDelta": (
+                round(stats.mean - reference.mean, 4)
+                if stats.count and reference is not None and reference.count
+                else None
+            ),
+            "psi": round(value, 4) if value is not None else None,
+            "status": drift_status(stats, value),
+            "histogram": list(stats.histogram),
+        }
+
+    def report(self, db, version: str, zone: Optional[str] = None,
+               hours: float = 24) -> Dict[str, Any]:
+        """
+        Distribución de las últimas `hours` horas por zona frente a la
+        referencia. Con `zone`, además la serie por ventana de esa zona.
+        """
+        self.flush(db)
+        E = db_models.EstadisticaPrediccion
+        since = self.window_start(datetime.now() - timedelta(hours=hours))
+        query = db.query(E).filter(E.version_modelo == version)
+        if zone is not None:
+            query = query.filter(E.zona == normalize_zone(zone))
+
+        baseline = self.baseline(version)
+        history = RunningStats()
+        by_zone: Dict[str, RunningStats] = {}
+        series: List[Tuple[datetime, RunningStats]] = []
+        for row in query.order_by(E.ventana):
+            stats = RunningStats.from_row(row)
+            if row.ventana < since:
+                if baseline is None:
+                    history.merge(stats)
+                continue
+            by_zone.setdefault(row.zona, RunningStats()).merge(stats)
+            if zone is not None:
+                series.append((row.ventana, stats))
+
+        if baseline is not None:
+            reference, source = baseline["stats"], baseline["source"]
+        elif history.count:
+            reference, source = history, "historial"
+        else:
+            reference, source = None, None
+
+        total = RunningStats()
+        zones = []
+        for name, stats in by_zone.items():
+            total.merge(stats)
+            zones.append({"zone": name, **self._describe(stats, reference)})
+        zones.sort(key=lambda z: (z["psi"] is None, -(z["psi"] or 0.0), z["zone"]))
+
+        result = {
+            "version": version,
+            "from": since.isoformat(),
+            "windowMinutes": int(self.window.total_seconds() // 60),
+            "bins": HISTOGRAM_BINS,
+            "reference": (
+                {
+                    "source": source,
+                    **{
+                        k: v
+                        for k, v in self._describe(reference, None).items()
+                        if k not in ("copperRateDelta", "confidenceDelta", "psi", "status")
+                    },
+                }
+                if reference is not None
+                else None
+            ),
+            "overall": self._describe(total, reference),
+            "zones": zones,
+        }
+        if zone is not None:
+            result["series"] = [
+                {"window": window.isoformat(), **self._describe(stats, reference)}
+                for window, stats in series
+            ]
+        return result
+
+
+def compute_baseline(images_dir: str, batch_size: int = 32) -> Tuple[str, RunningStats]:
+    """Corre el modelo en servicio sobre las imágenes de validación."""
+    from app.ml.models.cnn_model import copper_model
+    from app.ml.utils.decoding import load_image_array
+    import numpy as np
+
+    if not copper_model.load_model():
+        raise RuntimeError(copper_model.last_error or "No se pudo cargar el modelo")
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(images_dir)
+        for name in files
+        if os.path.splitext(name)[1].lower() in (".jpg", ".jpeg", ".png")
+    )
+    if not paths:
+        raise ValueError(f"No hay imágenes en {images_dir}")
+
+    size = (copper_model.img_width, copper_model.img_height)
+    stats = RunningStats()
+    version = copper_model.version
+    for start in range(0, len(paths), batch_size):
+        images = []
+        for path in paths[start:start + batch_size]:
+            try:
+                images.append(load_image_array(path, size, fast=copper_model.fast_decode)[0])
+            except Exception as e:
+                print(f"⚠️ {path}: {e}")
+        if not images:
+            continue
+        prediction, version = copper_model.predict_batch_versioned(np.stack(images))
+        for row in prediction:
+            predicted_class, confidence = copper_model.interpret(row)
+            stats.add(copper_model.copper_probability(row), confidence / 100.0,
+                      predicted_class == "con_cobre")
+        print(f"📊 {stats.count}/{len(paths)} imágenes")
+    return version, stats
+
+
+drift_monitor = DriftMonitor(
+    window_minutes=settings.DRIFT_WINDOW_MINUTES,
+    flush_seconds=settings.DRIFT_FLUSH_SECONDS,
+    retention_days=settings.DRIFT_RETENTION_DAYS,
+    baseline_path=settings.DRIFT_BASELINE_PATH,
+    enabled=settings.DRIFT_ENABLED,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    base = commands.add_parser("baseline", help="Referencia desde el conjunto de validación")
+    base.add_argument("--images", required=True, help="Carpeta con las imágenes (recursiva)")
+    base.add_argument("--batch-size", type=int, default=32)
+    report = commands.add_parser("report", help="Distribución y drift por zona")
+    report.add_argument("--version", default=None, help="Por defecto, la activa")
+    report.add_argument("--zone", default=None)
+    report.add_argument("--hours", type=float, default=24)
+    args = parser.parse_args(argv)
+
+    if args.command == "baseline":
+        version, stats = compute_baseline(args.images, args.batch_size)
+        drift_monitor.save_baseline(version, stats, f"validacion:{os.path.abspath(args.images)}")
+        print(
+            f"✅ Referencia de {version}: {stats.count} imágenes, "
+            f"{stats.copper_rate:.1%} con cobre, confianza media {stats.mean:.3f} "
+            f"-> {drift_monitor.baseline_path}"
+        )
+    elif args.command == "report":
+        from app.ml.models.cnn_model import copper_model
+
+        db = SessionLocal()
+        try:
+            result = drift_monitor.report(db, args.version or copper_model.version, args.zone, args.hours)
+        finally:
+            db.close()
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
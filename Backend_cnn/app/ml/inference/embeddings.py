@@ -0,0 +1,509 @@
+# app/ml/inference/embeddings.py
+"""
+Embeddings de las imágenes analizadas y búsqueda de análisis similares.
+
+El embedding es la salida de GlobalAveragePooling de MobileNetV2 (1280
+valores), que el modelo ya calcula antes de la cabeza sigmoid. Se guarda
+normalizado (norma 1) en float16, así la similitud coseno es un producto
+punto.
+
+Almacenamiento: por versión del modelo (cada versión tiene su propio
+espacio de embeddings) un archivo de registros de tamaño fijo
+(id_clasificacion, id_usuario, vector) al que todos los procesos agregan
+bajo `flock` y que se lee con `np.memmap`, sin cargarlo entero en memoria.
+
+Búsqueda: hasta EMBEDDINGS_IVF_MIN_VECTORS vectores, fuerza bruta
+vectorizada por bloques. Desde ahí un índice IVF: k-means sobre una
+muestra, cada vector queda asignado a su centroide más cercano y una
+consulta solo compara contra las `nprobe` listas más cercanas. El índice
+se entrena en segundo plano, se guarda en `ivf.npz` y el resto de los
+procesos lo reutiliza.
+
+Uso (desde Backend_cnn/):
+    python -m app.ml.inference.embeddings stats
+    python -m app.ml.inference.embeddings train
+    python -m app.ml.inference.embeddings backfill --limit 5000
+"""
+import argparse
+import fcntl
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+VECTORS_FILE = "vectors.bin"
+META_FILE = "meta.json"
+IVF_FILE = "ivf.npz"
+LOCK_FILE = ".lock"
+TRAIN_LOCK_FILE = ".train.lock"
+
+# Filas por bloque al recorrer el memmap (acota la memoria temporal)
+SCAN_CHUNK = 16384
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 32
+MAX_IVF_LISTS = 1024
+
+
+def record_dtype(dim: int) -> np.dtype:
+    return np.dtype([("id", "<i8"), ("user", "<i4"), ("vec", "<f2", (dim,))])
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _safe_name(version: str) -> str:
+    # Las versiones sin registro traen ':' (motor:archivo:mtime)
+    return re.sub(r"[^A-Za-z0-9._-]", "_", version)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Índices de los k puntajes más altos, ordenados de mayor a menor."""
+    if len(scores) > k:
+        picked = np.argpartition(-scores, k - 1)[:k]
+    else:
+        picked = np.arange(len(scores))
+    return picked[np.argsort(-scores[picked], kind="stable")]
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Centroide más cercano (producto punto máximo) de cada fila."""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SCAN_CHUNK):
+        chunk = np.asarray(vectors[start:start + SCAN_CHUNK], dtype=np.float32)
+        out[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+def train_kmeans(vectors: np.ndarray, lists: int, seed: int = 0) -> np.ndarray:
+    """
+    K-means esférico sobre una muestra de `vectors` (normalizados).
+    Devuelve los centroides (lists, D) normalizados.
+    """
+    rng = np.random.default_rng(seed)
+    samples = min(len(vectors), lists * KMEANS_SAMPLES_PER_LIST)
+    picked = np.sort(rng.choice(len(vectors), samples, replace=False))
+    sample = np.asarray(vectors[picked], dtype=np.float32)
+    centroids = sample[rng.choice(samples, lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=lists)
+        empty = counts == 0
+        # Una lista vacía se reinicia con un punto al azar
+        sums[empty] = sample[rng.choice(samples, int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class EmbeddingIndex:
+    """Embeddings e índice de una versión del modelo."""
+
+    def __init__(self, root: str, version: str, ivf_min_vectors: int, nprobe: int):
+        self.version = version
+        self.dir = os.path.join(root, _safe_name(version))
+        self.path = os.path.join(self.dir, VECTORS_FILE)
+        self.ivf_min_vectors = max(1, ivf_min_vectors)
+        self.nprobe = max(1, nprobe)
+        self.dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self._training = False
+        self._train_after = 0.0
+        # Estado leído del archivo (se amplía en `refresh`)
+        self._records: Optional[np.memmap] = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._users = np.empty(0, dtype=np.int32)
+        # IVF: centroides, lista de cada fila y filas con que se entrenó
+        self._centroids: Optional[np.ndarray] = None
+        self._assignment = np.empty(0, dtype=np.int32)
+        self._ivf_rows = 0
+        self._ivf_mtime = 0
+
+    # --------- archivo ---------
+
+    def _read_dim(self) -> Optional[int]:
+        if self.dim is None:
+            try:
+                with open(os.path.join(self.dir, META_FILE), encoding="utf-8") as f:
+                    self.dim = int(json.load(f)["dim"])
+            except (OSError, ValueError, KeyError):
+                return None
+        return self.dim
+
+    def append(self, rows: List[Tuple[int, int, np.ndarray]]) -> None:
+        """Agrega (id_clasificacion, id_usuario, embedding) al archivo."""
+        if not rows:
+            return
+        vectors = normalize(np.stack([np.ravel(vector) for _, _, vector in rows]))
+        os.makedirs(self.dir, exist_ok=True)
+        with open(os.path.join(self.dir, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dim = self._read_dim()
+            if dim is None:
+                dim = self.dim = vectors.shape[1]
+                with open(os.path.join(self.dir, META_FILE), "w", encoding="utf-8") as f:
+                    json.dump({"version": self.version, "dim": dim}, f)
+            if vectors.shape[1] != dim:
+                raise ValueError(f"Embedding de {vectors.shape[1]} valores, se esperaban {dim}")
+
+            records = np.empty(len(rows), dtype=record_dtype(dim))
+            records["id"] = [id_clasificacion for id_clasificacion, _, _ in rows]
+            records["user"] = [id_usuario for _, id_usuario, _ in rows]
+            records["vec"] = vectors
+            with open(self.path, "ab") as f:
+                # Un registro a medias (proceso caído mientras escribía) se descarta
+                size = f.tell()
+                partial = size % records.itemsize
+                if partial:
+                    f.truncate(size - partial)
+                f.write(records.tobytes())
+
+    def count(self) -> int:
+        dim = self._read_dim()
+        if dim is None:
+            return 0
+        try:
+            return os.path.getsize(self.path) // record_dtype(dim).itemsize
+        except OSError:
+            return 0
+
+    # --------- estado en memoria ---------
+
+    def refresh(self) -> None:
+        """Mapea los registros nuevos y mantiene al día el IVF."""
+        with self._lock:
+            rows = self.count()
+            if rows != len(self._ids):
+                self._records = np.memmap(
+                    self.path, dtype=record_dtype(self.dim), mode="r", shape=(rows,)
+                )
+                # ids y usuarios se copian a memoria (12 bytes por fila)
+                start = len(self._ids)
+                self._ids = np.concatenate([self._ids, self._records["id"][start:]])
+                self._users = np.concatenate([self._users, self._records["user"][start:]])
+            self._load_ivf()
+            if self._centroids is not None and len(self._assignment) < rows:
+                tail = self._records["vec"][len(self._assignment):rows]
+                self._assignment = np.concatenate(
+                    [self._assignment, _assign(tail, self._centroids)]
+                )
+            needs_training = rows >= self.ivf_min_vectors and (
+                self._centroids is None or rows >= 2 * self._ivf_rows
+            )
+        if needs_training:
+            self._start_training()
+
+    def _load_ivf(self) -> None:
+        path = os.path.join(self.dir, IVF_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._ivf_mtime:
+            return
+        with np.load(path) as data:
+            self._centroids = data["centroids"]
+            assignment = data["assignment"]
+        # Las filas agregadas después del entrenamiento se asignan en `refresh`
+        self._assignment = assignment[: len(self._ids)]
+        self._ivf_rows = int(len(assignment))
+        self._ivf_mtime = mtime
+
+    def _start_training(self) -> None:
+        with self._lock:
+            if self._training or time.monotonic() < self._train_after:
+                return
+            self._training = True
+        threading.Thread(
+            target=self.train, name=f"ivf-train-{self.version}", daemon=True
+        ).start()
+
+    def train(self) -> bool:
+        """
+        Entrena el IVF sobre los vectores actuales y lo publica en ivf.npz.
+        Si otro proceso ya está entrenando esta versión, no hace nada.
+        """
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            with open(os.path.join(self.dir, TRAIN_LOCK_FILE), "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+                rows = self.count()
+                if rows == 0:
+                    return False
+                records = np.memmap(
+                    self.path, dtype=record_dtype(self.dim), mode="r", shape=(rows,)
+                )
+                started = time.perf_counter()
+                lists = int(min(MAX_IVF_LISTS, max(1, np.sqrt(rows))))
+                centroids = train_kmeans(records["vec"], lists)
+                assignment = _assign(records["vec"], centroids)
+                tmp_path = os.path.join(self.dir, f"ivf.tmp-{os.getpid()}.npz")
+                np.savez(tmp_path, centroids=centroids, assignment=assignment)
+                os.replace(tmp_path, os.path.join(self.dir, IVF_FILE))
+                print(
+                    f"🧭 IVF {self.version}: {rows} vectores, {lists} listas "
+                    f"en {time.perf_counter() - started:.1f}s"
+                )
+                return True
+        except Exception as e:
+            print(f"❌ Error entrenando el índice de embeddings {self.version}: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._training = False
+                # Si otro proceso está entrenando, no reintentar en cada consulta
+                self._train_after = time.monotonic() + 60.0
+
+    # --------- consultas ---------
+
+    def get(self, id_clasificacion: int) -> Optional[np.ndarray]:
+        self.refresh()
+        with self._lock:
+            rows = np.flatnonzero(self._ids == id_clasificacion)
+            if not len(rows):
+                return None
+            return np.asarray(self._records["vec"][rows[-1]], dtype=np.float32)
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        user: Optional[int] = None,
+        exclude: Optional[int] = None,
+    ) -> List[Tuple[int, float]]:
+        """Los k vectores más parecidos a `query`: [(id_clasificacion, similitud)]."""
+        self.refresh()
+        query = normalize(query).ravel()
+        with self._lock:
+            records, ids, users = self._records, self._ids, self._users
+            centroids, assignment = self._centroids, self._assignment
+        if records is None or not len(ids):
+            return []
+
+        allowed = np.ones(len(ids), dtype=bool)
+        if user is not None:
+            allowed &= users == user
+        if exclude is not None:
+            allowed &= ids != exclude
+
+        if centroids is None or len(ids) < self.ivf_min_vectors:
+            candidates = np.flatnonzero(allowed)
+            scores = self._scores(records, candidates, query)
+        else:
+            # Se amplía nprobe hasta juntar k candidatos permitidos
+            ranking = np.argsort(-(centroids @ query))
+            nprobe = self.nprobe
+            while True:
+                probe = np.zeros(len(centroids), dtype=bool)
+                probe[ranking[:nprobe]] = True
+                candidates = np.flatnonzero(probe[assignment] & allowed[: len(assignment)])
+                if len(candidates) >= k or nprobe >= len(centroids):
+                    break
+                nprobe *= 4
+            scores = self._scores(records, candidates, query)
+
+        best = _top_k(scores, k)
+        # float16 puede pasarse levemente de 1
+        return [(int(ids[candidates[i]]), min(1.0, float(scores[i]))) for i in best]
+
+    @staticmethod
+    def _scores(records: np.memmap, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(rows), dtype=np.float32)
+        vectors = records["vec"]
+        for start in range(0, len(rows), SCAN_CHUNK):
+            chunk = rows[start:start + SCAN_CHUNK]
+            if len(chunk) and chunk[-1] - chunk[0] + 1 == len(chunk):
+                # Filas contiguas: rebanada del memmap, sin indexado por lista
+                block = vectors[chunk[0]:chunk[-1] + 1]
+            else:
+                block = vectors[chunk]
+            scores[start:start + len(chunk)] = np.asarray(block, dtype=np.float32) @ query
+        return scores
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "version": self.version,
+                "vectors": len(self._ids),
+                "dim": self.dim,
+                "index": "ivf" if self._centroids is not None else "brute_force",
+                "ivf_lists": None if self._centroids is None else len(self._centroids),
+                "ivf_trained_rows": self._ivf_rows or None,
+                "training": self._training,
+            }
+
+
+class EmbeddingStore:
+    """Índices por versión del modelo, creados bajo demanda."""
+
+    def __init__(self, root: str, ivf_min_vectors: int, nprobe: int):
+        self.root = root
+        self.ivf_min_vectors = ivf_min_vectors
+        self.nprobe = nprobe
+        self._indexes: Dict[str, EmbeddingIndex] = {}
+        self._lock = threading.Lock()
+
+    def index(self, version: str) -> EmbeddingIndex:
+        with self._lock:
+            index = self._indexes.get(version)
+            if index is None:
+                index = self._indexes[version] = EmbeddingIndex(
+                    self.root, version, self.ivf_min_vectors, self.nprobe
+                )
+            return index
+
+    def add(self, version: str, rows: Iterable[Tuple[int, int, Optional[np.ndarray]]]) -> int:
+        """Guarda (id_clasificacion, id_usuario, embedding); ignora los None."""
+        rows = [row for row in rows if row[2] is not None]
+        if not settings.EMBEDDINGS_ENABLED or not version or not rows:
+            return 0
+        try:
+            self.index(version).append(rows)
+        except Exception as e:
+            print(f"⚠️ No se pudieron guardar embeddings ({version}): {e}")
+            return 0
+        return len(rows)
+
+    def add_from(self, version: str, source_id: int, id_clasificacion: int, id_usuario: int) -> int:
+        """Reutiliza el embedding de otro análisis de la misma imagen (caché)."""
+        return self.add(
+            version, [(id_clasificacion, id_usuario, self.get(version, source_id))]
+        )
+
+    def get(self, version: str, id_clasificacion: int) -> Optional[np.ndarray]:
+        if not version:
+            return None
+        return self.index(version).get(id_clasificacion)
+
+    def similar(
+        self, version: str, id_clasificacion: int, k: int, user: Optional[int] = None
+    ) -> Optional[List[Tuple[int, float]]]:
+        """Análisis más parecidos a uno dado; None si no tiene embedding."""
+        index = self.index(version)
+        query = index.get(id_clasificacion)
+        if query is None:
+            return None
+        return index.search(query, k, user=user, exclude=id_clasificacion)
+
+    def versions(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        versions = []
+        for name in sorted(os.listdir(self.root)):
+            try:
+                with open(os.path.join(self.root, name, META_FILE), encoding="utf-8") as f:
+                    versions.append(json.load(f)["version"])
+            except (OSError, ValueError, KeyError):
+                continue
+        return versions
+
+    def stats(self) -> List[Dict[str, Any]]:
+        stats = []
+        for version in self.versions():
+            index = self.index(version)
+            index.refresh()
+            stats.append(index.stats())
+        return stats
+
+
+embedding_store = EmbeddingStore(
+    settings.EMBEDDINGS_DIR,
+    ivf_min_vectors=settings.EMBEDDINGS_IVF_MIN_VECTORS,
+    nprobe=settings.EMBEDDINGS_IVF_NPROBE,
+)
+
+
+def backfill(limit: Optional[int] = None, batch_size: int = 16) -> int:
+    """
+    Calcula embeddings de clasificaciones guardadas que no los tienen,
+    releyendo la imagen original. Solo para la versión que se sirve hoy
+    (los embeddings de versiones distintas no son comparables).
+    """
+    from app.db import models as db_models
+    from app.db.mysql_connection import SessionLocal
+    from app.ml.models.cnn_model import MODEL_VERSION_MAX_LENGTH, copper_model
+    from app.ml.utils.decoding import load_image_array
+
+    if not copper_model.load_model():
+        return 0
+    version = copper_model.version
+    index = embedding_store.index(version)
+    index.refresh()
+    known = set(index._ids.tolist())
+    size = (copper_model.img_width, copper_model.img_height)
+
+    db = SessionLocal()
+    added = 0
+    try:
+        query = (
+            db.query(db_models.Clasificacion, db_models.Imagen)
+            .join(db_models.Imagen, db_models.Imagen.id_imagen == db_models.Clasificacion.id_imagen)
+            .filter(db_models.Clasificacion.modelo_usado == version[:MODEL_VERSION_MAX_LENGTH])
+            .order_by(db_models.Clasificacion.id_clasificacion)
+        )
+        pending = [
+            (clasif.id_clasificacion, imagen.id_usuario, imagen.ruta_archivo)
+            for clasif, imagen in query
+            if clasif.id_clasificacion not in known
+        ][:limit]
+        for start in range(0, len(pending), batch_size):
+            rows, images = [], []
+            for id_clasificacion, id_usuario, path in pending[start:start + batch_size]:
+                try:
+                    images.append(load_image_array(path, size, fast=copper_model.fast_decode)[0])
+                    rows.append((id_clasificacion, id_usuario))
+                except Exception as e:
+                    print(f"⚠️ {path}: {e}")
+            if not images:
+                continue
+            _, embeddings, used_version = copper_model.predict_batch_embedded(np.stack(images))
+            if embeddings is None:
+                print("❌ El motor en uso no entrega embeddings (usar el backend keras)")
+                break
+            added += embedding_store.add(
+                used_version,
+                [(i, u, e) for (i, u), e in zip(rows, embeddings)],
+            )
+            print(f"🧩 {added}/{len(pending)} embeddings")
+    finally:
+        db.close()
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Vectores e índice por versión del modelo")
+    train = commands.add_parser("train", help="(Re)entrenar el IVF")
+    train.add_argument("--version", default=None, help="Por defecto, todas")
+    fill = commands.add_parser("backfill", help="Embeddings de análisis guardados")
+    fill.add_argument("--limit", type=int, default=None)
+    fill.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        for stats in embedding_store.stats():
+            print(json.dumps(stats, ensure_ascii=False))
+    elif args.command == "train":
+        for version in [args.version] if args.version else embedding_store.versions():
+            embedding_store.index(version).train()
+    elif args.command == "backfill":
+        print(f"✅ {backfill(args.limit, args.batch_size)} embeddings agregados")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,409 @@
+# app/ml/inference/explain.py
+"""
+Explicaciones Grad-CAM de las clasificaciones (por qué el modelo dijo
+`con_cobre` o `sin_cobre`), para la revisión de los análisis.
+
+Grad-CAM necesita gradientes, unas tres veces el costo de una inferencia,
+así que nunca corre durante la subida:
+
+- a pedido: GET /api/analysis/{id}/explanation encola la imagen y responde
+  202; un hilo propio junta los pedidos en lotes de
+  EXPLANATIONS_BATCH_SIZE y calcula los mapas en una sola pasada;
+- en bloque: el comando `bulk` procesa los análisis marcados (revisión no
+  aprobada, `es_correcto` falso o confianza baja).
+
+Cada mapa se superpone a la foto y se guarda como JPEG en
+`<EXPLANATIONS_DIR>/<versión>/<hash[:2]>/<hash>.jpg`: el archivo es la
+caché (misma imagen + misma versión del modelo => mismo mapa) y se sirve
+estático en /explanations, como /uploads.
+
+Uso (desde Backend_cnn/):
+    python -m app.ml.inference.explain bulk --flagged --max-confidence 70
+    python -m app.ml.inference.explain bulk --ids 12 15 40
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.core.config import settings
+from app.ml.inference.batcher import QueueFullError
+from app.ml.models.cnn_model import CopperCNN, copper_model
+from app.ml.utils.decoding import decode_image, normalize_into, open_image
+
+URL_PREFIX = "/explanations"
+# Tras un error se vuelve a intentar recién pasado este tiempo
+ERROR_RETRY_SECONDS = 300
+MAX_REMEMBERED_ERRORS = 1000
+
+
+def _safe_name(version: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", version)
+
+
+def _colormap(values: np.ndarray) -> np.ndarray:
+    """Escala tipo "jet": azul (0) -> verde -> amarillo -> rojo (1)."""
+    v = values[..., None] * 4.0
+    channels = np.concatenate([v - 3.0, v - 2.0, v - 1.0], axis=-1)
+    return np.clip(1.5 - np.abs(channels), 0.0, 1.0)
+
+
+def render_overlay(image_path: str, cam: np.ndarray, max_side: int = 768) -> bytes:
+    """Superpone el mapa Grad-CAM (h, w) a la foto y devuelve un JPEG."""
+    img = open_image(image_path)
+    if img.format == "JPEG":
+        img.draft("RGB", (max_side, max_side))
+    img = img.convert("RGB")
+    img.thumbnail((max_side, max_side))
+
+    heat = Image.fromarray(np.uint8(np.clip(cam, 0.0, 1.0) * 255), "L")
+    heat = np.asarray(heat.resize(img.size, Image.BILINEAR), dtype=np.float32) / 255.0
+    base = np.asarray(img, dtype=np.float32) / 255.0
+    # Más opaco donde el mapa es más fuerte: las zonas frías dejan ver la roca
+    alpha = 0.15 + 0.45 * heat[..., None]
+    blended = base * (1.0 - alpha) + _colormap(heat) * alpha
+
+    out = io.BytesIO()
+    Image.fromarray(np.uint8(blended * 255)).save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ExplanationService:
+    """
+    Caché en disco de las explicaciones y cola de pedidos pendientes.
+
+    `request` solo anota el pedido (un mismo hash se encola una vez aunque
+    lo pidan varios análisis); el hilo de la cola espera hasta
+    `max_wait_ms` a juntar un lote y llama a `explain_items`.
+    """
+
+    def __init__(self, model: CopperCNN, root: str, batch_size: int = 8,
+                 max_wait_ms: float = 200, queue_size: int = 256, max_side: int = 768,
+                 in_pdf: bool = False):
+        self.model = model
+        self.root = root
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_side = max_side
+        self.in_pdf = in_pdf
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=max(1, queue_size))
+        # hash -> (ruta de la imagen, análisis cuyo PDF espera la explicación)
+        self._pending: Dict[str, Tuple[str, Set[int]]] = {}
+        self._errors: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._counters = {"requested": 0, "generated": 0, "batches": 0, "errors": 0, "rejected": 0}
+
+    # --------- caché ---------
+
+    def path(self, version: str, hash_imagen: str) -> str:
+        return os.path.join(self.root, _safe_name(version), hash_imagen[:2], f"{hash_imagen}.jpg")
+
+    def url(self, version: str, hash_imagen: str) -> str:
+        return f"{URL_PREFIX}/{_safe_name(version)}/{hash_imagen[:2]}/{hash_imagen}.jpg"
+
+    def find(self, hash_imagen: Optional[str], version: Optional[str]) -> Optional[Tuple[str, str]]:
+        """
+        (versión, ruta) de la explicación ya generada: primero con la versión
+        que clasificó la imagen y, si no, con la que se sirve ahora.
+        """
+        if not hash_imagen:
+            return None
+        for candidate in dict.fromkeys(v for v in (version, self.model.version) if v):
+            path = self.path(candidate, hash_imagen)
+            if os.path.exists(path):
+                return candidate, path
+        return None
+
+    def url_for(self, hash_imagen: Optional[str], version: Optional[str]) -> Optional[str]:
+        found = self.find(hash_imagen, version)
+        return self.url(found[0], hash_imagen) if found else None
+
+    # --------- cola ---------
+
+    def error(self, hash_imagen: str) -> Optional[str]:
+        with self._lock:
+            failed = self._errors.get(hash_imagen)
+        if failed and time.monotonic() - failed[0] < ERROR_RETRY_SECONDS:
+            return failed[1]
+        return None
+
+    def is_pending(self, hash_imagen: str) -> bool:
+        with self._lock:
+            return hash_imagen in self._pending
+
+    def request(self, hash_imagen: str, image_path: str,
+                clasificacion_id: Optional[int] = None) -> None:
+        """Encola la explicación de una imagen. QueueFullError si no hay lugar."""
+        with self._lock:
+            pending = self._pending.get(hash_imagen)
+            if pending is not None:
+                if clasificacion_id is not None:
+                    pending[1].add(clasificacion_id)
+                return
+            try:
+                self._queue.put_nowait(hash_imagen)
+            except queue.Full:
+                self._counters["rejected"] += 1
+                raise QueueFullError("Cola de explicaciones llena")
+            self._pending[hash_imagen] = (
+                image_path,
+                {clasificacion_id} if clasificacion_id is not None else set(),
+            )
+            self._counters["requested"] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="explanations", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            hashes = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(hashes) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    hashes.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            with self._lock:
+                items = [(h, *self._pending[h]) for h in hashes]
+            try:
+                self._process(items)
+            except Exception as e:
+                print(f"❌ Error generando explicaciones: {e}")
+            finally:
+                with self._lock:
+                    for h in hashes:
+                        self._pending.pop(h, None)
+
+    def _process(self, items: List[Tuple[str, str, Set[int]]]) -> None:
+        results = self.explain_items([(h, path) for h, path, _ in items])
+        if not self.in_pdf:
+            return
+        for (_, _, ids), (hash_imagen, version, error) in zip(items, results):
+            if error is not None:
+                continue
+            for clasificacion_id in ids:
+                try:
+                    embed_in_report(clasificacion_id, self.path(version, hash_imagen))
+                except Exception as e:
+                    print(f"⚠️ No se pudo agregar la explicación al PDF {clasificacion_id}: {e}")
+
+    # --------- cálculo ---------
+
+    def _fail(self, hash_imagen: str, message: str) -> None:
+        with self._lock:
+            self._errors[hash_imagen] = (time.monotonic(), message)
+            self._errors.move_to_end(hash_imagen)
+            while len(self._errors) > MAX_REMEMBERED_ERRORS:
+                self._errors.popitem(last=False)
+            self._counters["errors"] += 1
+
+    def explain_items(self, items: Iterable[Tuple[str, str]]) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """
+        Genera las explicaciones de (hash, ruta) en una pasada del modelo.
+        Devuelve (hash, versión, error) por imagen.
+        """
+        items = list(items)
+        size = (self.model.img_width, self.model.img_height)
+        batch = np.empty((len(items), size[1], size[0], 3), dtype=np.float32)
+        results: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        valid = []
+        for hash_imagen, path in items:
+            try:
+                normalize_into(decode_image(path, size, self.model.fast_decode), batch[len(valid)])
+                valid.append((hash_imagen, path))
+            except Exception as e:
+                results[hash_imagen] = (None, f"No se pudo leer la imagen: {e}")
+
+        if valid:
+            try:
+                cams, _, version = self.model.explain_batch(batch[: len(valid)])
+                with self._lock:
+                    self._counters["batches"] += 1
+                for (hash_imagen, path), cam in zip(valid, cams):
+                    try:
+                        _write_atomic(
+                            self.path(version, hash_imagen),
+                            render_overlay(path, cam, self.max_side),
+                        )
+                        results[hash_imagen] = (version, None)
+                    except Exception as e:
+                        results[hash_imagen] = (None, str(e))
+            except Exception as e:
+                for hash_imagen, _ in valid:
+                    results[hash_imagen] = (None, str(e))
+
+        output = []
+        for hash_imagen, _ in items:
+            version, error = results[hash_imagen]
+            if error is None:
+                with self._lock:
+                    self._errors.pop(hash_imagen, None)
+                    self._counters["generated"] += 1
+            else:
+                self._fail(hash_imagen, error)
+            output.append((hash_imagen, version, error))
+        return output
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            pending = len(self._pending)
+        return {
+            "enabled": settings.EXPLANATIONS_ENABLED,
+            "pending": pending,
+            "batch_size": self.batch_size,
+            "in_pdf": self.in_pdf,
+            **counters,
+        }
+
+
+def embed_in_report(clasificacion_id: int, explanation_path: str) -> bool:
+    """
+    Agrega la explicación al JSON del reporte: la clave de la caché de PDFs
+    cambia y el PDF se renderiza de nuevo, ya con la imagen, al descargarse.
+    """
+    from app.db.mysql_connection import SessionLocal
+    from app.db import models as db_models
+
+    db = SessionLocal()
+    try:
+        reporte = (
+            db.query(db_models.Reporte)
+            .filter(db_models.Reporte.id_clasificacion == clasificacion_id)
+            .first()
+        )
+        if reporte is None:
+            return False
+        payload = json.loads(reporte.contenido or "{}")
+        if payload.get("explanationPath") == explanation_path:
+            return False
+        payload["explanationPath"] = explanation_path
+        reporte.contenido = json.dumps(payload, ensure_ascii=False)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def bulk(ids: Optional[List[int]] = None, flagged: bool = False,
+         max_confidence: Optional[float] = None, limit: Optional[int] = None,
+         batch_size: Optional[int] = None) -> int:
+    """
+    Genera en bloque las explicaciones que falten. Sin `ids`, de los
+    análisis marcados: revisión no aprobada, `es_correcto` falso o (con
+    `max_confidence`, en %) confianza menor a ese valor.
+    """
+    from sqlalchemy import or_
+
+    from app.db.mysql_connection import SessionLocal
+    from app.db import models as db_models
+    from app.ml.inference.cache import content_hash
+
+    C, I, R, V = db_models.Clasificacion, db_models.Imagen, db_models.Reporte, db_models.Revision
+    db = SessionLocal()
+    try:
+        query = db.query(C, I).join(I, C.id_imagen == I.id_imagen)
+        if ids:
+            query = query.filter(C.id_clasificacion.in_(ids))
+        else:
+            conditions = []
+            if flagged:
+                reviewed = (
+                    db.query(R.id_clasificacion)
+                    .join(V, V.id_reporte == R.id_reporte)
+                    .filter(V.aprobado.is_(False))
+                )
+                conditions += [C.es_correcto.is_(False), C.id_clasificacion.in_(reviewed)]
+            if max_confidence is not None:
+                conditions.append(C.confianza < max_confidence)
+            if not conditions:
+                raise ValueError("Indicar --ids, --flagged o --max-confidence")
+            query = query.filter(or_(*conditions))
+        rows = query.order_by(C.id_clasificacion.desc()).limit(limit).all()
+    finally:
+        db.close()
+
+    todo: Dict[str, Tuple[str, Set[int]]] = {}
+    for clasif, imagen in rows:
+        try:
+            hash_imagen = imagen.hash_contenido
+            if not hash_imagen:
+                with open(imagen.ruta_archivo, "rb") as f:
+                    hash_imagen = content_hash(f.read())
+        except OSError as e:
+            print(f"⚠️ {imagen.ruta_archivo}: {e}")
+            continue
+        found = explanation_service.find(hash_imagen, clasif.modelo_usado)
+        if found is not None:
+            if explanation_service.in_pdf:
+                embed_in_report(clasif.id_clasificacion, found[1])
+            continue
+        todo.setdefault(hash_imagen, (imagen.ruta_archivo, set()))[1].add(clasif.id_clasificacion)
+
+    items = [(h, path, ids) for h, (path, ids) in todo.items()]
+    size = batch_size or explanation_service.batch_size
+    done = 0
+    for start in range(0, len(items), size):
+        chunk = items[start:start + size]
+        explanation_service._process(chunk)
+        done += len(chunk)
+        print(f"🔎 {done}/{len(items)} explicaciones")
+    return len(items)
+
+
+explanation_service = ExplanationService(
+    copper_model,
+    settings.EXPLANATIONS_DIR,
+    batch_size=settings.EXPLANATIONS_BATCH_SIZE,
+    max_wait_ms=settings.EXPLANATIONS_MAX_WAIT_MS,
+    queue_size=settings.EXPLANATIONS_QUEUE,
+    max_side=settings.EXPLANATIONS_MAX_SIDE,
+    in_pdf=settings.EXPLANATIONS_IN_PDF,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("bulk", help="Generar explicaciones en bloque")
+    run.add_argument("--ids", type=int, nargs="+", default=None)
+    run.add_argument("--flagged", action="store_true",
+                     help="Revisión no aprobada o es_correcto falso")
+    run.add_argument("--max-confidence", type=float, default=None,
+                     help="Además, confianza (%%) menor a este valor")
+    run.add_argument("--limit", type=int, default=None)
+    run.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "bulk":
+        count = bulk(args.ids, args.flagged, args.max_confidence, args.limit, args.batch_size)
+        print(f"✅ {count} imágenes procesadas")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
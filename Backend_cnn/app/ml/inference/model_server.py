@@ -0,0 +1,157 @@
+# app/ml/inference/model_server.py
+"""
+Servidor de modelo: un proceso dedicado carga el modelo (TensorFlow,
+TFLite u ONNX) y atiende inferencias por un socket Unix.
+
+Con INFERENCE_MODE=remote los workers de la API y de la cola no cargan el
+modelo: arrancan en menos de un segundo, ocupan poca memoria y escalan por
+separado. Los lotes que llegan de distintos workers pasan por el mismo
+micro-batcher, así también se agrupan entre procesos. El servidor vigila
+el registro de modelos (hot-swap) y corre el modelo en sombra.
+
+Uso (desde Backend_cnn/):
+    python -m app.ml.inference.model_server
+    INFERENCE_MODE=remote uvicorn app.main:app --workers 4
+    INFERENCE_MODE=remote python -m app.workers.analysis_worker
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+
+import numpy as np
+
+from app.core.config import settings
+from app.ml.inference.batcher import QueueFullError, copper_batcher
+from app.ml.inference.remote import decode_array, encode_array, read_message, write_message
+from app.ml.inference.shadow import shadow_runner
+from app.ml.models.cnn_model import copper_model
+from app.ml.models.registry import model_registry, start_registry_watcher
+
+
+def sync_models() -> None:
+    """Aplica en caliente la versión activa y el modelo en sombra del registro."""
+    copper_model.sync_with_registry()
+    shadow_runner.sync_with_registry()
+
+
+def load_models() -> None:
+    if not copper_model.warmup(
+        settings.MODEL_WARMUP_RUNS, sorted({1, copper_batcher.max_batch_size})
+    ):
+        return
+    shadow_runner.sync_with_registry()
+    if settings.MODEL_REGISTRY_WATCH_SECONDS > 0:
+        start_registry_watcher(
+            model_registry, sync_models, settings.MODEL_REGISTRY_WATCH_SECONDS
+        )
+
+
+async def _predict(header, payload):
+    batch = decode_array(header, payload)
+    futures = []
+    try:
+        for image in batch:
+            futures.append(copper_batcher.submit(image))
+    except QueueFullError:
+        for future in futures:
+            future.cancel()
+        raise
+    outputs = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+    if any(result is None for result in outputs):
+        raise RuntimeError(copper_model.last_error or "El modelo no está disponible")
+    prediction = np.stack([row for row, _, _ in outputs])
+    embeddings = None
+    if all(embedding is not None for _, _, embedding in outputs):
+        embeddings = np.stack([embedding for _, _, embedding in outputs])
+    # Si un hot-swap cae a mitad del pedido se informa la última versión
+    return prediction, embeddings, outputs[-1][1]
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            try:
+                header, payload = await read_message(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            try:
+                op = header.get("op")
+                if op == "predict":
+                    prediction, embeddings, version = await _predict(header, payload)
+                    array_header, data = encode_array(prediction)
+                    response = {
+                        "ok": True,
+                        "version": version,
+                        "output_bytes": len(data),
+                        **array_header,
+                    }
+                    if embeddings is not None:
+                        response["embeddings"], extra = encode_array(embeddings)
+                        data += extra
+                    await write_message(writer, response, data)
+                elif op == "explain":
+                    # Gradientes fuera del event loop y del micro-batcher
+                    cams, prediction, version = await asyncio.to_thread(
+                        copper_model.explain_batch, decode_array(header, payload)
+                    )
+                    cams_header, data = encode_array(cams)
+                    array_header, extra = encode_array(prediction)
+                    await write_message(
+                        writer,
+                        {
+                            "ok": True,
+                            "version": version,
+                            "cams": cams_header,
+                            "cams_bytes": len(data),
+                            **array_header,
+                        },
+                        data + extra,
+                    )
+                elif op == "status":
+                    status = {**copper_model.status(), "batcher": copper_batcher.stats()}
+                    await write_message(writer, {"ok": True, "status": status})
+                else:
+                    await write_message(writer, {"ok": False, "error": f"Operación desconocida: {op}"})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                break
+            except Exception as e:
+                await write_message(writer, {"ok": False, "error": str(e)})
+    finally:
+        writer.close()
+
+
+async def serve(socket_path: str) -> None:
+    if os.path.exists(socket_path):
+        # Socket de una ejecución anterior
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle_connection, path=socket_path)
+    os.chmod(socket_path, 0o660)
+    print(f"🧠 Servidor de modelo escuchando en {socket_path} (pid {os.getpid()})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", default=settings.MODEL_SERVER_SOCKET)
+    args = parser.parse_args(argv)
+
+    # Este proceso es el que sirve: nunca se llama a sí mismo
+    copper_model.remote = None
+    # El socket atiende (status) mientras el modelo carga en segundo plano
+    threading.Thread(target=load_models, name="model-load", daemon=True).start()
+    try:
+        asyncio.run(serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
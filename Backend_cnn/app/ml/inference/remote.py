@@ -0,0 +1,184 @@
+# app/ml/inference/remote.py
+"""
+Protocolo y cliente del servidor de modelo (app.ml.inference.model_server).
+
+Cada mensaje es un encabezado JSON precedido por su largo (4 bytes, big
+endian) y seguido de `nbytes` bytes crudos de un arreglo NumPy; así un
+lote viaja sin serializar a JSON ni pasar por pickle.
+
+Solo depende de NumPy y de la biblioteca estándar: importarlo no carga
+TensorFlow.
+"""
+import asyncio
+import json
+import socket
+import struct
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+HEADER = struct.Struct("!I")
+MAX_HEADER_BYTES = 1024 * 1024
+
+
+def encode_array(array: np.ndarray) -> Tuple[Dict[str, Any], bytes]:
+    array = np.ascontiguousarray(array)
+    return {"shape": list(array.shape), "dtype": array.dtype.str}, array.tobytes()
+
+
+def decode_array(header: Dict[str, Any], payload: bytes) -> np.ndarray:
+    return np.frombuffer(payload, dtype=np.dtype(header["dtype"])).reshape(header["shape"])
+
+
+def _frame(header: Dict[str, Any], payload: bytes) -> bytes:
+    encoded = json.dumps({**header, "nbytes": len(payload)}, default=str).encode("utf-8")
+    return HEADER.pack(len(encoded)) + encoded
+
+
+def _parse_header(raw: bytes) -> Dict[str, Any]:
+    header = json.loads(raw)
+    if not isinstance(header, dict):
+        raise ValueError("Encabezado inválido")
+    return header
+
+
+# --------- lado síncrono (cliente) ---------
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("El servidor de modelo cerró la conexión")
+        received += count
+    return bytes(buffer)
+
+
+def send_message(sock: socket.socket, header: Dict[str, Any], payload: bytes = b"") -> None:
+    sock.sendall(_frame(header, payload))
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Dict[str, Any], bytes]:
+    (length,) = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if length > MAX_HEADER_BYTES:
+        raise ValueError("Encabezado demasiado grande")
+    header = _parse_header(_recv_exact(sock, length))
+    return header, _recv_exact(sock, int(header.get("nbytes", 0)))
+
+
+# --------- lado asyncio (servidor) ---------
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_HEADER_BYTES:
+        raise ValueError("Encabezado demasiado grande")
+    header = _parse_header(await reader.readexactly(length))
+    return header, await reader.readexactly(int(header.get("nbytes", 0)))
+
+
+async def write_message(
+    writer: asyncio.StreamWriter, header: Dict[str, Any], payload: bytes = b""
+) -> None:
+    writer.write(_frame(header, payload))
+    if payload:
+        writer.write(payload)
+    await writer.drain()
+
+
+class RemoteModelError(RuntimeError):
+    """El servidor de modelo respondió con un error."""
+
+
+class RemoteModelClient:
+    """
+    Cliente del servidor de modelo. Mantiene una conexión por hilo (el hilo
+    del micro-batcher, el de cada worker de la cola) y reconecta una vez si
+    la conexión se cayó, p. ej. porque el servidor se reinició.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._local.sock = sock
+        return sock
+
+    def close(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _call(self, header: Dict[str, Any], payload: bytes = b"") -> Tuple[Dict[str, Any], bytes]:
+        for attempt in (1, 2):
+            sock = getattr(self._local, "sock", None) or self._connect()
+            try:
+                send_message(sock, header, payload)
+                response, data = recv_message(sock)
+                break
+            except (OSError, ValueError):
+                # Conexión vieja o a medias: no se puede reutilizar
+                self.close()
+                if attempt == 2:
+                    raise
+        if not response.get("ok"):
+            raise RemoteModelError(response.get("error") or "Error en el servidor de modelo")
+        return response, data
+
+    def predict(self, batch: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray], str]:
+        """Lote (N, H, W, 3) -> (salida cruda del modelo, embeddings o None, versión)."""
+        header, payload = encode_array(batch)
+        response, data = self._call({"op": "predict", **header}, payload)
+        # El payload trae la salida y, a continuación, los embeddings
+        split = int(response["output_bytes"])
+        embeddings = None
+        if response.get("embeddings"):
+            embeddings = decode_array(response["embeddings"], data[split:])
+        return decode_array(response, data[:split]), embeddings, response["version"]
+
+    def explain(self, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray, str]:
+        """Lote (N, H, W, 3) -> (mapas Grad-CAM, salida cruda, versión)."""
+        header, payload = encode_array(batch)
+        response, data = self._call({"op": "explain", **header}, payload)
+        split = int(response["cams_bytes"])
+        return (
+            decode_array(response["cams"], data[:split]),
+            decode_array(response, data[split:]),
+            response["version"],
+        )
+
+    def status(self) -> Dict[str, Any]:
+        response, _ = self._call({"op": "status"})
+        return response["status"]
+
+    def wait_ready(self, timeout: float, interval: float = 0.5) -> Optional[Dict[str, Any]]:
+        """Espera a que el servidor tenga el modelo listo; None si no llega a tiempo."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                status = self.status()
+                if status.get("ready"):
+                    return status
+            except (OSError, RemoteModelError):
+                pass
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
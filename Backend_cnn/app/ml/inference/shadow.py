@@ -0,0 +1,212 @@
+# app/ml/inference/shadow.py
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import case, func
+
+from app.core.config import settings
+from app.db.mysql_connection import SessionLocal
+from app.db import models as db_models
+from app.ml.models.backends import create_backend
+from app.ml.models.cnn_model import CopperCNN, copper_model
+from app.ml.models.registry import ModelRegistry, model_registry
+
+
+class ShadowRunner:
+    """
+    Modo sombra: un modelo candidato procesa una fracción muestreada de
+    las imágenes que ya clasificó el modelo activo y se guardan ambas
+    salidas en `comparaciones_modelo`.
+
+    Corre fuera del camino crítico: `offer` solo copia las imágenes
+    muestreadas y las deja en una cola acotada (si está llena se descartan),
+    y un hilo propio hace la inferencia y los inserts.
+    """
+
+    def __init__(self, model: CopperCNN, registry: ModelRegistry, queue_size: int = 32,
+                 num_threads: Optional[int] = None):
+        self.model = model
+        self.registry = registry
+        self.num_threads = num_threads
+        # (motor, versión, fracción) del candidato; se reemplaza de una vez
+        self._candidate: Optional[Tuple[Any, str, float]] = None
+        self._queue: "queue.Queue[Tuple[np.ndarray, np.ndarray, str]]" = queue.Queue(
+            maxsize=max(1, queue_size)
+        )
+        self._rng = np.random.default_rng()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Serializa los cambios de candidato (endpoints y vigía del registro)
+        self._sync_lock = threading.Lock()
+        self._counters = {"sampled": 0, "dropped": 0, "compared": 0, "agreements": 0, "errors": 0}
+
+    def sync_with_registry(self) -> None:
+        """Carga, cambia o quita el candidato según `shadow.json`."""
+        with self._sync_lock:
+            self._sync_locked()
+
+    def _sync_locked(self) -> None:
+        shadow = self.registry.shadow()
+        if shadow is None or shadow["sample_rate"] <= 0:
+            if self._candidate is not None:
+                print("🌑 Modo sombra desactivado")
+            self._candidate = None
+            return
+
+        meta = shadow["meta"]
+        current = self._candidate
+        if current is not None and current[1] == meta["version"]:
+            self._candidate = (current[0], current[1], shadow["sample_rate"])
+            return
+        try:
+            backend = create_backend(
+                meta["backend"], self.registry.model_path(meta), num_threads=self.num_threads
+            )
+            backend.load()
+        except Exception as e:
+            print(f"❌ No se pudo cargar el modelo en sombra {meta['version']}: {e}")
+            return
+        self._candidate = (backend, meta["version"], shadow["sample_rate"])
+        print(f"🌗 Modelo en sombra: {meta['version']} ({shadow['sample_rate']:.0%} del tráfico)")
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="model-shadow", daemon=True
+                )
+                self._thread.start()
+
+    def offer(self, batch: np.ndarray, outputs: np.ndarray, version: str) -> None:
+        """
+        Muestrea imágenes de un lote ya clasificado por el modelo activo.
+        `batch` puede ser un buffer reutilizado: las filas elegidas se copian.
+        """
+        candidate = self._candidate
+        if candidate is None or outputs is None or candidate[1] == version:
+            return
+        picked = self._rng.random(len(batch)) < candidate[2]
+        if not picked.any():
+            return
+        # La indexación booleana copia
+        item = (batch[picked], np.asarray(outputs)[picked], version)
+        self._start()
+        try:
+            self._queue.put_nowait(item)
+            self._count("sampled", int(picked.sum()))
+        except queue.Full:
+            self._count("dropped", int(picked.sum()))
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def _run(self) -> None:
+        while True:
+            images, active_outputs, active_version = self._queue.get()
+            candidate = self._candidate
+            if candidate is None:
+                continue
+            backend, shadow_version, _ = candidate
+            try:
+                started = time.perf_counter()
+                shadow_outputs = backend.predict(images)
+                latency_ms = (time.perf_counter() - started) * 1000.0 / len(images)
+                self._record(active_outputs, active_version, shadow_outputs, shadow_version, latency_ms)
+            except Exception as e:
+                self._count("errors")
+                print(f"❌ Error en la inferencia en sombra: {e}")
+
+    def _record(self, active_outputs, active_version, shadow_outputs, shadow_version,
+                latency_ms) -> None:
+        rows = []
+        agreements = 0
+        for active_row, shadow_row in zip(active_outputs, shadow_outputs):
+            active_class, active_conf = self.model.interpret(np.asarray(active_row))
+            shadow_class, shadow_conf = self.model.interpret(np.asarray(shadow_row))
+            agreements += int(active_class == shadow_class)
+            rows.append(
+                db_models.ComparacionModelo(
+                    version_activa=active_version,
+                    version_sombra=shadow_version,
+                    resultado_activo=active_class,
+                    confianza_activa=active_conf,
+                    resultado_sombra=shadow_class,
+                    confianza_sombra=shadow_conf,
+                    coincide=active_class == shadow_class,
+                    diferencia=abs(
+                        self.model.copper_probability(np.asarray(active_row))
+                        - self.model.copper_probability(np.asarray(shadow_row))
+                    ),
+                    latencia_ms=latency_ms,
+                )
+            )
+        db = SessionLocal()
+        try:
+            db.add_all(rows)
+            db.commit()
+        finally:
+            db.close()
+        self._count("compared", len(rows))
+        self._count("agreements", agreements)
+
+    def stats(self) -> Dict[str, Any]:
+        candidate = self._candidate
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "version": candidate[1] if candidate else None,
+            "sample_rate": candidate[2] if candidate else 0.0,
+            "queued": self._queue.qsize(),
+            "agreement": (
+                round(counters["agreements"] / counters["compared"], 4)
+                if counters["compared"]
+                else None
+            ),
+            **counters,
+        }
+
+
+def shadow_report(db) -> list:
+    """Resumen por par (activa, sombra) de las comparaciones guardadas."""
+    C = db_models.ComparacionModelo
+    rows = (
+        db.query(
+            C.version_activa,
+            C.version_sombra,
+            func.count(C.id_comparacion),
+            func.sum(case((C.coincide, 1), else_=0)),
+            func.avg(C.diferencia),
+            func.max(C.diferencia),
+            func.avg(C.latencia_ms),
+            func.min(C.fecha),
+            func.max(C.fecha),
+        )
+        .group_by(C.version_activa, C.version_sombra)
+        .all()
+    )
+    return [
+        {
+            "activeVersion": active,
+            "shadowVersion": shadow,
+            "samples": count,
+            "agreement": round(float(agreements or 0) / count, 4) if count else None,
+            "meanAbsDiff": round(float(mean_diff or 0.0), 6),
+            "maxAbsDiff": round(float(max_diff or 0.0), 6),
+            "shadowLatencyMs": round(float(latency or 0.0), 3),
+            "from": first.isoformat() if first else None,
+            "to": last.isoformat() if last else None,
+        }
+        for active, shadow, count, agreements, mean_diff, max_diff, latency, first, last in rows
+    ]
+
+
+shadow_runner = ShadowRunner(
+    copper_model,
+    model_registry,
+    queue_size=settings.MODEL_SHADOW_QUEUE,
+    num_threads=settings.MODEL_SHADOW_THREADS,
+)
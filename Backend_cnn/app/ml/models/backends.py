@@ -0,0 +1,276 @@
+# app/ml/models/backends.py
+import os
+import threading
+
+import numpy as np
+
+
+class InferenceBackend:
+    """
+    Motor de inferencia detrás de CopperCNN.
+
+    Todas las implementaciones reciben un lote float32 (N, H, W, 3) en [0, 1]
+    y devuelven la salida del modelo como ndarray (N, salidas), así
+    `CopperCNN.interpret` no depende del motor usado.
+    """
+
+    name = "base"
+
+    def __init__(self, model_path, num_threads=None, inter_op_threads=None):
+        self.model_path = model_path
+        # Hilos intra-op (dentro de cada operación) e inter-op (operaciones
+        # en paralelo); None deja los del runtime
+        self.num_threads = num_threads
+        self.inter_op_threads = inter_op_threads
+
+    def load(self):
+        raise NotImplementedError
+
+    def predict(self, batch):
+        raise NotImplementedError
+
+    def predict_with_embeddings(self, batch):
+        """
+        (salida, embeddings (N, D) o None) en una sola pasada. Por defecto el
+        motor no expone la capa de pooling y no hay embeddings.
+        """
+        return self.predict(batch), None
+
+    def explain(self, batch):
+        """
+        Mapas Grad-CAM (N, h, w) en [0, 1] de la clase predicha y la salida
+        del modelo. Requiere gradientes: solo el motor keras los calcula.
+        """
+        raise NotImplementedError(
+            f"El motor {self.name} no calcula Grad-CAM (se requiere keras)"
+        )
+
+    @property
+    def output_shape(self):
+        raise NotImplementedError
+
+
+class KerasBackend(InferenceBackend):
+    name = "keras"
+
+    def load(self):
+        import tensorflow as tf
+
+        self._configure_threads(tf)
+        self.model = tf.keras.models.load_model(self.model_path)
+        self._embedding_model = self._with_embeddings(self.model)
+        # Se arma recién con la primera explicación
+        self._gradcam_model = None
+
+    def _configure_threads(self, tf):
+        """Solo tiene efecto antes de que TensorFlow inicialice su runtime."""
+        try:
+            if self.num_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(self.num_threads)
+            if self.inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+        except RuntimeError:
+            # Ya inicializado (p. ej. un hot-swap): siguen los hilos del
+            # primer modelo, que vienen del mismo perfil
+            pass
+
+    @staticmethod
+    def _with_embeddings(model):
+        """
+        Mismo grafo con una segunda salida: el vector de GlobalAveragePooling
+        (la característica de MobileNetV2 que alimenta la cabeza sigmoid).
+        """
+        import tensorflow as tf
+
+        pooling = next(
+            (
+                layer
+                for layer in model.layers
+                if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)
+            ),
+            None,
+        )
+        if pooling is None:
+            return None
+        try:
+            return tf.keras.Model(inputs=model.inputs, outputs=[model.outputs[0], pooling.output])
+        except Exception as e:
+            print(f"⚠️ No se pudo exponer el embedding del modelo: {e}")
+            return None
+
+    def predict(self, batch):
+        return np.asarray(self.model.predict(batch, verbose=0))
+
+    def predict_with_embeddings(self, batch):
+        if self._embedding_model is None:
+            return self.predict(batch), None
+        output, embeddings = self._embedding_model.predict(batch, verbose=0)
+        return np.asarray(output), np.asarray(embeddings, dtype=np.float32)
+
+    @staticmethod
+    def _with_feature_map(model):
+        """
+        Mismo grafo con el mapa de activaciones que entra al
+        GlobalAveragePooling (última capa convolucional de MobileNetV2).
+        """
+        import tensorflow as tf
+
+        pooling = next(
+            (
+                layer
+                for layer in model.layers
+                if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)
+            ),
+            None,
+        )
+        if pooling is None:
+            return None
+        return tf.keras.Model(inputs=model.inputs, outputs=[pooling.input, model.outputs[0]])
+
+    def explain(self, batch):
+        import tensorflow as tf
+
+        if self._gradcam_model is None:
+            self._gradcam_model = self._with_feature_map(self.model)
+            if self._gradcam_model is None:
+                raise NotImplementedError("El modelo no tiene una capa GlobalAveragePooling2D")
+
+        images = tf.convert_to_tensor(batch, dtype=tf.float32)
+        with tf.GradientTape() as tape:
+            features, output = self._gradcam_model(images, training=False)
+            # Puntaje de la clase predicha de cada imagen. Las imágenes del
+            # lote son independientes: el gradiente de la suma es el de cada una
+            if output.shape[-1] == 1:
+                probability = output[:, 0]
+                score = tf.where(probability > 0.5, probability, 1.0 - probability)
+            else:
+                score = tf.reduce_max(output, axis=-1)
+        grads = tape.gradient(score, features)
+        weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+        cams = tf.nn.relu(tf.reduce_sum(weights * features, axis=-1))
+        cams = cams / (tf.reduce_max(cams, axis=(1, 2), keepdims=True) + 1e-8)
+        return cams.numpy().astype(np.float32), np.asarray(output)
+
+    @property
+    def output_shape(self):
+        return self.model.output_shape
+
+
+class TFLiteBackend(InferenceBackend):
+    name = "tflite"
+
+    def load(self):
+        try:
+            # Runtime liviano si está instalado (nodos solo-inferencia)
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(
+            model_path=self.model_path, num_threads=self.num_threads
+        )
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # El intérprete no es thread-safe
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        if batch_size == self._batch_size:
+            return
+        self.interpreter.resize_tensor_input(
+            self._input["index"],
+            [batch_size, *self._input["shape"][1:]],
+        )
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch):
+        with self._lock:
+            self._resize(len(batch))
+
+            input_dtype = self._input["dtype"]
+            if input_dtype in (np.int8, np.uint8):
+                # Modelos full-integer: cuantizar la entrada
+                scale, zero_point = self._input["quantization"]
+                batch = np.round(batch / scale + zero_point)
+                info = np.iinfo(input_dtype)
+                batch = np.clip(batch, info.min, info.max)
+            self.interpreter.set_tensor(
+                self._input["index"], batch.astype(input_dtype, copy=False)
+            )
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"])
+
+            if self._output["dtype"] in (np.int8, np.uint8):
+                scale, zero_point = self._output["quantization"]
+                output = (output.astype(np.float32) - zero_point) * scale
+            return np.array(output, dtype=np.float32)
+
+    @property
+    def output_shape(self):
+        return tuple(self._output["shape_signature"])
+
+
+class OnnxBackend(InferenceBackend):
+    name = "onnx"
+
+    def load(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if self.num_threads:
+            options.intra_op_num_threads = self.num_threads
+        if self.inter_op_threads:
+            options.inter_op_num_threads = self.inter_op_threads
+        self.session = ort.InferenceSession(
+            self.model_path,
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_name = self.session.get_inputs()[0].name
+        self._output_name = self.session.get_outputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(
+            [self._output_name],
+            {self._input_name: batch.astype(np.float32, copy=False)},
+        )[0]
+
+    @property
+    def output_shape(self):
+        return tuple(self.session.get_outputs()[0].shape)
+
+
+BACKENDS = {
+    KerasBackend.name: KerasBackend,
+    TFLiteBackend.name: TFLiteBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+BACKEND_EXTENSIONS = {
+    KerasBackend.name: ".h5",
+    TFLiteBackend.name: ".tflite",
+    OnnxBackend.name: ".onnx",
+}
+
+
+def backend_model_path(keras_path, backend):
+    """Ruta del modelo exportado para un motor, junto al .h5 original."""
+    root, _ = os.path.splitext(keras_path)
+    return root + BACKEND_EXTENSIONS[backend]
+
+
+def create_backend(name, model_path, num_threads=None, inter_op_threads=None):
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Motor de inferencia desconocido: {name} (opciones: {', '.join(BACKENDS)})"
+        )
+    return backend_cls(model_path, num_threads=num_threads, inter_op_threads=inter_op_threads)
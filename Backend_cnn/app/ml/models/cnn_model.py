@@ -1,62 +1,268 @@
-import tensorflow as tf
+import os
+import threading
+import time
+
 import numpy as np
-from PIL import Image
+
+from app.core.config import settings
+from app.ml.inference.remote import RemoteModelClient
+from app.ml.models.backends import backend_model_path, create_backend
+from app.ml.models.registry import model_registry
+# Antes de cargar TensorFlow: fija los hilos del perfil de runtime
+from app.ml.models.runtime_profile import runtime_settings
+from app.ml.utils.decoding import load_image_array
+
+# Largo de Clasificacion.modelo_usado
+MODEL_VERSION_MAX_LENGTH = 50
+
 
 class CopperCNN:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, backend="keras", backend_path=None, registry=None,
+                 remote=None, num_threads=None, inter_op_threads=None):
+        # model_path es siempre el .h5 entrenado; los otros motores usan
+        # el archivo exportado por app.ml.models.convert. Si el registro
+        # tiene una versión activa, esa manda sobre ambos.
         self.model_path = model_path
-        self.model = None
+        self.backend = backend
+        self.backend_path = backend_path or (
+            model_path if backend == "keras" else backend_model_path(model_path, backend)
+        )
+        self.registry = registry
+        # RemoteModelClient: las pasadas del modelo las hace el servidor de
+        # modelo y este proceso nunca carga el motor
+        self.remote = remote
+        # Modo remoto: versión que informó el servidor de modelo (estado o
+        # último lote), no la que dice el registro
+        self._served_version = None
+        self.num_threads = num_threads
+        self.inter_op_threads = inter_op_threads
+        # (motor cargado, versión) se reemplaza de una sola vez en el
+        # hot-swap: una pasada en curso termina con el modelo que tomó
+        self._active = None
         self.img_height = 224
         self.img_width = 224
         # ACTUALIZADO: El nuevo modelo usa binary classification
         self.class_names = {0: 'sin_cobre', 1: 'con_cobre'}
-        
-    def load_model(self):
-        """Cargar modelo pre-entrenado"""
+        # Decodificación JPEG reducida (draft) + uint8 -> float32
+        self.fast_decode = settings.PREPROCESS_FAST_DECODE
+        # Evita que peticiones concurrentes carguen el modelo dos veces
+        self._load_lock = threading.Lock()
+        # Serializa los hot-swaps (endpoint de activación y vigía del
+        # registro); aparte de _load_lock para no frenar las predicciones
+        self._sync_lock = threading.Lock()
+        self.ready = False
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.last_error = None
+        self.warmup_runs = 1
+        self.warmup_batch_sizes = (1,)
+        self.swaps = 0
+
+    @property
+    def model(self):
+        return self._active[0] if self._active else None
+
+    @model.setter
+    def model(self, backend):
+        self._active = (backend, self._target()[2]) if backend is not None else None
+
+    def _file_version(self, backend, path):
         try:
-            self.model = tf.keras.models.load_model(self.model_path)
-            print("✅ Modelo cargado exitosamente")
-            print(f"🔍 Arquitectura de salida: {self.model.output_shape}")
+            mtime = int(os.path.getmtime(path))
+        except OSError:
+            mtime = 0
+        version = f"{backend}:{os.path.basename(path)}:{mtime:x}"
+        return version[-MODEL_VERSION_MAX_LENGTH:]
+
+    def _target(self):
+        """(motor, ruta, versión) que se debería servir ahora."""
+        meta = self.registry.active() if self.registry is not None else None
+        if meta is not None:
+            return meta["backend"], self.registry.model_path(meta), meta["version"]
+        return self.backend, self.backend_path, self._file_version(self.backend, self.backend_path)
+
+    @property
+    def version(self):
+        """
+        Versión servida: la del registro de modelos o, sin registro, motor +
+        archivo + fecha de modificación. Antes de cargar se calcula desde lo
+        que se cargaría. Se guarda en `modelo_usado` y en la clave de caché.
+        En modo remoto es la que informó el servidor de modelo.
+        """
+        if self.remote is not None and self._served_version is not None:
+            return self._served_version
+        active = self._active
+        return active[1] if active else self._target()[2]
+
+    def _load_backend(self, backend, path):
+        started = time.perf_counter()
+        model = create_backend(
+            backend, path, num_threads=self.num_threads, inter_op_threads=self.inter_op_threads
+        )
+        model.load()
+        return model, time.perf_counter() - started
+
+    def load_model(self):
+        """Cargar modelo pre-entrenado (una sola vez por proceso)"""
+        with self._load_lock:
+            if self._active is not None:
+                return True
+            try:
+                backend, path, version = self._target()
+                model, self.load_seconds = self._load_backend(backend, path)
+                self.backend, self.backend_path = backend, path
+                self._active = (model, version)
+                self.last_error = None
+                print(
+                    f"✅ Modelo {version} cargado exitosamente ({backend}) "
+                    f"en {self.load_seconds:.2f}s"
+                )
+                print(f"🔍 Arquitectura de salida: {model.output_shape}")
+                return True
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"❌ Error cargando el modelo: {e}")
+                return False
+
+    def sync_with_registry(self):
+        """
+        Hot-swap: si la versión activa del registro cambió, carga y calienta
+        la nueva al lado de la actual y recién entonces la reemplaza. Las
+        peticiones en curso no se cortan ni esperan la carga.
+        """
+        if self.remote is not None:
+            # El servidor de modelo vigila el registro por su cuenta: solo
+            # se actualiza la versión que sirve
+            return self.refresh_served_version()
+        with self._sync_lock:
+            return self._sync_locked()
+
+    def _sync_locked(self):
+        if self._active is None:
+            return self.load_model()
+        # Se lee recién con el lock: si otro hilo ya hizo este swap, no se
+        # vuelve a cargar
+        backend, path, version = self._target()
+        if version == self.version:
             return True
+        try:
+            model, load_seconds = self._load_backend(backend, path)
+            for batch_size in self.warmup_batch_sizes:
+                dummy = np.zeros(
+                    (batch_size, self.img_height, self.img_width, 3), dtype=np.float32
+                )
+                for _ in range(max(0, self.warmup_runs)):
+                    model.predict(dummy)
         except Exception as e:
-            print(f"❌ Error cargando el modelo: {e}")
+            self.last_error = str(e)
+            print(f"❌ No se pudo cargar la versión {version}; se mantiene {self.version}: {e}")
             return False
+        with self._load_lock:
+            previous = self.version
+            self.backend, self.backend_path = backend, path
+            self._active = (model, version)
+            self.load_seconds = load_seconds
+            self.last_error = None
+            self.swaps += 1
+        print(f"🔁 Modelo {previous} -> {version} ({backend}, {load_seconds:.2f}s)")
+        return True
+
+    def refresh_served_version(self):
+        """Modo remoto: toma la versión cargada del estado del servidor de modelo."""
+        try:
+            status = self.remote.status()
+        except Exception as e:
+            print(f"⚠️ No se pudo consultar el servidor de modelo: {e}")
+            return False
+        if status.get("version"):
+            self._served_version = status["version"]
+        return bool(status.get("ready"))
+
+    def warmup(self, runs=1, batch_sizes=(1,)):
+        """
+        Carga el modelo y ejecuta pasadas con tensores en cero para que el
+        trazado del grafo no lo pague la primera petición real. Se hace por
+        cada tamaño de lote que verá el servidor.
+        """
+        self.warmup_runs = runs
+        self.warmup_batch_sizes = tuple(batch_sizes)
+        if self.remote is not None:
+            # El warm-up lo hace el servidor de modelo: solo se espera que esté listo
+            status = self.remote.wait_ready(settings.MODEL_SERVER_TIMEOUT)
+            self.ready = status is not None
+            if self.ready:
+                self._served_version = status.get("version") or self._served_version
+            else:
+                self.last_error = f"Servidor de modelo no disponible en {self.remote.socket_path}"
+                print(f"❌ {self.last_error}")
+            return self.ready
+        if not self.load_model():
+            return False
+        try:
+            started = time.perf_counter()
+            for batch_size in batch_sizes:
+                dummy = np.zeros(
+                    (batch_size, self.img_height, self.img_width, 3), dtype=np.float32
+                )
+                for _ in range(max(0, runs)):
+                    self.model.predict(dummy)
+            self.warmup_seconds = time.perf_counter() - started
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"❌ Error en warm-up del modelo: {e}")
+            return False
+        self.ready = True
+        print(f"🔥 Warm-up listo en {self.warmup_seconds:.2f}s (lotes {list(batch_sizes)})")
+        return True
+
+    def status(self):
+        if self.remote is not None:
+            try:
+                return {**self.remote.status(), "mode": "remote"}
+            except Exception as e:
+                return {
+                    "ready": False,
+                    "mode": "remote",
+                    "backend": self.backend,
+                    "model_path": self.backend_path,
+                    "version": self.version,
+                    "load_seconds": None,
+                    "warmup_seconds": None,
+                    "error": f"Servidor de modelo no disponible: {e}",
+                    "swaps": 0,
+                }
+        return {
+            "ready": self.ready,
+            "mode": "local",
+            "backend": self.backend,
+            "model_path": self.backend_path,
+            "version": self.version,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.last_error,
+            "swaps": self.swaps,
+            "threads": {
+                "intra_op": self.num_threads,
+                "inter_op": self.inter_op_threads,
+                "profile": runtime_settings["profile"],
+            },
+        }
     
-    def preprocess_image(self, image_path):
-        """Preprocesar imagen para predicción - ACTUALIZADO"""
+    def preprocess_image(self, source):
+        """Preprocesar imagen para predicción (ruta, bytes o buffer)"""
         try:
-            # Cargar y redimensionar imagen
-            img = Image.open(image_path)
-            img = img.convert('RGB')
-            img = img.resize((self.img_width, self.img_height))
-            
-            # Convertir a array y normalizar
-            img_array = np.array(img) / 255.0
-            img_array = np.expand_dims(img_array, axis=0)
-            
-            return img_array
+            return load_image_array(
+                source, (self.img_width, self.img_height), fast=self.fast_decode
+            )
         except Exception as e:
             print(f"❌ Error en preprocesamiento: {e}")
             return None
     
-    def predict(self, image_path):
-        """Realizar predicción - COMPLETAMENTE ACTUALIZADO"""
-        if not self.model:
-            if not self.load_model():
-                return None, None
-        
-        processed_image = self.preprocess_image(image_path)
-        if processed_image is None:
-            return None, None
-        
-        # Obtener predicción
-        prediction = self.model.predict(processed_image, verbose=0)
-        
-        print(f"🔍 Predicción cruda: {prediction}")  # Debug
-        
+    def interpret(self, prediction_row):
+        """Convertir una fila de salida del modelo en (clase, confianza %)"""
         # PARA MODELO BINARIO (1 neurona sigmoid)
-        if prediction.shape[1] == 1:
-            probability = float(prediction[0][0])
+        if prediction_row.shape[0] == 1:
+            probability = float(prediction_row[0])
             if probability > 0.5:
                 predicted_class = 'sin_cobre'
                 confidence = probability
@@ -65,12 +271,128 @@ class CopperCNN:
                 confidence = 1 - probability
         # PARA MODELO MULTICLASE (2 neuronas softmax) - compatibilidad
         else:
-            predicted_idx = np.argmax(prediction[0])
-            confidence = float(prediction[0][predicted_idx])
+            predicted_idx = int(np.argmax(prediction_row))
+            confidence = float(prediction_row[predicted_idx])
             predicted_class = self.class_names.get(predicted_idx, 'desconocido')
-        
-        print(f"🎯 Clase: {predicted_class}, Confianza: {confidence:.2%}")
+
         return predicted_class, round(confidence * 100, 2)
 
+    def copper_probability(self, prediction_row):
+        """Probabilidad de 'con_cobre' para una fila de salida del modelo."""
+        if prediction_row.shape[0] == 1:
+            # Sigmoid = probabilidad de 'sin_cobre' (clase 1 alfabética)
+            return 1.0 - float(prediction_row[0])
+        return float(prediction_row[1])
+
+    def aggregate_tiles(self, prediction_rows, rows, cols,
+                        min_copper_fraction=0.05):
+        """
+        Combina las salidas por tile en un veredicto de imagen y un mapa de
+        calor (rows x cols) de probabilidad de cobre.
+
+        La imagen es 'con_cobre' si al menos `min_copper_fraction` de los
+        tiles lo son; la confianza es la media de esos tiles. Si no, la
+        confianza es la media de la probabilidad de 'sin_cobre'.
+        """
+        copper = np.array(
+            [self.copper_probability(row) for row in prediction_rows],
+            dtype=np.float32,
+        ).reshape(rows, cols)
+        positive = copper > 0.5
+        fraction = float(positive.mean())
+
+        if positive.any() and fraction >= min_copper_fraction:
+            predicted_class = 'con_cobre'
+            confidence = float(copper[positive].mean())
+        else:
+            predicted_class = 'sin_cobre'
+            confidence = float((1.0 - copper).mean())
+
+        heatmap = {
+            "rows": rows,
+            "cols": cols,
+            "values": np.round(copper.astype(np.float64), 3).tolist(),
+            "copperFraction": round(fraction, 4),
+        }
+        return predicted_class, round(confidence * 100, 2), heatmap
+
+    def predict_batch_embedded(self, batch):
+        """
+        Una sola pasada hacia adelante para un lote (N, H, W, 3).
+
+        Devuelve (salida cruda, una fila por imagen; embeddings (N, D) o None
+        si el motor no los entrega; versión que la produjo).
+        """
+        if self.remote is not None:
+            prediction, embeddings, version = self.remote.predict(batch)
+            self._served_version = version
+            return prediction, embeddings, version
+        if not self._active:
+            if not self.load_model():
+                return None, None, None
+
+        model, version = self._active
+        if settings.EMBEDDINGS_ENABLED:
+            prediction, embeddings = model.predict_with_embeddings(batch)
+        else:
+            prediction, embeddings = model.predict(batch), None
+        return prediction, embeddings, version
+
+    def explain_batch(self, batch):
+        """
+        Grad-CAM de un lote (N, H, W, 3): (mapas (N, h, w) en [0, 1],
+        salida cruda, versión). Calcula gradientes, así que cuesta varias
+        pasadas: no se usa en el camino de la subida.
+        """
+        if self.remote is not None:
+            cams, prediction, version = self.remote.explain(batch)
+            self._served_version = version
+            return cams, prediction, version
+        if not self._active:
+            if not self.load_model():
+                raise RuntimeError(self.last_error or "El modelo no está disponible")
+
+        model, version = self._active
+        cams, prediction = model.explain(batch)
+        return cams, prediction, version
+
+    def predict_batch_versioned(self, batch):
+        """Como `predict_batch_embedded`, sin los embeddings."""
+        prediction, _, version = self.predict_batch_embedded(batch)
+        return prediction, version
+
+    def predict_batch(self, batch):
+        """Como `predict_batch_versioned`, solo la salida cruda."""
+        return self.predict_batch_versioned(batch)[0]
+
+    def predict(self, image_path):
+        """Realizar predicción - COMPLETAMENTE ACTUALIZADO"""
+        processed_image = self.preprocess_image(image_path)
+        if processed_image is None:
+            return None, None
+        
+        # Obtener predicción
+        prediction = self.predict_batch(processed_image)
+        if prediction is None:
+            return None, None
+        
+        print(f"🔍 Predicción cruda: {prediction}")  # Debug
+        
+        predicted_class, confidence = self.interpret(prediction[0])
+        print(f"🎯 Clase: {predicted_class}, Confianza: {confidence:.2f}%")
+        return predicted_class, confidence
+
 # Instancia global del modelo
-copper_model = CopperCNN('model_data/model_copper_fixed.h5')
\ No newline at end of file
+copper_model = CopperCNN(
+    settings.MODEL_PATH,
+    backend=settings.INFERENCE_BACKEND,
+    backend_path=settings.INFERENCE_BACKEND_MODEL_PATH,
+    registry=model_registry,
+    remote=(
+        RemoteModelClient(settings.MODEL_SERVER_SOCKET, settings.MODEL_SERVER_TIMEOUT)
+        if settings.INFERENCE_MODE == "remote"
+        else None
+    ),
+    num_threads=runtime_settings["intra_op_threads"],
+    inter_op_threads=runtime_settings["inter_op_threads"],
+)
\ No newline at end of file
@@ -0,0 +1,152 @@
+# app/ml/models/convert.py
+"""
+Exporta el modelo Keras entrenado a los otros motores de inferencia y
+verifica que las salidas sigmoid no se desvíen.
+
+Uso (desde Backend_cnn/):
+    python -m app.ml.models.convert --backends tflite onnx
+    python -m app.ml.models.convert --backends tflite --images uploads/
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from app.core.config import settings
+from app.ml.models.backends import backend_model_path, create_backend
+from app.ml.utils.decoding import load_image_array
+
+IMG_SIZE = (224, 224)
+
+
+def _concrete_function(model):
+    import tensorflow as tf
+
+    # Lote dinámico para que el micro-batching pueda usar cualquier tamaño
+    fn = tf.function(lambda x: model(x, training=False))
+    return fn.get_concrete_function(
+        tf.TensorSpec([None, *IMG_SIZE, 3], tf.float32, name="input")
+    )
+
+
+def tflite_converter(model):
+    """Conversor TFLite sobre una función concreta (compatible con Keras 3)."""
+    import tensorflow as tf
+
+    return tf.lite.TFLiteConverter.from_concrete_functions(
+        [_concrete_function(model)], model
+    )
+
+
+def export_tflite(model, output_path):
+    tflite_model = tflite_converter(model).convert()
+    with open(output_path, "wb") as f:
+        f.write(tflite_model)
+    return output_path
+
+
+def export_onnx(model, output_path, opset=13):
+    import tensorflow as tf
+    import tf2onnx
+
+    fn = tf.function(lambda x: model(x, training=False))
+    tf2onnx.convert.from_function(
+        fn,
+        input_signature=(tf.TensorSpec([None, *IMG_SIZE, 3], tf.float32, name="input"),),
+        opset=opset,
+        output_path=output_path,
+    )
+    return output_path
+
+
+EXPORTERS = {
+    "tflite": export_tflite,
+    "onnx": export_onnx,
+}
+
+
+def parity_inputs(samples=16, images_dir=None, seed=0):
+    """Lote de referencia: imágenes reales (si hay) más ruido uniforme."""
+    batches = []
+    if images_dir and os.path.isdir(images_dir):
+        names = sorted(
+            n for n in os.listdir(images_dir)
+            if n.lower().endswith((".jpg", ".jpeg", ".png"))
+        )[:samples]
+        for name in names:
+            try:
+                batches.append(load_image_array(os.path.join(images_dir, name), IMG_SIZE))
+            except Exception as e:
+                print(f"⚠️ Imagen ignorada en la verificación ({name}): {e}")
+    rng = np.random.default_rng(seed)
+    batches.append(rng.random((samples, *IMG_SIZE, 3)))
+    return np.concatenate(batches, axis=0).astype(np.float32)
+
+
+def check_parity(reference, candidate, batch, tolerance=1e-3, batch_size=8):
+    """
+    Compara las salidas de dos motores sobre el mismo lote.
+
+    Se marca deriva si la diferencia absoluta máxima supera `tolerance` o
+    si alguna imagen cambia de clase (cruza el umbral 0.5).
+    """
+    ref_out = []
+    cand_out = []
+    for start in range(0, len(batch), batch_size):
+        chunk = batch[start:start + batch_size]
+        ref_out.append(reference.predict(chunk))
+        cand_out.append(candidate.predict(chunk))
+    ref_out = np.concatenate(ref_out, axis=0).astype(np.float64)
+    cand_out = np.concatenate(cand_out, axis=0).astype(np.float64)
+
+    diff = np.abs(ref_out - cand_out)
+    class_flips = int(np.sum((ref_out > 0.5) != (cand_out > 0.5)))
+    max_abs_diff = float(diff.max()) if diff.size else 0.0
+    return {
+        "samples": int(len(batch)),
+        "max_abs_diff": max_abs_diff,
+        "mean_abs_diff": float(diff.mean()) if diff.size else 0.0,
+        "class_flips": class_flips,
+        "tolerance": tolerance,
+        "ok": max_abs_diff <= tolerance and class_flips == 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=settings.MODEL_PATH, help="Modelo Keras .h5")
+    parser.add_argument(
+        "--backends", nargs="+", choices=sorted(EXPORTERS), default=["tflite"]
+    )
+    parser.add_argument("--images", default=None, help="Carpeta con imágenes reales")
+    parser.add_argument("--samples", type=int, default=16)
+    parser.add_argument("--tolerance", type=float, default=1e-3)
+    args = parser.parse_args(argv)
+
+    reference = create_backend("keras", args.model)
+    reference.load()
+    batch = parity_inputs(args.samples, args.images)
+
+    failed = False
+    for name in args.backends:
+        output_path = backend_model_path(args.model, name)
+        print(f"📦 Exportando {name} -> {output_path}")
+        EXPORTERS[name](reference.model, output_path)
+
+        candidate = create_backend(name, output_path)
+        candidate.load()
+        report = check_parity(reference, candidate, batch, args.tolerance)
+        status = "✅" if report["ok"] else "❌ DERIVA"
+        print(
+            f"{status} {name}: max |Δ|={report['max_abs_diff']:.2e}, "
+            f"media |Δ|={report['mean_abs_diff']:.2e}, "
+            f"cambios de clase={report['class_flips']}/{report['samples']}"
+        )
+        failed = failed or not report["ok"]
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
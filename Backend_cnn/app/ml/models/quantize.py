@@ -0,0 +1,219 @@
+# app/ml/models/quantize.py
+"""
+Cuantización post-entrenamiento del modelo de cobre para servidores CPU.
+
+Genera variantes TFLite float32, dynamic-range, float16 e INT8 completo
+(calibrado con una muestra del dataset de entrenamiento), mide exactitud,
+latencia por imagen y tamaño de cada una y recomienda la más pequeña que
+se mantiene dentro de la tolerancia de exactitud.
+
+Uso (desde Backend_cnn/):
+    python -m app.ml.models.quantize --dataset ../dataset
+    python -m app.ml.models.quantize --dataset ../dataset --install
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from app.core.config import settings
+from app.ml.models.backends import (
+    TFLiteBackend,
+    backend_model_path,
+    create_backend,
+)
+from app.ml.models.convert import IMG_SIZE, tflite_converter
+from app.ml.utils.decoding import load_image_array
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+VALIDATION_SPLIT = 0.2  # mismo valor que training/train_cnn_fixed.py
+VARIANTS = ("float32", "dynamic_range", "float16", "int8")
+
+
+def split_dataset(dataset_dir, validation_split=VALIDATION_SPLIT):
+    """
+    Reproduce la partición de `flow_from_directory`: clases en orden
+    alfabético y el primer `validation_split` de cada clase como validación.
+    """
+    classes = sorted(
+        d for d in os.listdir(dataset_dir)
+        if os.path.isdir(os.path.join(dataset_dir, d))
+    )
+    train, validation = [], []
+    for label, class_name in enumerate(classes):
+        class_dir = os.path.join(dataset_dir, class_name)
+        files = sorted(
+            os.path.join(class_dir, f) for f in os.listdir(class_dir)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        cut = int(len(files) * validation_split)
+        validation.extend((path, label) for path in files[:cut])
+        train.extend((path, label) for path in files[cut:])
+    return classes, train, validation
+
+
+def representative_dataset(train_files, samples, seed=0):
+    """Generador de calibración INT8 con una muestra aleatoria del train."""
+    rng = np.random.default_rng(seed)
+    count = min(samples, len(train_files))
+    picks = rng.choice(len(train_files), size=count, replace=False)
+
+    def gen():
+        for i in picks:
+            path, _ = train_files[i]
+            yield [load_image_array(path, IMG_SIZE).astype(np.float32)]
+
+    return gen
+
+
+def convert_variant(model, variant, train_files, calibration_samples):
+    import tensorflow as tf
+
+    converter = tflite_converter(model)
+    if variant == "dynamic_range":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif variant == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(
+            train_files, calibration_samples
+        )
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+def evaluate(backend, validation_files, latency_runs=50):
+    """Exactitud sobre validación y latencia por imagen (lote de 1)."""
+    correct = 0
+    for path, label in validation_files:
+        output = backend.predict(load_image_array(path, IMG_SIZE).astype(np.float32))
+        # Salida sigmoid = probabilidad de la clase 1 (orden alfabético)
+        correct += int((float(output[0][0]) > 0.5) == bool(label))
+
+    sample = (
+        load_image_array(validation_files[0][0], IMG_SIZE).astype(np.float32)
+        if validation_files
+        else np.zeros((1, *IMG_SIZE, 3), dtype=np.float32)
+    )
+    for _ in range(5):
+        backend.predict(sample)
+    timings = []
+    for _ in range(latency_runs):
+        started = time.perf_counter()
+        backend.predict(sample)
+        timings.append((time.perf_counter() - started) * 1000.0)
+
+    return {
+        "accuracy": correct / len(validation_files) if validation_files else None,
+        "latency_ms_p50": float(np.percentile(timings, 50)),
+        "latency_ms_p95": float(np.percentile(timings, 95)),
+    }
+
+
+def choose_variant(results, tolerance):
+    """La variante más pequeña cuya exactitud no cae más de `tolerance`."""
+    baseline = results["keras"]["accuracy"]
+    candidates = [
+        (r["size_bytes"], name) for name, r in results.items()
+        if name != "keras"
+        and r["accuracy"] is not None
+        and baseline is not None
+        and r["accuracy"] >= baseline - tolerance
+    ]
+    return min(candidates)[1] if candidates else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=settings.MODEL_PATH, help="Modelo Keras .h5")
+    parser.add_argument("--dataset", required=True, help="Carpeta con una subcarpeta por clase")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--calibration-samples", type=int, default=200)
+    parser.add_argument("--latency-runs", type=int, default=50)
+    parser.add_argument(
+        "--tolerance", type=float, default=settings.QUANTIZATION_ACCURACY_TOLERANCE
+    )
+    parser.add_argument("--report", default="model_data/quantization_report.json")
+    parser.add_argument(
+        "--install",
+        action="store_true",
+        help="Copiar la variante recomendada a la ruta del motor tflite",
+    )
+    args = parser.parse_args(argv)
+
+    classes, train_files, validation_files = split_dataset(args.dataset)
+    print(f"🎯 Clases: {classes} | train={len(train_files)} val={len(validation_files)}")
+
+    keras_backend = create_backend("keras", args.model)
+    keras_backend.load()
+
+    results = {
+        "keras": {
+            "path": args.model,
+            "size_bytes": os.path.getsize(args.model),
+            **evaluate(keras_backend, validation_files, args.latency_runs),
+        }
+    }
+
+    root, _ = os.path.splitext(args.model)
+    for variant in args.variants:
+        print(f"⚙️ Cuantizando variante {variant}...")
+        output_path = f"{root}.{variant}.tflite"
+        with open(output_path, "wb") as f:
+            f.write(
+                convert_variant(
+                    keras_backend.model, variant, train_files, args.calibration_samples
+                )
+            )
+        backend = TFLiteBackend(output_path)
+        backend.load()
+        results[variant] = {
+            "path": output_path,
+            "size_bytes": os.path.getsize(output_path),
+            **evaluate(backend, validation_files, args.latency_runs),
+        }
+
+    recommended = choose_variant(results, args.tolerance)
+    report = {
+        "model": args.model,
+        "classes": classes,
+        "validation_images": len(validation_files),
+        "tolerance": args.tolerance,
+        "recommended": recommended,
+        "variants": results,
+    }
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"{'variante':<15}{'exactitud':>10}{'p50 ms':>10}{'p95 ms':>10}{'MB':>10}")
+    for name, r in results.items():
+        accuracy = f"{r['accuracy']:.4f}" if r["accuracy"] is not None else "-"
+        print(
+            f"{name:<15}{accuracy:>10}{r['latency_ms_p50']:>10.2f}"
+            f"{r['latency_ms_p95']:>10.2f}{r['size_bytes'] / 1e6:>10.2f}"
+        )
+    print(f"📄 Reporte: {args.report}")
+
+    if recommended is None:
+        print("❌ Ninguna variante queda dentro de la tolerancia de exactitud")
+        return 1
+
+    print(f"✅ Variante recomendada: {recommended}")
+    if args.install:
+        target = backend_model_path(args.model, "tflite")
+        shutil.copyfile(results[recommended]["path"], target)
+        print(f"📦 Instalada en {target} (usar INFERENCE_BACKEND=tflite)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
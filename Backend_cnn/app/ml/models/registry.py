@@ -0,0 +1,290 @@
+# app/ml/models/registry.py
+"""
+Registro local de versiones del modelo.
+
+Cada versión vive en `<root>/<versión>/` con su archivo de modelo y un
+`meta.json` (motor, sha256, fecha, descripción, métricas). Qué versión se
+sirve y cuál corre en sombra lo indican `active.json` y `shadow.json`,
+que se reescriben de forma atómica (archivo temporal + os.replace): los
+procesos que vigilan el registro nunca leen un puntero a medias.
+
+Uso (desde Backend_cnn/):
+    python -m app.ml.models.registry register --model model_data/model_copper_fixed.h5 --activate
+    python -m app.ml.models.registry register --model model_data/model_copper_fixed.int8.tflite --backend tflite
+    python -m app.ml.models.registry list
+    python -m app.ml.models.registry activate v2-1a2b3c4d
+    python -m app.ml.models.registry shadow v3-5e6f7a8b --rate 0.1
+    python -m app.ml.models.registry shadow --off
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.ml.models.backends import BACKEND_EXTENSIONS, BACKENDS
+
+ACTIVE_POINTER = "active.json"
+SHADOW_POINTER = "shadow.json"
+META_FILE = "meta.json"
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,49}$")
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path: str, data: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ModelRegistry:
+    def __init__(self, root: str):
+        self.root = root
+
+    # --------- versiones ---------
+
+    def _version_dir(self, version: str) -> str:
+        if not VERSION_PATTERN.match(version):
+            raise ValueError(f"Versión inválida: {version}")
+        return os.path.join(self.root, version)
+
+    def get(self, version: str) -> Optional[Dict[str, Any]]:
+        return _read_json(os.path.join(self._version_dir(version), META_FILE))
+
+    def model_path(self, meta: Dict[str, Any]) -> str:
+        return os.path.join(self._version_dir(meta["version"]), meta["file"])
+
+    def list_versions(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.root):
+            return []
+        versions = []
+        for name in os.listdir(self.root):
+            if ".tmp-" in name or not VERSION_PATTERN.match(name):
+                continue
+            if os.path.isdir(os.path.join(self.root, name)):
+                meta = self.get(name)
+                if meta is not None:
+                    versions.append(meta)
+        return sorted(versions, key=lambda meta: meta.get("created_at", ""))
+
+    def register(
+        self,
+        source_path: str,
+        backend: str = "keras",
+        version: Optional[str] = None,
+        description: str = "",
+        metrics: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Copia el archivo del modelo al registro y devuelve su metadata."""
+        if backend not in BACKENDS:
+            raise ValueError(f"Motor desconocido: {backend}")
+        sha256 = _sha256(source_path)
+        if version is None:
+            version = f"v{len(self.list_versions()) + 1}-{sha256[:8]}"
+        version_dir = self._version_dir(version)
+        if os.path.exists(version_dir):
+            raise ValueError(f"La versión {version} ya existe")
+
+        extension = os.path.splitext(source_path)[1] or BACKEND_EXTENSIONS[backend]
+        file_name = f"model{extension}"
+        # Se arma en un directorio temporal y se publica con un rename
+        tmp_dir = f"{version_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir)
+        try:
+            shutil.copy2(source_path, os.path.join(tmp_dir, file_name))
+            meta = {
+                "version": version,
+                "backend": backend,
+                "file": file_name,
+                "sha256": sha256,
+                "size_bytes": os.path.getsize(source_path),
+                "source": os.path.abspath(source_path),
+                "created_at": datetime.now().isoformat(timespec="milliseconds"),
+                "description": description,
+                "metrics": metrics or {},
+            }
+            _write_json_atomic(os.path.join(tmp_dir, META_FILE), meta)
+            os.replace(tmp_dir, version_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return meta
+
+    # --------- punteros ---------
+
+    def _pointer(self, name: str) -> Optional[Dict[str, Any]]:
+        return _read_json(os.path.join(self.root, name))
+
+    def _set_pointer(self, name: str, data: Dict[str, Any]) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        _write_json_atomic(os.path.join(self.root, name), data)
+
+    def active(self) -> Optional[Dict[str, Any]]:
+        """Metadata de la versión activa (None si el registro está vacío)."""
+        pointer = self._pointer(ACTIVE_POINTER)
+        return self.get(pointer["version"]) if pointer else None
+
+    def activate(self, version: str) -> Dict[str, Any]:
+        meta = self.get(version)
+        if meta is None:
+            raise ValueError(f"Versión no registrada: {version}")
+        self._set_pointer(
+            ACTIVE_POINTER,
+            {"version": version, "activated_at": datetime.now().isoformat(timespec="seconds")},
+        )
+        return meta
+
+    def shadow(self) -> Optional[Dict[str, Any]]:
+        """{"meta": ..., "sample_rate": ...} del modelo en sombra, o None."""
+        pointer = self._pointer(SHADOW_POINTER)
+        if not pointer or not pointer.get("version"):
+            return None
+        meta = self.get(pointer["version"])
+        if meta is None:
+            return None
+        return {"meta": meta, "sample_rate": float(pointer.get("sample_rate", 0.0))}
+
+    def set_shadow(self, version: Optional[str], sample_rate: float = 0.0) -> None:
+        if version is not None and self.get(version) is None:
+            raise ValueError(f"Versión no registrada: {version}")
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate debe estar entre 0 y 1")
+        self._set_pointer(
+            SHADOW_POINTER,
+            {"version": version, "sample_rate": sample_rate if version else 0.0},
+        )
+
+    def pointers_signature(self):
+        """Cambia cada vez que se reescribe un puntero (para vigilarlos)."""
+        signature = []
+        for name in (ACTIVE_POINTER, SHADOW_POINTER):
+            try:
+                stat = os.stat(os.path.join(self.root, name))
+                signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+
+def start_registry_watcher(
+    registry: ModelRegistry,
+    on_change: Callable[[], None],
+    interval: float,
+) -> threading.Event:
+    """
+    Hilo que llama a `on_change` cuando cambian los punteros del registro.
+    Así cada proceso (workers de uvicorn y de la cola) se entera de una
+    activación hecha desde otro. Devuelve el Event para detenerlo.
+    """
+    stop = threading.Event()
+
+    def watch():
+        last = registry.pointers_signature()
+        while not stop.wait(interval):
+            current = registry.pointers_signature()
+            if current != last:
+                last = current
+                try:
+                    on_change()
+                except Exception as e:
+                    print(f"❌ Error aplicando cambios del registro de modelos: {e}")
+
+    threading.Thread(target=watch, name="model-registry-watcher", daemon=True).start()
+    return stop
+
+
+model_registry = ModelRegistry(settings.MODEL_REGISTRY_DIR)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--root", default=settings.MODEL_REGISTRY_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    register = commands.add_parser("register", help="Registrar un archivo de modelo")
+    register.add_argument("--model", required=True)
+    register.add_argument("--backend", choices=sorted(BACKENDS), default=None)
+    register.add_argument("--version", default=None)
+    register.add_argument("--description", default="")
+    register.add_argument("--metrics", default=None, help="JSON con métricas (p. ej. el reporte de cuantización)")
+    register.add_argument("--activate", action="store_true")
+
+    commands.add_parser("list", help="Listar versiones")
+
+    activate = commands.add_parser("activate", help="Activar una versión (hot-swap)")
+    activate.add_argument("version")
+
+    shadow = commands.add_parser("shadow", help="Configurar el modelo en sombra")
+    shadow.add_argument("version", nargs="?")
+    shadow.add_argument("--rate", type=float, default=settings.MODEL_SHADOW_SAMPLE_RATE)
+    shadow.add_argument("--off", action="store_true")
+
+    args = parser.parse_args(argv)
+    registry = ModelRegistry(args.root)
+
+    if args.command == "register":
+        backend = args.backend
+        if backend is None:
+            extension = os.path.splitext(args.model)[1].lower()
+            backend = {v: k for k, v in BACKEND_EXTENSIONS.items()}.get(extension, "keras")
+        metrics = None
+        if args.metrics:
+            with open(args.metrics, encoding="utf-8") as f:
+                metrics = json.load(f)
+        meta = registry.register(args.model, backend, args.version, args.description, metrics)
+        print(f"📦 Registrada {meta['version']} ({meta['backend']}, {meta['size_bytes'] / 1e6:.1f} MB)")
+        if args.activate:
+            registry.activate(meta["version"])
+            print(f"✅ Versión activa: {meta['version']}")
+    elif args.command == "list":
+        active = registry.active()
+        shadow = registry.shadow()
+        for meta in registry.list_versions():
+            flags = []
+            if active and active["version"] == meta["version"]:
+                flags.append("activa")
+            if shadow and shadow["meta"]["version"] == meta["version"]:
+                flags.append(f"sombra {shadow['sample_rate']:.0%}")
+            print(
+                f"{meta['version']:<24}{meta['backend']:<8}{meta['created_at'][:19]:<22}"
+                f"{', '.join(flags):<18}{meta.get('description', '')}"
+            )
+    elif args.command == "activate":
+        registry.activate(args.version)
+        print(f"✅ Versión activa: {args.version} (los procesos la cargan en caliente)")
+    elif args.command == "shadow":
+        if args.off or not args.version:
+            registry.set_shadow(None)
+            print("🌑 Modo sombra desactivado")
+        else:
+            registry.set_shadow(args.version, args.rate)
+            print(f"🌗 {args.version} en sombra sobre el {args.rate:.0%} del tráfico")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
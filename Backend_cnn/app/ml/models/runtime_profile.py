@@ -0,0 +1,111 @@
+# app/ml/models/runtime_profile.py
+"""
+Perfil de runtime: hilos del motor, tamaño de lote y procesos de inferencia
+recomendados para este equipo, medidos por benchmarks/tune_threads.py.
+
+Por defecto TensorFlow (y OpenMP) usan todos los núcleos en cada proceso:
+con varios workers de uvicorn o de la cola en la misma máquina se pisan y
+la latencia de cola se dispara. El perfil se aplica al importar este
+módulo (lo importa CopperCNN, antes de que se cargue TensorFlow), así
+cada proceso arranca con los hilos que le corresponden.
+
+Prioridad de cada valor: variable de entorno explícita > perfil > valor
+por defecto del runtime. Un perfil medido en otro equipo (distinta
+cantidad de núcleos) se ignora.
+"""
+import json
+import os
+import platform
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+
+def load_profile(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(profile, dict) or not isinstance(profile.get("recommended"), dict):
+        print(f"⚠️ Perfil de runtime inválido: {path}")
+        return None
+    cpu_count = (profile.get("host") or {}).get("cpu_count")
+    if cpu_count and cpu_count != os.cpu_count():
+        print(
+            f"⚠️ Perfil de runtime medido con {cpu_count} núcleos y este equipo "
+            f"tiene {os.cpu_count()}: se ignora ({path})"
+        )
+        return None
+    return profile
+
+
+def _positive(value: Any) -> Optional[int]:
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def resolve_runtime(profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Valores efectivos: entorno > perfil > None (por defecto del runtime)."""
+    recommended = (profile or {}).get("recommended") or {}
+
+    def pick(env_name: str, explicit: Optional[int], key: str) -> Optional[int]:
+        if os.getenv(env_name):
+            return explicit
+        return _positive(recommended.get(key)) or explicit
+
+    return {
+        "intra_op_threads": pick(
+            "INFERENCE_INTRA_OP_THREADS", settings.INFERENCE_INTRA_OP_THREADS, "intra_op_threads"
+        ),
+        "inter_op_threads": pick(
+            "INFERENCE_INTER_OP_THREADS", settings.INFERENCE_INTER_OP_THREADS, "inter_op_threads"
+        ),
+        "batch_size": pick(
+            "INFERENCE_MAX_BATCH_SIZE", settings.INFERENCE_MAX_BATCH_SIZE, "batch_size"
+        ),
+        "workers": pick(
+            "ANALYSIS_WORKER_PROCESSES", settings.ANALYSIS_WORKER_PROCESSES, "workers"
+        ),
+        "profile": settings.RUNTIME_PROFILE_PATH if profile else None,
+    }
+
+
+def apply_thread_environment(runtime: Dict[str, Any]) -> None:
+    """
+    Variables que leen TensorFlow y OpenMP al inicializarse. No pisa las
+    que ya vengan definidas en el entorno.
+    """
+    intra = runtime.get("intra_op_threads")
+    inter = runtime.get("inter_op_threads")
+    if intra:
+        os.environ.setdefault("OMP_NUM_THREADS", str(intra))
+        os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(intra))
+    if inter:
+        os.environ.setdefault("TF_NUM_INTEROP_THREADS", str(inter))
+
+
+def host_info() -> Dict[str, Any]:
+    return {
+        "hostname": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+    }
+
+
+runtime_profile = (
+    load_profile(settings.RUNTIME_PROFILE_PATH) if settings.RUNTIME_PROFILE_ENABLED else None
+)
+runtime_settings = resolve_runtime(runtime_profile)
+apply_thread_environment(runtime_settings)
+if runtime_profile is not None:
+    print(
+        f"⚙️ Perfil de runtime {settings.RUNTIME_PROFILE_PATH}: "
+        f"{runtime_settings['intra_op_threads']} hilos intra-op, "
+        f"{runtime_settings['inter_op_threads']} inter-op, lotes de "
+        f"{runtime_settings['batch_size']}, {runtime_settings['workers']} procesos"
+    )
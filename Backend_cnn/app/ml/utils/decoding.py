@@ -0,0 +1,119 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+# Para reducir antes del resample final (Image.reduce), ver Image.resize
+REDUCING_GAP = 3.0
+
+# Errores de PIL al decodificar un archivo dañado o inválido (no del
+# servidor): archivo truncado u ilegible (OSError, UnidentifiedImageError
+# incluida), cabeceras corruptas (SyntaxError) o bombas de descompresión
+DECODE_ERRORS = (OSError, SyntaxError, Image.DecompressionBombError)
+
+
+def open_image(source):
+    """
+    Abre una imagen desde una ruta, bytes, memoryview o un buffer
+    (BytesIO / archivo abierto), sin pasar por disco si ya está en memoria.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def decode_image(source, size=(224, 224), fast=True):
+    """
+    Decodifica y redimensiona a `size`, devolviendo uint8 (H, W, 3).
+
+    En modo rápido los JPEG se decodifican con `draft`, que le pide a
+    libjpeg escalar 1/2, 1/4 o 1/8 durante la decodificación (sin bajar de
+    `size`), así una foto de 12 MP nunca se decodifica a resolución
+    completa. El resto de la reducción usa `reducing_gap`.
+    """
+    img = open_image(source)
+    if fast and img.format == "JPEG":
+        img.draft("RGB", size)
+    img = img.convert("RGB")
+    if fast:
+        img = img.resize(size, reducing_gap=REDUCING_GAP)
+    else:
+        img = img.resize(size)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def normalize_into(image, out):
+    """Escribe `image` (uint8 o float en [0, 1]) como float32 en `out`."""
+    if image.dtype == np.uint8:
+        np.multiply(image, np.float32(1.0 / 255.0), out=out, casting="unsafe")
+    else:
+        out[...] = image
+    return out
+
+
+def load_image_array(source, size=(224, 224), fast=True):
+    """
+    Decodifica una imagen y la deja lista para el modelo: (1, H, W, 3)
+    float32 normalizada a [0, 1]. `source` puede ser ruta, bytes o buffer.
+
+    Solo depende de PIL y NumPy para poder correr en un proceso aparte
+    sin importar TensorFlow.
+    """
+    image = decode_image(source, size, fast=fast)
+    out = np.empty((1, *image.shape), dtype=np.float32)
+    normalize_into(image, out[0])
+    return out
+
+
+def _tile_positions(length, tile, stride):
+    """Inicios de tile a lo largo de un eje; el último queda pegado al borde."""
+    if length <= tile:
+        return [0]
+    positions = list(range(0, length - tile + 1, stride))
+    if positions[-1] != length - tile:
+        positions.append(length - tile)
+    return positions
+
+
+def _grid_shape(width, height, tile, stride):
+    return len(_tile_positions(height, tile, stride)), len(_tile_positions(width, tile, stride))
+
+
+def decode_tiles(source, tile=224, overlap=0.25, max_tiles=64, fast=True):
+    """
+    Decodifica una imagen grande en tiles solapados de `tile` x `tile`.
+
+    Si la grilla a resolución completa superaría `max_tiles`, la imagen se
+    reduce (con `draft` en JPEG) hasta que quepa, así la cantidad de tiles,
+    y por ende la latencia, queda acotada. Devuelve (tiles uint8
+    (N, tile, tile, 3), filas, columnas) en orden fila por fila.
+    """
+    stride = max(1, int(round(tile * (1.0 - overlap))))
+    max_tiles = max(1, max_tiles)
+    img = open_image(source)
+    width, height = img.size
+
+    scale = 1.0
+    rows, cols = _grid_shape(width, height, tile, stride)
+    while rows * cols > max_tiles:
+        scale *= max(0.5, min(0.95, (max_tiles / (rows * cols)) ** 0.5))
+        rows, cols = _grid_shape(int(width * scale), int(height * scale), tile, stride)
+
+    # Nunca por debajo de un tile en cada eje
+    target = (max(tile, int(width * scale)), max(tile, int(height * scale)))
+    if fast and img.format == "JPEG":
+        img.draft("RGB", target)
+    img = img.convert("RGB")
+    if img.size != target:
+        img = img.resize(target, reducing_gap=REDUCING_GAP if fast else None)
+    pixels = np.asarray(img, dtype=np.uint8)
+
+    ys = _tile_positions(target[1], tile, stride)
+    xs = _tile_positions(target[0], tile, stride)
+    tiles = np.empty((len(ys) * len(xs), tile, tile, 3), dtype=np.uint8)
+    i = 0
+    for y in ys:
+        for x in xs:
+            tiles[i] = pixels[y:y + tile, x:x + tile]
+            i += 1
+    return tiles, len(ys), len(xs)
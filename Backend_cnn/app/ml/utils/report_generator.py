@@ -1,10 +1,15 @@
 import os
-from typing import Any, Dict
+from typing import Any, Dict, Iterable
 
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
 
+# Subir cuando cambie el diseño del PDF: invalida los PDFs en caché
+# (app.services.report_cache), que se renderizan de nuevo al descargarse
+TEMPLATE_VERSION = "1"
+
 
 def _wrap_text(text: str, max_chars: int = 90):
     """
@@ -30,14 +35,50 @@ def _wrap_text(text: str, max_chars: int = 90):
     return lines
 
 
-def generate_pdf_report(payload: Dict[str, Any], output_path: str) -> None:
+def _heatmap_color(value: float):
+    """Interpola de gris claro (sin cobre) a color cobre."""
+    low = (0.95, 0.95, 0.95)
+    high = (0.72, 0.45, 0.20)
+    v = min(max(float(value), 0.0), 1.0)
+    return tuple(lo + (hi - lo) * v for lo, hi in zip(low, high))
+
+
+def _draw_heatmap(c, heatmap: Dict[str, Any], x: float, top: float,
+                  max_width: float, max_height: float) -> float:
     """
-    Genera un PDF simple con la información del análisis.
-    payload viene del detalle (AnalysisDetail).
+    Dibuja la grilla de probabilidad de cobre con su esquina superior
+    izquierda en (x, top). Devuelve la altura usada.
     """
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    rows = int(heatmap.get("rows") or 0)
+    cols = int(heatmap.get("cols") or 0)
+    values = heatmap.get("values") or []
+    if not rows or not cols:
+        return 0
 
-    c = canvas.Canvas(output_path, pagesize=A4)
+    cell = min(max_width / cols, max_height / rows)
+    c.setStrokeColorRGB(1, 1, 1)
+    for r in range(rows):
+        for col in range(cols):
+            value = values[r][col]
+            c.setFillColorRGB(*_heatmap_color(value))
+            c.rect(x + col * cell, top - (r + 1) * cell, cell, cell, stroke=1, fill=1)
+            if cell >= 1 * cm:
+                c.setFillColorRGB(0, 0, 0)
+                c.setFont("Helvetica", 7)
+                c.drawCentredString(
+                    x + col * cell + cell / 2,
+                    top - (r + 1) * cell + cell / 2 - 2,
+                    f"{value:.2f}",
+                )
+    c.setFillColorRGB(0, 0, 0)
+    return rows * cell
+
+
+def draw_report(c, payload: Dict[str, Any]) -> None:
+    """
+    Dibuja un reporte en el canvas `c`, desde una página nueva hasta el
+    final (termina con showPage).
+    """
     width, height = A4
     x = 2 * cm
     y = height - 2 * cm
@@ -70,5 +111,65 @@ def generate_pdf_report(payload: Dict[str, Any], output_path: str) -> None:
         for t in _wrap_text(f"• {rec}"):
             line(t)
 
+    heatmap = payload.get("heatmap")
+    if heatmap:
+        line("")
+        line("Mapa de calor de cobre por región", "Helvetica-Bold", 12, 16)
+        line(
+            f"Regiones con cobre: {round(heatmap.get('copperFraction', 0) * 100, 1)} % "
+            f"(grilla {heatmap.get('rows')}x{heatmap.get('cols')})"
+        )
+        max_height = min(10 * cm, y - 2 * cm)
+        if max_height < 4 * cm:
+            c.showPage()
+            y = height - 2 * cm
+            max_height = 10 * cm
+        y -= _draw_heatmap(c, heatmap, x, y, width - 4 * cm, max_height)
+
+    explanation_path = payload.get("explanationPath")
+    if explanation_path and os.path.exists(explanation_path):
+        line("")
+        line("Explicación del modelo (Grad-CAM)", "Helvetica-Bold", 12, 16)
+        line("Las zonas cálidas son las que más pesaron en la clasificación.")
+        image = ImageReader(explanation_path)
+        image_width, image_height = image.getSize()
+        max_height = min(12 * cm, y - 2 * cm)
+        if max_height < 5 * cm:
+            c.showPage()
+            y = height - 2 * cm
+            max_height = 12 * cm
+        scale = min((width - 4 * cm) / image_width, max_height / image_height)
+        c.drawImage(
+            image, x, y - image_height * scale,
+            width=image_width * scale, height=image_height * scale,
+        )
+        y -= image_height * scale
+
     c.showPage()
+
+
+def generate_pdf_report(payload: Dict[str, Any], output_path: str) -> None:
+    """
+    Genera un PDF simple con la información del análisis.
+    payload viene del detalle (AnalysisDetail).
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    c = canvas.Canvas(output_path, pagesize=A4)
+    draw_report(c, payload)
+    c.save()
+
+
+def generate_merged_report(payloads: Iterable[Dict[str, Any]], output_path: str) -> int:
+    """
+    Un solo PDF con varios reportes, uno a continuación del otro.
+    Devuelve la cantidad de reportes.
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    c = canvas.Canvas(output_path, pagesize=A4)
+    c.setTitle("MinerIA - Reportes de análisis")
+    count = 0
+    for payload in payloads:
+        draw_report(c, payload)
+        count += 1
     c.save()
+    return count
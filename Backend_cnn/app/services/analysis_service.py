@@ -0,0 +1,110 @@
+# app/services/analysis_service.py
+import json
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from app.db import models as db_models
+
+
+def build_detail_payload(
+    meta_dict: Dict[str, Any],
+    predicted_class: str,
+    confidence: float,
+    id_clasificacion: int,
+    fecha_clasificacion,
+    web_url: str,
+    heatmap: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Construye el detalle del análisis (formato AnalysisDetail del front) a
+    partir de la metadata enviada y el resultado de la IA. Es lo que se
+    guarda en `reportes.contenido` y se usa para el PDF.
+    """
+    category = str(meta_dict.get("category") or "No especificada")
+    risk_level = str(meta_dict.get("riskLevel") or "No especificado")
+    zone = str(meta_dict.get("location") or "Zona no especificada")
+    gps = str(meta_dict.get("coordinates") or "")
+    responsable = str(meta_dict.get("responsible") or "")
+    personal = meta_dict.get("personnel")
+
+    conf_pct = round(confidence * 100, 2)
+    hay_cobre = predicted_class == "con_cobre"
+
+    if hay_cobre:
+        copper_grade_text = f"Presencia de cobre detectada ({conf_pct} % de confianza)"
+        ai_summary = (
+            f"Se detecta PRESENCIA de vetas de cobre en la imagen con una "
+            f"confianza de {conf_pct}%. Zona: {zone}. Nivel de riesgo declarado: {risk_level}. "
+            f"Responsable del registro: {responsable or 'N/D'}. "
+            f"Personal involucrado: {personal or 'N/D'}."
+        )
+        recommendations = [
+            "Derivar el registro al área de geología para evaluación detallada.",
+            "Actualizar el modelo geológico de la zona con esta evidencia.",
+            "Priorizar esta zona en el plan de explotación según los lineamientos de la faena.",
+        ]
+        status = "con_cobre"
+    else:
+        copper_grade_text = f"Sin evidencia significativa de cobre ({conf_pct} % de confianza)"
+        ai_summary = (
+            f"No se detecta presencia significativa de vetas de cobre en la imagen "
+            f"(confianza {conf_pct}%). Zona: {zone}. Nivel de riesgo declarado: {risk_level}. "
+            f"Responsable del registro: {responsable or 'N/D'}. "
+            f"Personal involucrado: {personal or 'N/D'}."
+        )
+        recommendations = [
+            "Archivar el registro como caso sin presencia de cobre.",
+            "Utilizar esta imagen como ejemplo negativo para seguir entrenando el modelo.",
+        ]
+        status = "sin_cobre"
+
+    meta_out: Dict[str, Any] = dict(meta_dict)
+    meta_out.update(
+        {
+            "coordinates": gps,
+            "responsible": responsable,
+            "personnel": personal,
+            "modelo": "CopperCNN",
+            "confianza_porcentaje": conf_pct,
+            "modo_inferencia": "tiles" if heatmap is not None else "imagen_completa",
+        }
+    )
+
+    detail_payload: Dict[str, Any] = {
+        "id": id_clasificacion,
+        "date": fecha_clasificacion.isoformat() if fecha_clasificacion else "",
+        "zone": zone,
+        "category": category,
+        "riskLevel": risk_level,
+        "copperGrade": copper_grade_text,
+        "aiSummary": ai_summary,
+        "recommendations": recommendations,
+        "metadata": meta_out,
+        "imageUrl": web_url,
+        "status": status,
+    }
+    if heatmap is not None:
+        detail_payload["heatmap"] = heatmap
+    return detail_payload
+
+
+def save_reporte(db: Session, id_clasificacion: int, detail_payload: Dict[str, Any]):
+    reporte = db_models.Reporte(
+        id_clasificacion=id_clasificacion,
+        contenido=json.dumps(detail_payload, ensure_ascii=False),
+        formato_reporte="pdf",
+    )
+    db.add(reporte)
+    db.commit()
+
+
+def analysis_event(detail_payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Resumen de un análisis terminado para los eventos de progreso."""
+    return {
+        "analysisId": detail_payload["id"],
+        "status": detail_payload["status"],
+        "copperGrade": detail_payload["copperGrade"],
+        "zone": detail_payload["zone"],
+        "imageUrl": detail_payload["imageUrl"],
+    }
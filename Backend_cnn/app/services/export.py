@@ -0,0 +1,398 @@
+# app/services/export.py
+"""
+Exportación en bloque de reportes (GET /api/analysis/export).
+
+Los análisis que cumplen el filtro (fechas, zona, estado) se recorren por
+páginas, sin cargar todos los reportes a la vez. Los PDFs que falten se
+renderizan en `render_stage` (report_cache) y luego:
+
+- ZIP: se arma al vuelo, sin compresión (los PDF ya vienen comprimidos) y
+  sin escribirlo a disco. Con el tamaño y el CRC de cada PDF el archivo
+  completo queda determinado de antemano: se conoce su largo, su ETag, y
+  cualquier rango de bytes se genera leyendo solo los PDFs que toca. Una
+  descarga cortada se reanuda con Range/If-Range.
+  Los PDFs se enlazan (hard link) en <EXPORTS_DIR>/zip-<etag>/: el gc de
+  la caché de reportes no los borra a mitad de una descarga. El armado
+  queda en memoria por filtro, así reanudar no vuelve a consultar ni a
+  leer los PDFs; el CRC de cada PDF en caché se calcula una sola vez
+  mientras el archivo no cambie.
+- PDF unido: un solo documento renderizado en el pool de procesos a
+  <EXPORTS_DIR>/<clave>.pdf (clave = versión de plantilla + reportes), que
+  se sirve como archivo con Range. Limitado a EXPORT_MAX_MERGED reportes.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import struct
+import time
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+from uuid import uuid4
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.executors import db_stage, io_stage, render_stage
+from app.db import models as db_models
+from app.ml.utils.report_generator import TEMPLATE_VERSION, generate_merged_report
+from app.services.report_cache import render_key, report_renderer
+
+PAGE_SIZE = 200
+READ_CHUNK = 64 * 1024
+# Límites del formato ZIP sin extensiones ZIP64
+ZIP_MAX_ENTRIES = 0xFFFF
+ZIP_MAX_BYTES = 0xFFFFFFFF
+# Bit 11: nombres en UTF-8
+ZIP_FLAGS = 0x0800
+# Armados de ZIP recientes (por filtro) y CRC de PDFs en caché (por ruta)
+LAYOUT_CACHE_SIZE = 32
+CRC_CACHE_SIZE = 50000
+
+
+class ExportTooLarge(Exception):
+    """El filtro abarca más reportes (o bytes) de los que se exportan de una vez."""
+
+
+class ExportFilter(NamedTuple):
+    id_usuario: Optional[int]  # None: todos los usuarios
+    date_from: Optional[date]
+    date_to: Optional[date]
+    zone: Optional[str]
+    status: Optional[str]
+
+
+class ZipEntry(NamedTuple):
+    name: str
+    path: str
+    size: int
+    crc: int
+    moment: datetime
+
+
+def _fetch_page(
+    db: Session, filters: ExportFilter, after_id: int, limit: int
+) -> List[Tuple[int, datetime, Dict[str, Any]]]:
+    C, I, R = db_models.Clasificacion, db_models.Imagen, db_models.Reporte
+    query = (
+        db.query(C.id_clasificacion, C.fecha_clasificacion, R.contenido)
+        .join(R, R.id_clasificacion == C.id_clasificacion)
+        .join(I, C.id_imagen == I.id_imagen)
+        .filter(C.id_clasificacion > after_id)
+    )
+    if filters.id_usuario is not None:
+        query = query.filter(I.id_usuario == filters.id_usuario)
+    if filters.date_from is not None:
+        query = query.filter(
+            C.fecha_clasificacion >= datetime.combine(filters.date_from, dt_time.min)
+        )
+    if filters.date_to is not None:
+        query = query.filter(
+            C.fecha_clasificacion
+            < datetime.combine(filters.date_to + timedelta(days=1), dt_time.min)
+        )
+    if filters.status is not None:
+        query = query.filter(C.resultado == filters.status)
+    rows = query.order_by(C.id_clasificacion).limit(limit).all()
+
+    page = []
+    for id_clasificacion, fecha, contenido in rows:
+        try:
+            payload = json.loads(contenido or "{}")
+        except ValueError:
+            continue
+        page.append((id_clasificacion, fecha, payload))
+    return page
+
+
+def _zone_matches(payload: Dict[str, Any], zone: Optional[str]) -> bool:
+    if zone is None:
+        return True
+    return str(payload.get("zone") or "").strip().casefold() == zone.strip().casefold()
+
+
+def entry_name(id_clasificacion: int, moment: Optional[datetime]) -> str:
+    prefix = moment.strftime("%Y-%m-%d_") if moment else ""
+    return f"{prefix}reporte_{id_clasificacion}.pdf"
+
+
+async def iter_reports(filters: ExportFilter, db: Session, limit: int):
+    """
+    Páginas de (id, fecha, payload) que cumplen el filtro. Lanza
+    ExportTooLarge apenas se pasa de `limit`.
+    """
+    after_id = 0
+    total = 0
+    while True:
+        page = await db_stage.run(_fetch_page, db, filters, after_id, PAGE_SIZE)
+        if not page:
+            return
+        after_id = page[-1][0]
+        selected = [row for row in page if _zone_matches(row[2], filters.zone)]
+        total += len(selected)
+        if total > limit:
+            raise ExportTooLarge(
+                f"El filtro abarca más de {limit} reportes: acote las fechas o la zona"
+            )
+        if selected:
+            yield selected
+
+
+# --------- ZIP al vuelo ---------
+
+def _crc_file(path: str) -> Tuple[int, int]:
+    crc, size = 0, 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_CHUNK), b""):
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+    return size, crc
+
+
+def _dos_datetime(moment: datetime) -> Tuple[int, int]:
+    moment = max(moment, datetime(1980, 1, 1))
+    dos_date = ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day
+    dos_time = (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2)
+    return dos_time, dos_date
+
+
+class ZipLayout:
+    """
+    ZIP (método stored) descrito como segmentos consecutivos: bytes de
+    cabecera en memoria o el contenido de un PDF en disco.
+    """
+
+    def __init__(self, entries: List[ZipEntry]):
+        if len(entries) > ZIP_MAX_ENTRIES:
+            raise ExportTooLarge("Demasiados reportes para un ZIP")
+        self.segments: List[Tuple[int, int, Union[bytes, str]]] = []
+        central = []
+        offset = 0
+        for entry in entries:
+            if offset + entry.size > ZIP_MAX_BYTES:
+                raise ExportTooLarge("La exportación supera 4 GB: acote el filtro")
+            name = entry.name.encode("utf-8")
+            dos_time, dos_date = _dos_datetime(entry.moment)
+            header = struct.pack(
+                "<4sHHHHHLLLHH",
+                b"PK\x03\x04", 20, ZIP_FLAGS, 0, dos_time, dos_date,
+                entry.crc, entry.size, entry.size, len(name), 0,
+            ) + name
+            central.append(
+                struct.pack(
+                    "<4sHHHHHHLLLHHHHHLL",
+                    b"PK\x01\x02", 20, 20, ZIP_FLAGS, 0, dos_time, dos_date,
+                    entry.crc, entry.size, entry.size, len(name), 0, 0, 0, 0,
+                    0o100644 << 16, offset,
+                ) + name
+            )
+            offset = self._add(offset, header)
+            offset = self._add(offset, entry.path, entry.size)
+        directory = b"".join(central)
+        if offset + len(directory) > ZIP_MAX_BYTES:
+            raise ExportTooLarge("La exportación supera 4 GB: acote el filtro")
+        end = struct.pack(
+            "<4sHHHHLLH",
+            b"PK\x05\x06", 0, 0, len(entries), len(entries), len(directory), offset, 0,
+        )
+        offset = self._add(offset, directory + end)
+        self.size = offset
+        self._starts = [start for start, _, _ in self.segments]
+        # El ETag cubre nombres, tamaños y CRC: cambia si cambia algún byte
+        self.etag = '"zip-%s"' % hashlib.sha256(directory).hexdigest()
+
+    def _add(self, offset: int, source: Union[bytes, str], length: Optional[int] = None) -> int:
+        length = len(source) if length is None else length
+        self.segments.append((offset, length, source))
+        return offset + length
+
+    def read_range(self, start: int, end: int) -> Iterator[bytes]:
+        """Bytes [start, end] del ZIP, leyendo de disco solo lo necesario."""
+        index = bisect_right(self._starts, start) - 1
+        position = start
+        while position <= end and index < len(self.segments):
+            seg_start, length, source = self.segments[index]
+            seg_from = position - seg_start
+            seg_to = min(length, end - seg_start + 1)
+            if isinstance(source, bytes):
+                yield source[seg_from:seg_to]
+            else:
+                with open(source, "rb") as f:
+                    f.seek(seg_from)
+                    remaining = seg_to - seg_from
+                    while remaining > 0:
+                        block = f.read(min(READ_CHUNK, remaining))
+                        if not block:
+                            raise OSError(f"{source} cambió durante la exportación")
+                        remaining -= len(block)
+                        yield block
+            position = seg_start + seg_to
+            index += 1
+
+
+_layouts: "OrderedDict[Tuple[ExportFilter, str], ZipLayout]" = OrderedDict()
+# (ruta, mtime, tamaño) -> (tamaño, CRC). Un PDF vuelto a renderizar (p. ej.
+# tras el gc de la caché) tiene otro mtime y se vuelve a leer
+_crcs: "OrderedDict[Tuple[str, int, int], Tuple[int, int]]" = OrderedDict()
+
+
+async def _crc_cached(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    result = _crcs.get(key)
+    if result is None:
+        result = await io_stage.run(_crc_file, path)
+        _crcs[key] = result
+        while len(_crcs) > CRC_CACHE_SIZE:
+            _crcs.popitem(last=False)
+    else:
+        _crcs.move_to_end(key)
+    return result
+
+
+def _pin_entries(root: str, etag: str, entries: List[ZipEntry]) -> List[ZipEntry]:
+    """
+    Enlaza los PDFs del ZIP en <root>/zip-<etag>/ y devuelve las entradas
+    apuntando ahí. Si el directorio ya existe (mismo contenido) se reutiliza
+    y se renueva su mtime para que _prune_exports no lo borre en uso.
+    """
+    target = os.path.join(root, "zip-" + etag.strip('"').removeprefix("zip-"))
+    pinned = [
+        entry._replace(path=os.path.join(target, entry.name)) for entry in entries
+    ]
+    if os.path.isdir(target):
+        os.utime(target)
+        return pinned
+    os.makedirs(root, exist_ok=True)
+    tmp_dir = f"{target}.tmp-{uuid4().hex}"
+    os.makedirs(tmp_dir)
+    try:
+        for entry in entries:
+            link = os.path.join(tmp_dir, entry.name)
+            try:
+                os.link(entry.path, link)
+            except OSError:
+                # Otro sistema de archivos: se copia
+                shutil.copyfile(entry.path, link)
+        try:
+            os.rename(tmp_dir, target)
+        except OSError:
+            # Otra petición lo enlazó primero
+            if not os.path.isdir(target):
+                raise
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return pinned
+
+
+def _layout_alive(layout: ZipLayout) -> bool:
+    first = next((s for _, _, s in layout.segments if isinstance(s, str)), None)
+    if first is None or not os.path.isdir(os.path.dirname(first)):
+        return False
+    os.utime(os.path.dirname(first))
+    return True
+
+
+async def prepare_zip(
+    db: Session, filters: ExportFilter, resume_etag: Optional[str] = None
+) -> Optional[ZipLayout]:
+    """
+    Renderiza los PDFs que falten y arma el ZIP (None si no hay reportes).
+    Con `resume_etag` (If-Range de una descarga que se reanuda) se reutiliza
+    ese armado del mismo filtro si sus PDFs siguen enlazados.
+    """
+    if resume_etag:
+        key = (filters, resume_etag.strip())
+        layout = _layouts.get(key)
+        if layout is not None and await io_stage.run(_layout_alive, layout):
+            _layouts.move_to_end(key)
+            return layout
+
+    entries: List[ZipEntry] = []
+    async for page in iter_reports(filters, db, settings.EXPORT_MAX_REPORTS):
+        paths = await asyncio.gather(
+            *(report_renderer.ensure(payload) for _, _, payload in page)
+        )
+        sizes = await asyncio.gather(*(_crc_cached(path) for path in paths))
+        for (id_clasificacion, moment, _), path, (size, crc) in zip(page, paths, sizes):
+            entries.append(
+                ZipEntry(
+                    entry_name(id_clasificacion, moment),
+                    path,
+                    size,
+                    crc,
+                    moment or datetime(1980, 1, 1),
+                )
+            )
+    if not entries:
+        return None
+    layout = ZipLayout(entries)
+    root = settings.EXPORTS_DIR
+    await io_stage.run(_prune_exports, root, settings.EXPORT_RETENTION_HOURS * 3600)
+    pinned = await io_stage.run(_pin_entries, root, layout.etag, entries)
+    layout = ZipLayout(pinned)
+    key = (filters, layout.etag)
+    _layouts[key] = layout
+    _layouts.move_to_end(key)
+    while len(_layouts) > LAYOUT_CACHE_SIZE:
+        _layouts.popitem(last=False)
+    return layout
+
+
+# --------- PDF unido ---------
+
+def _render_merged(payloads: List[Dict[str, Any]], path: str) -> str:
+    """En el pool de procesos: un PDF con todos los reportes, escrito atómicamente."""
+    if os.path.exists(path):
+        return path
+    tmp_path = f"{path}.tmp-{uuid4().hex}"
+    try:
+        generate_merged_report(payloads, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def _prune_exports(root: str, max_age_seconds: float) -> None:
+    cutoff = time.time() - max_age_seconds
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        except OSError:
+            pass
+
+
+async def prepare_merged(db: Session, filters: ExportFilter) -> Optional[Tuple[str, str]]:
+    """(ruta, etag) del PDF unido, renderizándolo si falta (None si no hay reportes)."""
+    payloads: List[Dict[str, Any]] = []
+    async for page in iter_reports(filters, db, settings.EXPORT_MAX_MERGED):
+        payloads.extend(payload for _, _, payload in page)
+    if not payloads:
+        return None
+    digest = hashlib.sha256(TEMPLATE_VERSION.encode("utf-8"))
+    for payload in payloads:
+        digest.update(render_key(payload).encode("ascii"))
+    key = digest.hexdigest()
+    root = settings.EXPORTS_DIR
+    path = os.path.join(root, f"{key}.pdf")
+    if not os.path.exists(path):
+        os.makedirs(root, exist_ok=True)
+        await io_stage.run(_prune_exports, root, settings.EXPORT_RETENTION_HOURS * 3600)
+        await render_stage.run(_render_merged, payloads, path)
+    return path, f'"{key}"'
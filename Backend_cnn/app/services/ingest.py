@@ -0,0 +1,235 @@
+# app/services/ingest.py
+"""
+Ingesta de subidas por streaming.
+
+El archivo se lee por bloques (UPLOAD_CHUNK_BYTES) y cada bloque se escribe
+en un temporal y se suma al hash en `io_stage`, sin copiarlo entero a
+memoria. Con los primeros bloques se validan los magic bytes y la cabecera
+de la imagen (formato, dimensiones): una subida que no es PNG/JPEG, que
+supera UPLOAD_MAX_BYTES o cuyas dimensiones no sirven se rechaza sin
+escribir el resto. Solo una subida válida y completa pasa a su ruta por
+contenido en el almacén (app.services.storage); ante cualquier fallo el
+temporal se borra. Con `keep_bytes` los bloques también quedan en memoria
+(acotados por UPLOAD_MAX_BYTES) para decodificar desde ahí sin volver a
+leer el archivo recién escrito.
+
+El tipo se toma de los bytes, no de `content_type` del cliente.
+"""
+import hashlib
+import io
+import os
+from typing import BinaryIO, NamedTuple, Optional, Tuple
+
+from fastapi import UploadFile
+from PIL import Image, UnidentifiedImageError
+
+from app.core.config import settings
+from app.core.executors import db_stage, io_stage
+from app.services.storage import UploadStore, upload_store
+
+# Cabecera máxima a examinar: un JPEG con EXIF/miniatura grande puede tener
+# el marcador SOF (dimensiones) bastante después del inicio
+HEADER_MAX_BYTES = 512 * 1024
+
+MAGIC_BYTES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+)
+FORMATS = {
+    "JPEG": ("image/jpeg", ".jpg"),
+    "PNG": ("image/png", ".png"),
+}
+
+
+class UploadRejected(Exception):
+    """Subida inválida; `status_code` y `detail` van tal cual a la respuesta."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class IngestedUpload(NamedTuple):
+    path: str
+    web_url: str
+    size: int
+    hash: str
+    content_type: str
+    width: int
+    height: int
+    # mtime del archivo si lo creó esta subida; None si ya estaba en el
+    # almacén (misma imagen subida antes)
+    created_ns: Optional[int]
+    # Contenido completo, solo con keep_bytes
+    data: Optional[bytes] = None
+
+
+def sniff_image(header: bytes, complete: bool) -> Optional[Tuple[str, int, int]]:
+    """
+    (formato, ancho, alto) a partir de los primeros bytes del archivo, o
+    None si todavía no alcanzan para leer la cabecera. Con `complete` (ya
+    no llegarán más bytes a examinar) una cabecera ilegible se rechaza.
+    """
+    if len(header) < 8 and not complete:
+        return None
+    magic_format = next(
+        (fmt for magic, fmt in MAGIC_BYTES if header.startswith(magic)), None
+    )
+    if magic_format is None:
+        raise UploadRejected(415, "Solo se aceptan PNG o JPEG")
+    try:
+        with Image.open(io.BytesIO(header)) as img:
+            fmt, (width, height) = img.format, img.size
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        if not complete:
+            return None
+        raise UploadRejected(400, "La imagen está dañada o incompleta")
+    if fmt != magic_format:
+        raise UploadRejected(415, "Solo se aceptan PNG o JPEG")
+    if min(width, height) < settings.UPLOAD_MIN_SIDE:
+        raise UploadRejected(
+            400, f"La imagen debe medir al menos {settings.UPLOAD_MIN_SIDE} px por lado"
+        )
+    if width * height > settings.UPLOAD_MAX_PIXELS:
+        raise UploadRejected(
+            413, f"La imagen supera los {settings.UPLOAD_MAX_PIXELS} píxeles"
+        )
+    return fmt, width, height
+
+
+def _append(buffer: BinaryIO, digest, chunk: bytes) -> None:
+    # hashlib libera el GIL con bloques grandes: no frena al resto del pool
+    digest.update(chunk)
+    buffer.write(chunk)
+
+
+def _discard(buffer: BinaryIO, path: str) -> None:
+    buffer.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _finish(
+    store: UploadStore, buffer: BinaryIO, tmp_path: str, hash_imagen: str, ext: str
+) -> Tuple[str, Optional[int]]:
+    buffer.close()
+    return store.commit(tmp_path, hash_imagen, ext)
+
+
+async def discard_upload(db, upload: IngestedUpload, store: UploadStore = upload_store) -> None:
+    """
+    Libera una subida ya ingerida que no llegó a registrarse en BD: el
+    archivo se borra solo si nadie más lo usa (ver UploadStore.release).
+    """
+    try:
+        await db_stage.run(store.release, db, upload.path, upload.created_ns)
+    except Exception as e:
+        print(f"⚠️ No se pudo liberar {upload.path}: {e}")
+
+
+async def ingest_upload(
+    file: UploadFile,
+    max_bytes: Optional[int] = None,
+    store: UploadStore = upload_store,
+    keep_bytes: bool = False,
+) -> IngestedUpload:
+    """
+    Lee `file` por bloques hacia el almacén, validando y hasheando en el
+    camino. Con `keep_bytes` devuelve también el contenido en `data`.
+    Lanza UploadRejected si la subida no es válida.
+    """
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    tmp_path = await io_stage.run(store.temp_path)
+    buffer = await io_stage.run(open, tmp_path, "wb")
+    digest = hashlib.sha256()
+    header = b""
+    info = None
+    size = 0
+    chunks = []
+    try:
+        while True:
+            chunk = await file.read(settings.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadRejected(
+                    413, f"El archivo supera los {max_bytes // (1024 * 1024)} MB"
+                )
+            if info is None:
+                header += chunk[: HEADER_MAX_BYTES - len(header)]
+                info = sniff_image(header, complete=len(header) >= HEADER_MAX_BYTES)
+            await io_stage.run(_append, buffer, digest, chunk)
+            if keep_bytes:
+                chunks.append(chunk)
+        if size == 0:
+            raise UploadRejected(400, "El archivo está vacío")
+        if info is None:
+            info = sniff_image(header, complete=True)
+
+        fmt, width, height = info
+        content_type, ext = FORMATS[fmt]
+        hash_imagen = digest.hexdigest()
+        path, created_ns = await io_stage.run(
+            _finish, store, buffer, tmp_path, hash_imagen, ext
+        )
+    except BaseException:
+        await io_stage.run(_discard, buffer, tmp_path)
+        raise
+
+    return IngestedUpload(
+        path=path,
+        web_url=store.url_for(path),
+        size=size,
+        hash=hash_imagen,
+        content_type=content_type,
+        width=width,
+        height=height,
+        created_ns=created_ns,
+        data=b"".join(chunks) if keep_bytes else None,
+    )
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Middleware ASGI: rechaza con 413 las subidas cuyo Content-Length ya
+    supera el límite, antes de que Starlette lea y parsee el multipart.
+    Los cuerpos sin Content-Length (chunked) quedan limitados por archivo
+    en `ingest_upload`.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        # {ruta: bytes máximos del cuerpo}
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST":
+            limit = self.limits.get(scope["path"].rstrip("/"))
+            if limit is not None:
+                length = dict(scope["headers"]).get(b"content-length")
+                if length is not None and length.isdigit() and int(length) > limit:
+                    await self._reject(send, limit)
+                    return
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(send, limit: int) -> None:
+        body = (
+            '{"detail":"La subida supera los %d MB"}' % (limit // (1024 * 1024))
+        ).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"connection", b"close"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,254 @@
+# app/services/job_queue.py
+"""
+Cola de trabajos de análisis respaldada por la tabla `trabajos`.
+
+La API encola (imagen en estado `pendiente`) y los procesos de
+`app.workers.analysis_worker` reclaman trabajos con
+`SELECT ... FOR UPDATE SKIP LOCKED`, así varios workers no toman el mismo.
+Todas las funciones son síncronas: desde endpoints async se llaman a
+través de `db_stage`.
+"""
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db import models as db_models
+
+
+def enqueue_job(
+    db: Session,
+    id_usuario: int,
+    disk_path: str,
+    web_url: str,
+    tamano: int,
+    formato: str,
+    hash_contenido: str,
+    meta_dict: Dict[str, Any],
+    tiled: bool,
+) -> db_models.Trabajo:
+    """Registra la imagen (pendiente) y su trabajo en un solo commit."""
+    ahora = datetime.now()
+    imagen = db_models.Imagen(
+        id_usuario=id_usuario,
+        ruta_archivo=disk_path,
+        hash_contenido=hash_contenido,
+        tamano=tamano,
+        formato=formato,
+        estado="pendiente",
+    )
+    db.add(imagen)
+    db.flush()
+
+    trabajo = db_models.Trabajo(
+        id_imagen=imagen.id_imagen,
+        id_usuario=id_usuario,
+        metadata_json=json.dumps(meta_dict, ensure_ascii=False),
+        web_url=web_url,
+        tiled=tiled,
+        estado="pendiente",
+        intentos=0,
+        fecha_creacion=ahora,
+    )
+    db.add(trabajo)
+    db.commit()
+    db.refresh(trabajo)
+    return trabajo
+
+
+def claim_jobs(db: Session, worker: str, limit: int) -> List[db_models.Trabajo]:
+    """
+    Toma hasta `limit` trabajos pendientes (los más antiguos primero) y los
+    marca `en_proceso` a nombre de `worker`.
+    """
+    trabajos = (
+        db.query(db_models.Trabajo)
+        .filter(db_models.Trabajo.estado == "pendiente")
+        .order_by(db_models.Trabajo.id_trabajo)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    ahora = datetime.now()
+    for trabajo in trabajos:
+        trabajo.estado = "en_proceso"
+        trabajo.worker = worker
+        trabajo.fecha_inicio = ahora
+        trabajo.intentos += 1
+    db.commit()
+    return trabajos
+
+
+def finish_job(db: Session, trabajo: db_models.Trabajo) -> None:
+    trabajo.estado = "completado"
+    trabajo.error = None
+    trabajo.fecha_fin = datetime.now()
+    db.commit()
+
+
+def fail_job(db: Session, trabajo: db_models.Trabajo, error: str) -> bool:
+    """
+    Registra el fallo de un intento. Vuelve a la cola mientras queden
+    intentos; si no, el trabajo y su imagen quedan en `error`.
+    Devuelve True si el trabajo falló definitivamente.
+    """
+    db.rollback()
+    trabajo.error = error[:2000]
+    final = trabajo.intentos >= settings.ANALYSIS_JOB_MAX_ATTEMPTS
+    if final:
+        trabajo.estado = "error"
+        trabajo.fecha_fin = datetime.now()
+        trabajo.imagen.estado = "error"
+    else:
+        trabajo.estado = "pendiente"
+        trabajo.worker = None
+    db.commit()
+    return final
+
+
+def requeue_stale_jobs(
+    db: Session, stale_seconds: float
+) -> Tuple[int, List[db_models.Trabajo]]:
+    """
+    Devuelve a la cola los trabajos `en_proceso` de workers sin latido
+    reciente (proceso caído a mitad de un lote). Los que ya agotaron
+    ANALYSIS_JOB_MAX_ATTEMPTS quedan en `error` como en fail_job: una
+    imagen que tumba al worker no se reclama para siempre.
+    Devuelve (cantidad reencolada, trabajos fallidos definitivamente).
+    """
+    limite = datetime.now() - timedelta(seconds=stale_seconds)
+    vivos = {
+        nombre
+        for (nombre,) in db.query(db_models.WorkerAnalisis.nombre).filter(
+            db_models.WorkerAnalisis.ultimo_latido >= limite
+        )
+    }
+    huerfanos = [
+        trabajo
+        for trabajo in db.query(db_models.Trabajo)
+        .filter(db_models.Trabajo.estado == "en_proceso")
+        .with_for_update(skip_locked=True)
+        if trabajo.worker not in vivos
+    ]
+    requeued = 0
+    agotados = []
+    for trabajo in huerfanos:
+        if trabajo.intentos >= settings.ANALYSIS_JOB_MAX_ATTEMPTS:
+            trabajo.estado = "error"
+            trabajo.error = f"El worker {trabajo.worker} se detuvo durante el intento {trabajo.intentos}"
+            trabajo.fecha_fin = datetime.now()
+            trabajo.imagen.estado = "error"
+            agotados.append(trabajo)
+        else:
+            trabajo.estado = "pendiente"
+            trabajo.worker = None
+            requeued += 1
+    db.commit()
+    return requeued, agotados
+
+
+def heartbeat(
+    db: Session,
+    nombre: str,
+    pid: int,
+    fecha_inicio: datetime,
+    ocupado: bool,
+    segundos_ocupado: float,
+    procesados: int,
+    fallidos: int,
+) -> None:
+    worker = db.get(db_models.WorkerAnalisis, nombre)
+    if worker is None:
+        worker = db_models.WorkerAnalisis(nombre=nombre)
+        db.add(worker)
+    worker.pid = pid
+    worker.fecha_inicio = fecha_inicio
+    worker.ultimo_latido = datetime.now()
+    worker.ocupado = ocupado
+    worker.segundos_ocupado = segundos_ocupado
+    worker.trabajos_procesados = procesados
+    worker.trabajos_fallidos = fallidos
+    db.commit()
+
+
+def remove_worker(db: Session, nombre: str) -> None:
+    db.query(db_models.WorkerAnalisis).filter(
+        db_models.WorkerAnalisis.nombre == nombre
+    ).delete()
+    db.commit()
+
+
+def queue_position(db: Session, trabajo: db_models.Trabajo) -> Optional[int]:
+    """Cantidad de trabajos pendientes por delante (None si ya no espera)."""
+    if trabajo.estado != "pendiente":
+        return None
+    return (
+        db.query(func.count(db_models.Trabajo.id_trabajo))
+        .filter(
+            db_models.Trabajo.estado == "pendiente",
+            db_models.Trabajo.id_trabajo < trabajo.id_trabajo,
+        )
+        .scalar()
+    )
+
+
+def _seconds_since(fecha: Optional[datetime], ahora: datetime) -> Optional[float]:
+    if fecha is None:
+        return None
+    return round((ahora - fecha.replace(tzinfo=None)).total_seconds(), 3)
+
+
+def queue_stats(db: Session) -> Dict[str, Any]:
+    """Profundidad de la cola, antigüedad de los trabajos y uso de workers."""
+    ahora = datetime.now()
+    por_estado = dict(
+        db.query(db_models.Trabajo.estado, func.count(db_models.Trabajo.id_trabajo))
+        .group_by(db_models.Trabajo.estado)
+        .all()
+    )
+    oldest_pending = (
+        db.query(func.min(db_models.Trabajo.fecha_creacion))
+        .filter(db_models.Trabajo.estado == "pendiente")
+        .scalar()
+    )
+    oldest_running = (
+        db.query(func.min(db_models.Trabajo.fecha_inicio))
+        .filter(db_models.Trabajo.estado == "en_proceso")
+        .scalar()
+    )
+
+    limite = ahora - timedelta(seconds=settings.ANALYSIS_WORKER_STALE_SECONDS)
+    workers = []
+    for worker in db.query(db_models.WorkerAnalisis).order_by(db_models.WorkerAnalisis.nombre):
+        uptime = _seconds_since(worker.fecha_inicio, ahora) or 0.0
+        workers.append(
+            {
+                "name": worker.nombre,
+                "pid": worker.pid,
+                "alive": worker.ultimo_latido.replace(tzinfo=None) >= limite,
+                "busy": worker.ocupado,
+                "last_heartbeat_seconds": _seconds_since(worker.ultimo_latido, ahora),
+                "processed": worker.trabajos_procesados,
+                "failed": worker.trabajos_fallidos,
+                "utilization": round(worker.segundos_ocupado / uptime, 4) if uptime else 0.0,
+            }
+        )
+    alive = [w for w in workers if w["alive"]]
+
+    return {
+        "pending": por_estado.get("pendiente", 0),
+        "running": por_estado.get("en_proceso", 0),
+        "completed": por_estado.get("completado", 0),
+        "failed": por_estado.get("error", 0),
+        "oldest_pending_seconds": _seconds_since(oldest_pending, ahora),
+        "oldest_running_seconds": _seconds_since(oldest_running, ahora),
+        "workers_alive": len(alive),
+        "workers_busy": sum(1 for w in alive if w["busy"]),
+        "utilization": (
+            round(sum(w["utilization"] for w in alive) / len(alive), 4) if alive else 0.0
+        ),
+        "workers": workers,
+    }
@@ -0,0 +1,229 @@
+# app/services/report_cache.py
+"""
+PDFs de reportes renderizados bajo demanda.
+
+La subida ya no genera el PDF: solo guarda el JSON del reporte
+(`Reporte.contenido`). El PDF se renderiza en `render_stage` la primera vez
+que se descarga y queda en disco por hash del contenido + versión de la
+plantilla (report_generator.TEMPLATE_VERSION):
+
+    <REPORTS_CACHE_DIR>/ab/<clave>.pdf
+
+Si el contenido cambia (p. ej. se agrega la explicación Grad-CAM) o la
+plantilla cambia de versión, la clave es otra y se renderiza de nuevo; si
+el archivo se borró, también. Con REPORTS_PRERENDER los reportes nuevos
+se renderizan en segundo plano cuando `render_stage` está libre.
+
+Uso (desde Backend_cnn/):
+    python -m app.services.report_cache prerender --days 7
+    python -m app.services.report_cache gc --keep-days 30
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+from uuid import uuid4
+
+from app.core.config import settings
+from app.core.executors import render_stage
+from app.ml.utils.report_generator import TEMPLATE_VERSION, generate_pdf_report
+
+# Claves del payload que no cambian el PDF
+VOLATILE_KEYS = ("pdfPath",)
+
+
+def render_key(payload: Dict[str, Any]) -> str:
+    content = {k: v for k, v in payload.items() if k not in VOLATILE_KEYS}
+    data = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{TEMPLATE_VERSION}\n{data}".encode("utf-8")).hexdigest()
+
+
+def cache_path(payload: Dict[str, Any], root: Optional[str] = None) -> str:
+    key = render_key(payload)
+    return os.path.join(root or settings.REPORTS_CACHE_DIR, key[:2], f"{key}.pdf")
+
+
+def render_cached(payload: Dict[str, Any], root: Optional[str] = None) -> str:
+    """
+    Ruta del PDF del payload, renderizándolo si no está en disco. Escribe
+    en un temporal y lo renombra: nunca se sirve un PDF a medias. Corre en
+    el pool de procesos o en los workers.
+    """
+    path = cache_path(payload, root)
+    if os.path.exists(path):
+        return path
+    tmp_path = f"{path}.tmp-{uuid4().hex}"
+    try:
+        generate_pdf_report(payload, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+class ReportRenderer:
+    def __init__(self, root: str, prerender: bool, queue_size: int):
+        self.root = root
+        self.prerender = prerender
+        # Generaciones en curso por ruta: descargas simultáneas del mismo
+        # reporte esperan el mismo renderizado
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._pending: Deque[Dict[str, Any]] = deque(maxlen=queue_size)
+        self._worker: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.rendered = 0
+        self.prerendered = 0
+        self.failed = 0
+
+    async def ensure(self, payload: Dict[str, Any]) -> str:
+        """Ruta del PDF en caché, renderizándolo en `render_stage` si falta."""
+        path = cache_path(payload, self.root)
+        if os.path.exists(path):
+            self.hits += 1
+            return path
+        future = self._in_flight.get(path)
+        if future is None:
+            future = asyncio.ensure_future(render_stage.run(render_cached, payload, self.root))
+            self._in_flight[path] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(path, None))
+            try:
+                await asyncio.shield(future)
+                self.rendered += 1
+            except Exception:
+                self.failed += 1
+                raise
+        else:
+            await asyncio.shield(future)
+        return path
+
+    def schedule(self, payload: Dict[str, Any]) -> None:
+        """Encola un reporte nuevo para renderizarlo cuando haya tiempo libre."""
+        if not self.prerender:
+            return
+        # Si la cola está llena se descarta el más antiguo: se renderizará
+        # al descargarse
+        self._pending.append(payload)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._prerender_loop())
+
+    async def _prerender_loop(self) -> None:
+        while self._pending:
+            # Solo con el pool libre: las descargas no esperan detrás
+            if render_stage.stats()["in_flight"] > 0:
+                await asyncio.sleep(0.5)
+                continue
+            payload = self._pending.popleft()
+            try:
+                if not os.path.exists(cache_path(payload, self.root)):
+                    await self.ensure(payload)
+                    self.prerendered += 1
+            except Exception as e:
+                print(f"⚠️ No se pudo pre-renderizar el reporte {payload.get('id')}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "template_version": TEMPLATE_VERSION,
+            "prerender": self.prerender,
+            "pending": len(self._pending),
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "rendered": self.rendered,
+            "prerendered": self.prerendered,
+            "failed": self.failed,
+        }
+
+
+report_renderer = ReportRenderer(
+    settings.REPORTS_CACHE_DIR,
+    prerender=settings.REPORTS_PRERENDER,
+    queue_size=settings.REPORTS_PRERENDER_QUEUE,
+)
+
+
+def prerender(days: float) -> Dict[str, int]:
+    """Renderiza los reportes de los últimos `days` días que falten."""
+    from datetime import datetime, timedelta
+
+    from app.db import models as db_models
+    from app.db.mysql_connection import SessionLocal
+
+    since = datetime.now() - timedelta(days=days)
+    stats = {"checked": 0, "rendered": 0, "failed": 0}
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(db_models.Reporte.contenido)
+            .join(
+                db_models.Clasificacion,
+                db_models.Reporte.id_clasificacion
+                == db_models.Clasificacion.id_clasificacion,
+            )
+            .filter(db_models.Clasificacion.fecha_clasificacion >= since)
+            .yield_per(500)
+        )
+        for (contenido,) in rows:
+            stats["checked"] += 1
+            try:
+                payload = json.loads(contenido or "{}")
+                if not os.path.exists(cache_path(payload)):
+                    render_cached(payload)
+                    stats["rendered"] += 1
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"⚠️ {e}")
+    finally:
+        db.close()
+    return stats
+
+
+def gc(keep_days: float, root: Optional[str] = None) -> Dict[str, int]:
+    """
+    Borra los PDFs en caché sin acceso en `keep_days` días (por atime, o
+    mtime si el sistema de archivos no lo lleva): se regeneran al pedirse.
+    """
+    root = root or settings.REPORTS_CACHE_DIR
+    cutoff = time.time() - keep_days * 86400
+    stats = {"scanned": 0, "removed": 0}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            stats["scanned"] += 1
+            try:
+                st = os.stat(path)
+                if max(st.st_atime, st.st_mtime) < cutoff:
+                    os.remove(path)
+                    stats["removed"] += 1
+            except OSError:
+                pass
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("prerender", help="Renderizar los reportes recientes que falten")
+    run.add_argument("--days", type=float, default=7.0)
+    run = commands.add_parser("gc", help="Borrar PDFs en caché sin uso")
+    run.add_argument("--keep-days", type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "prerender":
+        stats = prerender(args.days)
+        print(
+            f"✅ {stats['checked']} reportes revisados, {stats['rendered']} renderizados, "
+            f"{stats['failed']} con error"
+        )
+    elif args.command == "gc":
+        stats = gc(args.keep_days)
+        print(f"🧹 {stats['scanned']} PDFs revisados, {stats['removed']} borrados")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+# app/services/storage.py
+"""
+Almacén de subidas direccionado por contenido.
+
+Cada imagen se guarda una sola vez, con su SHA-256 como nombre, repartida
+en dos niveles de subdirectorios (uploads/ab/cd/<hash>.jpg): ningún
+directorio pasa de unos pocos miles de entradas aunque haya millones de
+imágenes, y la misma foto subida varias veces ocupa disco una vez.
+
+Las referencias son las filas de `imagenes` cuya `ruta_archivo` apunta al
+archivo: un archivo sin filas que lo referencien puede borrarse. Las
+escrituras van a uploads/.tmp/ y pasan a su ruta definitiva con un
+rename atómico, así nunca se sirve ni se referencia un archivo a medias.
+
+Uso (desde Backend_cnn/):
+    python -m app.services.storage migrate      # pasar uploads/ plano al layout nuevo
+    python -m app.services.storage gc --grace-hours 24
+    python -m app.services.storage stats
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db import models as db_models
+
+URL_PREFIX = "/uploads"
+TMP_DIR = ".tmp"
+
+
+class UploadStore:
+    def __init__(self, root: str, url_prefix: str = URL_PREFIX):
+        self.root = root
+        self.url_prefix = url_prefix
+
+    # --------- rutas ---------
+
+    def path_for(self, hash_imagen: str, ext: str) -> str:
+        return os.path.join(
+            self.root, hash_imagen[:2], hash_imagen[2:4], f"{hash_imagen}{ext}"
+        )
+
+    def is_addressed(self, path: str) -> bool:
+        """La ruta ya sigue el layout <root>/ab/cd/<hash>.<ext>."""
+        rel = os.path.relpath(path, self.root).split(os.sep)
+        if len(rel) != 3:
+            return False
+        name = os.path.splitext(rel[2])[0]
+        return len(name) == 64 and rel[0] == name[:2] and rel[1] == name[2:4]
+
+    def url_for(self, path: str) -> str:
+        rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+        return f"{self.url_prefix}/{rel}"
+
+    def temp_path(self) -> str:
+        tmp_dir = os.path.join(self.root, TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, uuid4().hex)
+
+    # --------- escritura ---------
+
+    def commit(self, tmp_path: str, hash_imagen: str, ext: str) -> Tuple[str, Optional[int]]:
+        """
+        Mueve un temporal ya escrito a su ruta por contenido. Devuelve
+        (ruta, created_ns): created_ns es el mtime del archivo si lo creó
+        esta llamada, o None si ya existía (se descarta el temporal y se
+        actualiza el mtime del existente, que así no lo recoge el gc ni
+        un release() concurrente).
+
+        El archivo se crea con os.link, que falla si la ruta ya existe: de
+        dos subidas simultáneas de los mismos bytes solo una lo crea.
+        """
+        path = self.path_for(hash_imagen, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        while True:
+            try:
+                os.link(tmp_path, path)
+            except FileExistsError:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    # Un release() lo apartó entre medio: se vuelve a crear
+                    continue
+                os.remove(tmp_path)
+                return path, None
+            created_ns = os.stat(path).st_mtime_ns
+            os.remove(tmp_path)
+            return path, created_ns
+
+    # --------- referencias ---------
+
+    def references(self, db: Session, paths: Iterable[str]) -> Dict[str, int]:
+        """Cantidad de filas de `imagenes` que apuntan a cada ruta."""
+        paths = list(paths)
+        if not paths:
+            return {}
+        rows = (
+            db.query(db_models.Imagen.ruta_archivo, func.count())
+            .filter(db_models.Imagen.ruta_archivo.in_(paths))
+            .group_by(db_models.Imagen.ruta_archivo)
+            .all()
+        )
+        counts = {path: 0 for path in paths}
+        counts.update({path: count for path, count in rows})
+        return counts
+
+    def release(self, db: Session, path: str, created_ns: Optional[int]) -> bool:
+        """
+        Borra el archivo de una subida que no llegó a registrarse, solo si
+        lo creó esa misma subida, ninguna otra lo reutilizó después (mtime
+        sin cambios) y ninguna fila lo referencia. Devuelve si se borró.
+        """
+        if created_ns is None:
+            return False
+        try:
+            if os.stat(path).st_mtime_ns != created_ns:
+                return False
+        except OSError:
+            return False
+        if self.references(db, [path])[path]:
+            return False
+        # Se aparta con un rename atómico y se vuelve a comprobar: si otra
+        # subida lo reutilizó entre la comprobación y el borrado (mtime
+        # cambiado o fila nueva), se devuelve a su lugar
+        trash = self.temp_path()
+        try:
+            os.rename(path, trash)
+        except OSError:
+            return False
+        try:
+            reused = (
+                os.stat(trash).st_mtime_ns != created_ns
+                or self.references(db, [path])[path] > 0
+            )
+            if reused:
+                try:
+                    os.link(trash, path)
+                except FileExistsError:
+                    # Otra subida ya lo volvió a crear con el mismo contenido
+                    pass
+            return not reused
+        finally:
+            os.remove(trash)
+
+    # --------- mantenimiento ---------
+
+    def _walk(self) -> Iterable[Tuple[str, List[str]]]:
+        """(directorio, archivos) del almacén, incluidos los temporales."""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            if filenames:
+                yield dirpath, [os.path.join(dirpath, name) for name in sorted(filenames)]
+
+    def gc(self, db: Session, grace_seconds: float, dry_run: bool = False) -> Dict[str, int]:
+        """
+        Borra los archivos sin referencias con más de `grace_seconds` sin
+        modificarse (temporales abandonados, subidas fallidas, archivos
+        planos antiguos que nadie referencia). Se consulta por directorio.
+        """
+        cutoff = time.time() - grace_seconds
+        stats = {"scanned": 0, "removed": 0, "bytes": 0}
+        for dirpath, paths in self._walk():
+            stats["scanned"] += len(paths)
+            old = {}
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_mtime < cutoff:
+                    old[path] = st.st_size
+            if not old:
+                continue
+            is_tmp = os.path.basename(dirpath) == TMP_DIR
+            counts = {} if is_tmp else self.references(db, old)
+            for path, size in old.items():
+                if counts.get(path):
+                    continue
+                if not dry_run:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                stats["removed"] += 1
+                stats["bytes"] += size
+        return stats
+
+    def stats(self, db: Session) -> Dict[str, int]:
+        files = disk_bytes = 0
+        for _, paths in self._walk():
+            for path in paths:
+                try:
+                    disk_bytes += os.path.getsize(path)
+                    files += 1
+                except OSError:
+                    pass
+        references, uploaded_bytes = db.query(
+            func.count(db_models.Imagen.id_imagen),
+            func.coalesce(func.sum(db_models.Imagen.tamano), 0),
+        ).one()
+        return {
+            "files": files,
+            "disk_bytes": disk_bytes,
+            "references": references,
+            "uploaded_bytes": int(uploaded_bytes),
+            "saved_bytes": max(0, int(uploaded_bytes) - disk_bytes),
+        }
+
+
+upload_store = UploadStore(settings.UPLOAD_DIR)
+
+
+def _hash_path(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def migrate(batch_size: int = 500) -> Dict[str, int]:
+    """
+    Pasa las imágenes guardadas con el layout plano (uploads/<uuid>.jpg)
+    al layout por contenido y actualiza `ruta_archivo`. Los duplicados
+    quedan apuntando al mismo archivo y las copias se borran. Conviene
+    correrlo sin tráfico de subidas; se puede repetir.
+    """
+    from app.db.mysql_connection import SessionLocal, engine
+    from app.db.schema import ensure_schema
+
+    # hash_contenido y los índices de `imagenes` en tablas existentes,
+    # antes de consultar Imagen
+    ensure_schema(engine)
+
+    stats = {"migrated": 0, "deduplicated": 0, "missing": 0}
+    moved: Dict[str, str] = {}
+    db = SessionLocal()
+    try:
+        last_id = 0
+        while True:
+            imagenes = (
+                db.query(db_models.Imagen)
+                .filter(db_models.Imagen.id_imagen > last_id)
+                .order_by(db_models.Imagen.id_imagen)
+                .limit(batch_size)
+                .all()
+            )
+            if not imagenes:
+                break
+            last_id = imagenes[-1].id_imagen
+            for imagen in imagenes:
+                old_path = imagen.ruta_archivo
+                if upload_store.is_addressed(old_path):
+                    continue
+                if old_path in moved:
+                    imagen.ruta_archivo = moved[old_path]
+                    continue
+                ext = ".png" if imagen.formato == "image/png" else ".jpg"
+                if not os.path.exists(old_path):
+                    # Una corrida interrumpida pudo mover el archivo sin
+                    # llegar a actualizar la fila
+                    new_path = (
+                        upload_store.path_for(imagen.hash_contenido, ext)
+                        if imagen.hash_contenido
+                        else None
+                    )
+                    if new_path and os.path.exists(new_path):
+                        imagen.ruta_archivo = moved[old_path] = new_path
+                    else:
+                        stats["missing"] += 1
+                        print(f"⚠️ No existe {old_path} (imagen {imagen.id_imagen})")
+                    continue
+                # Se recalcula: las filas antiguas pueden no tener hash
+                hash_imagen = _hash_path(old_path)
+                new_path = upload_store.path_for(hash_imagen, ext)
+                if os.path.exists(new_path):
+                    os.remove(old_path)
+                    stats["deduplicated"] += 1
+                else:
+                    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                    os.replace(old_path, new_path)
+                    stats["migrated"] += 1
+                imagen.ruta_archivo = moved[old_path] = new_path
+                imagen.hash_contenido = imagen.hash_contenido or hash_imagen
+            db.commit()
+    finally:
+        db.close()
+    return stats
+
+
+def main(argv=None):
+    from app.db.mysql_connection import SessionLocal
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("migrate", help="Mover uploads/ plano al layout por contenido")
+    run.add_argument("--batch-size", type=int, default=500)
+    run = commands.add_parser("gc", help="Borrar archivos sin referencias")
+    run.add_argument("--grace-hours", type=float, default=24.0,
+                     help="Antigüedad mínima (mtime) para borrar")
+    run.add_argument("--dry-run", action="store_true")
+    commands.add_parser("stats", help="Archivos, bytes y ahorro por deduplicación")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        stats = migrate(args.batch_size)
+        print(
+            f"✅ {stats['migrated']} movidas, {stats['deduplicated']} duplicadas "
+            f"eliminadas, {stats['missing']} sin archivo"
+        )
+        return 0
+
+    db = SessionLocal()
+    try:
+        if args.command == "gc":
+            stats = upload_store.gc(db, args.grace_hours * 3600, args.dry_run)
+            verb = "se borrarían" if args.dry_run else "borrados"
+            print(
+                f"🧹 {stats['scanned']} archivos revisados, {stats['removed']} {verb} "
+                f"({stats['bytes'] / 1024 / 1024:.1f} MB)"
+            )
+        elif args.command == "stats":
+            stats = upload_store.stats(db)
+            print(
+                f"📦 {stats['files']} archivos ({stats['disk_bytes'] / 1024 / 1024:.1f} MB) "
+                f"para {stats['references']} imágenes "
+                f"({stats['uploaded_bytes'] / 1024 / 1024:.1f} MB subidos, "
+                f"{stats['saved_bytes'] / 1024 / 1024:.1f} MB ahorrados)"
+            )
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
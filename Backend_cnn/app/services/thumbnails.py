@@ -0,0 +1,167 @@
+# app/services/thumbnails.py
+"""
+Miniaturas de las imágenes subidas (historial, detalle, similares).
+
+Cada imagen tiene unos pocos tamaños fijos (THUMBNAIL_SIZES, lado mayor en
+px) en WebP (JPEG si Pillow no trae WebP). Se generan en `decode_stage`
+justo después de la subida (THUMBNAILS_EAGER) o la primera vez que se
+piden, y quedan en disco por hash de contenido:
+
+    <THUMBNAILS_DIR>/<lado>q<calidad>/ab/cd/<sha256>.webp
+
+El lado y la calidad forman parte de la ruta y del ETag: cambiar la
+configuración genera miniaturas nuevas en vez de servir las anteriores.
+"""
+import asyncio
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+from PIL import Image, ImageOps, features
+
+from app.core.config import settings
+from app.core.executors import decode_stage
+from app.services.storage import UploadStore, upload_store
+
+URL_PREFIX = "/thumbnails"
+MEDIA_TYPES = {"webp": "image/webp", "jpg": "image/jpeg"}
+
+
+def render_thumbnails(
+    source: str, targets: Sequence[Tuple[str, int]], fmt: str, quality: int
+) -> List[str]:
+    """
+    Decodifica `source` una vez y escribe cada (ruta, lado mayor) de
+    `targets`, del más grande al más chico. Corre en el pool de procesos.
+    """
+    with Image.open(source) as img:
+        largest = max(side for _, side in targets)
+        if img.format == "JPEG":
+            # Decodificación reducida por DCT: mucho menos trabajo en fotos grandes
+            img.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+    written = []
+    for path, side in sorted(targets, key=lambda target: -target[1]):
+        img.thumbnail((side, side), Image.LANCZOS)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{uuid4().hex}"
+        if fmt == "webp":
+            img.save(tmp_path, "WEBP", quality=quality, method=4)
+        else:
+            img.save(tmp_path, "JPEG", quality=quality, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+        written.append(path)
+    return written
+
+
+class ThumbnailService:
+    def __init__(
+        self,
+        root: str,
+        sizes: Dict[str, int],
+        fmt: str,
+        quality: int,
+        eager: Sequence[str],
+        store: UploadStore,
+    ):
+        self.root = root
+        self.sizes = sizes
+        self.format = fmt if fmt != "webp" or features.check("webp") else "jpg"
+        self.quality = quality
+        self.eager = [size for size in eager if size in sizes]
+        self.store = store
+        # Generaciones en curso por ruta: dos peticiones de la misma
+        # miniatura esperan la misma tarea
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._background: set = set()
+        self.generated = 0
+        self.failed = 0
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    def path_for(self, hash_imagen: str, size: str) -> str:
+        return os.path.join(
+            self.root,
+            f"{self.sizes[size]}q{self.quality}",
+            hash_imagen[:2],
+            hash_imagen[2:4],
+            f"{hash_imagen}.{self.format}",
+        )
+
+    def url_for(self, hash_imagen: Optional[str], size: str) -> Optional[str]:
+        if not hash_imagen or size not in self.sizes:
+            return None
+        return f"{URL_PREFIX}/{size}/{hash_imagen}.{self.format}"
+
+    def etag(self, hash_imagen: str, size: str) -> str:
+        return f'"{hash_imagen}-{self.sizes[size]}q{self.quality}"'
+
+    def source_for(self, hash_imagen: str) -> Optional[str]:
+        """Original en el almacén por contenido (None si no está ahí)."""
+        for ext in (".jpg", ".png"):
+            path = self.store.path_for(hash_imagen, ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    async def ensure(self, hash_imagen: str, source: str, sizes: Sequence[str]) -> None:
+        """Genera las miniaturas de `sizes` que falten (una sola decodificación)."""
+        targets = [
+            (self.path_for(hash_imagen, size), self.sizes[size])
+            for size in sizes
+            if not os.path.exists(self.path_for(hash_imagen, size))
+        ]
+        if not targets:
+            return
+        key = "|".join(path for path, _ in targets)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(
+                decode_stage.run(render_thumbnails, source, targets, self.format, self.quality)
+            )
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            try:
+                await asyncio.shield(future)
+                self.generated += len(targets)
+            except Exception:
+                self.failed += 1
+                raise
+        else:
+            await asyncio.shield(future)
+
+    def schedule(self, hash_imagen: str, source: str) -> None:
+        """Genera en segundo plano los tamaños de THUMBNAILS_EAGER."""
+        if not self.eager:
+            return
+        task = asyncio.ensure_future(self._eager(hash_imagen, source))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _eager(self, hash_imagen: str, source: str) -> None:
+        try:
+            await self.ensure(hash_imagen, source, self.eager)
+        except Exception as e:
+            print(f"⚠️ No se pudieron generar las miniaturas de {source}: {e}")
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "format": self.format,
+            "sizes": self.sizes,
+            "eager": self.eager,
+            "in_flight": len(self._in_flight),
+            "generated": self.generated,
+            "failed": self.failed,
+        }
+
+
+thumbnail_service = ThumbnailService(
+    settings.THUMBNAILS_DIR,
+    settings.THUMBNAIL_SIZES,
+    settings.THUMBNAILS_FORMAT,
+    settings.THUMBNAILS_QUALITY,
+    settings.THUMBNAILS_EAGER,
+    upload_store,
+)
@@ -0,0 +1,424 @@
+# app/workers/analysis_worker.py
+"""
+Workers de la cola de análisis asíncronos (subidas con `async_mode=true`).
+
+Cada proceso carga su propia copia del modelo (o, con INFERENCE_MODE=remote,
+usa el de app.ml.inference.model_server), reclama lotes de trabajos
+pendientes de la tabla `trabajos`, clasifica las imágenes completas del
+lote en una sola pasada del modelo, guarda clasificación + reporte y
+mueve `Imagen.estado` de `pendiente` a `procesada` o `error`.
+
+Uso (desde Backend_cnn/):
+    python -m app.workers.analysis_worker
+    python -m app.workers.analysis_worker --processes 4 --batch-size 16
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.events import event_bus
+from app.db.mysql_connection import SessionLocal, engine
+from app.db.schema import ensure_schema
+from app.db import models as db_models
+from app.ml.inference.cache import content_hash, prediction_cache
+from app.ml.inference.drift import drift_monitor
+from app.ml.inference.embeddings import embedding_store
+from app.ml.inference.shadow import shadow_runner
+from app.ml.models.cnn_model import MODEL_VERSION_MAX_LENGTH, copper_model
+from app.ml.models.registry import model_registry, start_registry_watcher
+from app.ml.models.runtime_profile import runtime_settings
+from app.ml.utils.decoding import decode_image, decode_tiles, normalize_into
+from app.services import job_queue
+from app.services.analysis_service import (
+    analysis_event,
+    build_detail_payload,
+    save_reporte,
+)
+
+
+
+def sync_models() -> None:
+    """Aplica en caliente la versión activa y el modelo en sombra del registro."""
+    copper_model.sync_with_registry()
+    shadow_runner.sync_with_registry()
+
+
+class AnalysisWorker:
+    def __init__(self, name: str, batch_size: int, poll_seconds: float):
+        self.name = name
+        self.batch_size = max(1, batch_size)
+        self.poll_seconds = poll_seconds
+        self.started_at = datetime.now()
+        self.busy = False
+        self.busy_seconds = 0.0
+        self.processed = 0
+        self.failed = 0
+        self._stop = threading.Event()
+
+    # --------- latido ---------
+
+    def _beat(self) -> None:
+        db = SessionLocal()
+        try:
+            job_queue.heartbeat(
+                db,
+                self.name,
+                os.getpid(),
+                self.started_at,
+                self.busy,
+                self.busy_seconds,
+                self.processed,
+                self.failed,
+            )
+        except Exception as e:
+            print(f"⚠️ [{self.name}] No se pudo registrar el latido: {e}")
+        finally:
+            db.close()
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(settings.ANALYSIS_WORKER_HEARTBEAT_SECONDS):
+            self._beat()
+
+    # --------- ciclo principal ---------
+
+    def run(self) -> None:
+        if not copper_model.warmup(
+            settings.MODEL_WARMUP_RUNS, sorted({1, self.batch_size})
+        ):
+            print(f"❌ [{self.name}] No se pudo cargar el modelo")
+            return
+        self._beat()
+        threading.Thread(
+            target=self._heartbeat_loop, name=f"{self.name}-heartbeat", daemon=True
+        ).start()
+        # En modo remoto el servidor de modelo hace el swap: aquí solo se
+        # refresca la versión que sirve
+        if copper_model.remote is None:
+            sync_models()
+        if settings.MODEL_REGISTRY_WATCH_SECONDS > 0:
+            start_registry_watcher(
+                model_registry,
+                sync_models if copper_model.remote is None else copper_model.refresh_served_version,
+                settings.MODEL_REGISTRY_WATCH_SECONDS,
+            )
+        print(f"👷 [{self.name}] Esperando trabajos (lotes de {self.batch_size})")
+
+        try:
+            while not self._stop.is_set():
+                if not self.run_once():
+                    self._stop.wait(self.poll_seconds)
+        finally:
+            self._stop.set()
+            db = SessionLocal()
+            try:
+                job_queue.remove_worker(db, self.name)
+                drift_monitor.flush(db)
+            finally:
+                db.close()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run_once(self) -> int:
+        """Reclama y procesa un lote. Devuelve cuántos trabajos tomó."""
+        db = SessionLocal()
+        try:
+            _, agotados = job_queue.requeue_stale_jobs(
+                db, settings.ANALYSIS_WORKER_STALE_SECONDS
+            )
+            for trabajo in agotados:
+                print(f"❌ [{self.name}] Trabajo {trabajo.id_trabajo}: {trabajo.error}")
+                event_bus.publish(
+                    trabajo.id_usuario,
+                    "job.failed",
+                    {"jobId": trabajo.id_trabajo, "status": trabajo.estado, "error": trabajo.error},
+                )
+            trabajos = job_queue.claim_jobs(db, self.name, self.batch_size)
+            if not trabajos:
+                return 0
+            for trabajo in trabajos:
+                event_bus.publish(
+                    trabajo.id_usuario,
+                    "job.started",
+                    {"jobId": trabajo.id_trabajo, "status": "en_proceso", "attempt": trabajo.intentos},
+                )
+            self.busy = True
+            started = time.perf_counter()
+            try:
+                self._process(db, trabajos)
+            finally:
+                self.busy_seconds += time.perf_counter() - started
+                self.busy = False
+            return len(trabajos)
+        finally:
+            db.close()
+
+    # --------- procesamiento ---------
+
+    def _classify(
+        self,
+        trabajos: List[db_models.Trabajo],
+        data: Dict[int, bytes],
+        errors: Dict[int, str],
+    ) -> Dict[int, Tuple[str, float, Optional[Dict[str, Any]], str, Any]]:
+        """
+        Clasifica los trabajos (caché primero). Las imágenes completas van
+        juntas en un lote del modelo; las de tiles, cada una en su lote.
+        Una imagen que no se puede decodificar solo falla su propio trabajo.
+        Cada resultado es (clase, confianza, heatmap, versión, embedding); en
+        un acierto de caché el embedding es el id del análisis original.
+        """
+        results: Dict[int, Tuple[str, float, Optional[Dict[str, Any]], str, Any]] = {}
+        size = (copper_model.img_width, copper_model.img_height)
+        version = copper_model.version
+        full: List[Tuple[db_models.Trabajo, np.ndarray]] = []
+
+        for trabajo in trabajos:
+            if trabajo.id_trabajo not in data:
+                continue
+            if trabajo.tiled:
+                try:
+                    tiles, rows, cols = decode_tiles(
+                        data[trabajo.id_trabajo],
+                        copper_model.img_width,
+                        settings.TILED_OVERLAP,
+                        settings.TILED_MAX_TILES,
+                        copper_model.fast_decode,
+                    )
+                except Exception as e:
+                    errors[trabajo.id_trabajo] = f"Imagen inválida: {e}"
+                    continue
+                outputs, embeddings = [], []
+                for start in range(0, len(tiles), self.batch_size):
+                    chunk = tiles[start:start + self.batch_size]
+                    batch = np.empty(chunk.shape, dtype=np.float32)
+                    normalize_into(chunk, batch)
+                    prediction, chunk_embeddings, tiles_version = (
+                        copper_model.predict_batch_embedded(batch)
+                    )
+                    outputs.extend(np.array(row) for row in prediction)
+                    embeddings.append(chunk_embeddings)
+                results[trabajo.id_trabajo] = (
+                    *copper_model.aggregate_tiles(
+                        outputs, rows, cols, settings.TILED_MIN_COPPER_FRACTION
+                    ),
+                    tiles_version,
+                    None
+                    if any(e is None for e in embeddings)
+                    else np.concatenate(embeddings).mean(axis=0),
+                )
+                continue
+
+            cached = None
+            if settings.PREDICTION_CACHE_ENABLED:
+                cached = prediction_cache.get(trabajo.imagen.hash_contenido, version)
+            if cached is not None:
+                results[trabajo.id_trabajo] = (
+                    cached.resultado, cached.confianza, None, version, cached.id_clasificacion
+                )
+                continue
+            try:
+                image = decode_image(data[trabajo.id_trabajo], size, copper_model.fast_decode)
+            except Exception as e:
+                errors[trabajo.id_trabajo] = f"Imagen inválida: {e}"
+                continue
+            full.append((trabajo, image))
+
+        if full:
+            batch = np.empty((len(full), size[1], size[0], 3), dtype=np.float32)
+            for i, (_, image) in enumerate(full):
+                normalize_into(image, batch[i])
+            prediction, embeddings, batch_version = copper_model.predict_batch_embedded(batch)
+            shadow_runner.offer(batch, prediction, batch_version)
+            for i, ((trabajo, _), row) in enumerate(zip(full, prediction)):
+                predicted_class, confidence = copper_model.interpret(row)
+                results[trabajo.id_trabajo] = (
+                    predicted_class,
+                    confidence,
+                    None,
+                    batch_version,
+                    None if embeddings is None else embeddings[i],
+                )
+        return results
+
+    def _process(self, db, trabajos: List[db_models.Trabajo]) -> None:
+        data: Dict[int, bytes] = {}
+        errors: Dict[int, str] = {}
+        for trabajo in trabajos:
+            try:
+                with open(trabajo.imagen.ruta_archivo, "rb") as f:
+                    data[trabajo.id_trabajo] = f.read()
+            except OSError as e:
+                errors[trabajo.id_trabajo] = f"No se pudo leer la imagen: {e}"
+
+        try:
+            results = self._classify(trabajos, data, errors)
+        except Exception as e:
+            # Falla el lote completo: cada trabajo se reintenta por separado
+            print(f"❌ [{self.name}] Error en el lote de inferencia: {e}")
+            results = {}
+            for trabajo in trabajos:
+                errors.setdefault(trabajo.id_trabajo, f"Error del modelo: {e}")
+
+        for trabajo in trabajos:
+            result = results.get(trabajo.id_trabajo)
+            try:
+                if result is None:
+                    raise RuntimeError(
+                        errors.get(trabajo.id_trabajo, "Error al procesar la imagen con el modelo")
+                    )
+                self._complete(db, trabajo, data[trabajo.id_trabajo], *result)
+                self.processed += 1
+            except Exception as e:
+                print(f"❌ [{self.name}] Trabajo {trabajo.id_trabajo}: {e}")
+                final = job_queue.fail_job(db, trabajo, str(e))
+                if final:
+                    self.failed += 1
+                event_bus.publish(
+                    trabajo.id_usuario,
+                    "job.failed" if final else "job.retry",
+                    {"jobId": trabajo.id_trabajo, "status": trabajo.estado, "error": str(e)},
+                )
+
+    def _complete(
+        self,
+        db,
+        trabajo: db_models.Trabajo,
+        data: bytes,
+        predicted_class: str,
+        confidence: float,
+        heatmap: Optional[Dict[str, Any]],
+        version: str,
+        embedding: Any = None,
+    ) -> None:
+        imagen = trabajo.imagen
+        clasificacion = (
+            db.get(db_models.Clasificacion, trabajo.id_clasificacion)
+            if trabajo.id_clasificacion
+            else None
+        )
+        # Un reintento tras una caída después de guardar la clasificación
+        # no la duplica: solo falta el reporte
+        if clasificacion is None:
+            clasificacion = db_models.Clasificacion(
+                id_imagen=imagen.id_imagen,
+                resultado=predicted_class,
+                confianza=Decimal(str(confidence)),
+                es_correcto=None,
+                modelo_usado=version[:MODEL_VERSION_MAX_LENGTH],
+                fecha_clasificacion=datetime.now(),
+            )
+            db.add(clasificacion)
+            imagen.estado = "procesada"
+            db.flush()
+            trabajo.id_clasificacion = clasificacion.id_clasificacion
+            db.commit()
+            drift_monitor.record(
+                version,
+                json.loads(trabajo.metadata_json).get("location"),
+                predicted_class,
+                confidence,
+            )
+            if settings.PREDICTION_CACHE_ENABLED and heatmap is None:
+                prediction_cache.put(
+                    imagen.hash_contenido or content_hash(data),
+                    version,
+                    predicted_class,
+                    confidence,
+                    clasificacion.id_clasificacion,
+                )
+            if isinstance(embedding, int):
+                embedding_store.add_from(
+                    version, embedding, clasificacion.id_clasificacion, trabajo.id_usuario
+                )
+            else:
+                embedding_store.add(
+                    version, [(clasificacion.id_clasificacion, trabajo.id_usuario, embedding)]
+                )
+
+        detail_payload = build_detail_payload(
+            json.loads(trabajo.metadata_json),
+            clasificacion.resultado,
+            float(clasificacion.confianza),
+            clasificacion.id_clasificacion,
+            clasificacion.fecha_clasificacion,
+            trabajo.web_url,
+            heatmap=heatmap,
+        )
+        # El PDF se renderiza al descargarse (app.services.report_cache)
+        if clasificacion.reporte is None:
+            save_reporte(db, clasificacion.id_clasificacion, detail_payload)
+        job_queue.finish_job(db, trabajo)
+        event_bus.publish(
+            trabajo.id_usuario,
+            "job.completed",
+            {"jobId": trabajo.id_trabajo, **analysis_event(detail_payload)},
+        )
+
+
+def run_worker(index: int, batch_size: int, poll_seconds: float) -> None:
+    name = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    worker = AnalysisWorker(name, batch_size, poll_seconds)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--processes", type=int, default=runtime_settings["workers"]
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=settings.ANALYSIS_WORKER_BATCH_SIZE
+    )
+    parser.add_argument(
+        "--poll-seconds", type=float, default=settings.ANALYSIS_WORKER_POLL_SECONDS
+    )
+    args = parser.parse_args(argv)
+    # Columnas nuevas de tablas existentes, por si el worker arranca antes
+    # que la API
+    ensure_schema(engine)
+
+    if args.processes <= 1:
+        run_worker(0, args.batch_size, args.poll_seconds)
+        return 0
+
+    # "spawn": TensorFlow no es seguro tras un fork
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(
+            target=run_worker,
+            args=(i, args.batch_size, args.poll_seconds),
+            name=f"analysis-worker-{i}",
+        )
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    print(f"🚀 {len(processes)} workers de análisis iniciados")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
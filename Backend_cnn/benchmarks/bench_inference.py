@@ -0,0 +1,319 @@
+# benchmarks/bench_inference.py
+"""
+Benchmark de inferencia de CopperCNN: arranque en frío, latencia en
+caliente por imagen (p50/p95/p99), throughput por tamaño de lote, costo
+del preprocesamiento frente al del modelo y pico de RSS.
+
+Cada motor corre en un subproceso nuevo, así el arranque en frío y el pico
+de memoria son solo suyos. Sin el .h5 entrenado se usa un modelo sintético
+con la misma arquitectura (MobileNetV2 + cabeza binaria, pesos aleatorios
+con semilla fija), que cuesta lo mismo de ejecutar.
+
+Uso (desde Backend_cnn/):
+    python benchmarks/bench_inference.py
+    python benchmarks/bench_inference.py --backends keras tflite onnx --output bench.json
+    python benchmarks/bench_inference.py --compare bench_anterior.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_preprocess import peak_rss_mb, synthetic_jpeg  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.ml.models.backends import BACKENDS, backend_model_path  # noqa: E402
+
+IMG_SIZE = (224, 224)
+BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+SYNTHETIC_MODEL = os.path.join(tempfile.gettempdir(), "bench_copper_synthetic.h5")
+
+
+def _percentiles(timings):
+    return {
+        "p50": float(np.percentile(timings, 50)),
+        "p95": float(np.percentile(timings, 95)),
+        "p99": float(np.percentile(timings, 99)),
+        "mean": float(np.mean(timings)),
+    }
+
+
+def _timed_ms(fn, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return timings
+
+
+def build_synthetic_model(path=SYNTHETIC_MODEL, seed=0):
+    """Misma arquitectura que training/train_cnn_fixed.py, sin entrenar."""
+    import tensorflow as tf
+    from tensorflow.keras import layers, models
+
+    tf.keras.utils.set_random_seed(seed)
+    base_model = tf.keras.applications.MobileNetV2(
+        weights=None, include_top=False, input_shape=(*IMG_SIZE, 3)
+    )
+    model = models.Sequential([
+        base_model,
+        layers.GlobalAveragePooling2D(),
+        layers.Dropout(0.6),
+        layers.Dense(32, activation="relu"),
+        layers.Dropout(0.4),
+        layers.Dense(1, activation="sigmoid"),
+    ])
+    model.save(path)
+    return model
+
+
+def prepare_models(model_path, backends):
+    """
+    Devuelve {motor: ruta} y si el modelo es sintético. Con el modelo
+    sintético los otros motores se exportan con app.ml.models.convert.
+    """
+    synthetic = not os.path.exists(model_path)
+    if synthetic:
+        model_path = SYNTHETIC_MODEL
+        if not os.path.exists(model_path):
+            print(f"🧪 Modelo entrenado no encontrado; creando modelo sintético en {model_path}")
+            build_synthetic_model(model_path)
+
+    paths = {}
+    for backend in backends:
+        path = model_path if backend == "keras" else backend_model_path(model_path, backend)
+        if not os.path.exists(path):
+            if not synthetic:
+                print(f"⚠️ {path} no existe (exportar con app.ml.models.convert); se omite {backend}")
+                continue
+            from app.ml.models.backends import create_backend
+            from app.ml.models.convert import EXPORTERS
+
+            reference = create_backend("keras", model_path)
+            reference.load()
+            EXPORTERS[backend](reference.model, path)
+        paths[backend] = path
+    return paths, synthetic
+
+
+def run_backend(backend, model_path, batch_sizes, runs, image_path):
+    """Mide un motor. Se ejecuta dentro de un subproceso propio."""
+    from app.ml.models.backends import create_backend
+    from app.ml.utils.decoding import load_image_array
+
+    rss_start = peak_rss_mb()
+
+    # Arranque en frío: import del runtime + carga + primera pasada
+    started = time.perf_counter()
+    model = create_backend(backend, model_path)
+    model.load()
+    load_ms = (time.perf_counter() - started) * 1000.0
+    sample = np.random.default_rng(0).random((1, *IMG_SIZE, 3), dtype=np.float32)
+    started = time.perf_counter()
+    model.predict(sample)
+    first_ms = (time.perf_counter() - started) * 1000.0
+    rss_loaded = peak_rss_mb()
+
+    # Latencia en caliente, una imagen
+    for _ in range(5):
+        model.predict(sample)
+    latency = _percentiles(_timed_ms(lambda: model.predict(sample), runs))
+
+    # Throughput por tamaño de lote
+    throughput = []
+    for batch_size in batch_sizes:
+        batch = np.random.default_rng(batch_size).random(
+            (batch_size, *IMG_SIZE, 3), dtype=np.float32
+        )
+        for _ in range(2):
+            model.predict(batch)
+        batch_runs = max(3, runs // batch_size)
+        timings = _timed_ms(lambda: model.predict(batch), batch_runs)
+        throughput.append(
+            {
+                "batch_size": batch_size,
+                "ms_per_batch_p50": float(np.percentile(timings, 50)),
+                "images_per_second": batch_size * batch_runs * 1000.0 / sum(timings),
+            }
+        )
+
+    # Preprocesamiento (decodificación + normalización) frente al modelo
+    with open(image_path, "rb") as f:
+        data = f.read()
+    preprocess = _percentiles(
+        _timed_ms(
+            lambda: load_image_array(data, IMG_SIZE, fast=settings.PREPROCESS_FAST_DECODE),
+            max(5, runs // 4),
+        )
+    )
+    end_to_end = preprocess["p50"] + latency["p50"]
+
+    return {
+        "backend": backend,
+        "model_path": model_path,
+        "model_bytes": os.path.getsize(model_path),
+        "cold_start": {
+            "load_ms": load_ms,
+            "first_inference_ms": first_ms,
+            "total_ms": load_ms + first_ms,
+        },
+        "latency_ms": latency,
+        "throughput": throughput,
+        "preprocess_ms": preprocess,
+        "preprocess_share": preprocess["p50"] / end_to_end if end_to_end else 0.0,
+        "peak_rss_mb": {
+            "after_load": round(rss_loaded - rss_start, 2),
+            "total": round(peak_rss_mb(), 2),
+        },
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _runtime_versions():
+    versions = {"numpy": np.__version__}
+    for module in ("tensorflow", "onnxruntime", "tflite_runtime"):
+        try:
+            versions[module] = __import__(module).__version__
+        except Exception:
+            pass
+    return versions
+
+
+def compare(baseline, current, max_regression):
+    """
+    Imprime las diferencias contra un JSON anterior y devuelve las
+    métricas que empeoraron más de `max_regression` (fracción).
+    """
+    regressions = []
+    old_results = {r["backend"]: r for r in baseline["results"]}
+    for result in current["results"]:
+        old = old_results.get(result["backend"])
+        if old is None:
+            continue
+        metrics = [
+            ("latency p50 ms", old["latency_ms"]["p50"], result["latency_ms"]["p50"], False),
+            ("latency p95 ms", old["latency_ms"]["p95"], result["latency_ms"]["p95"], False),
+            ("cold start ms", old["cold_start"]["total_ms"], result["cold_start"]["total_ms"], False),
+            ("preprocess p50 ms", old["preprocess_ms"]["p50"], result["preprocess_ms"]["p50"], False),
+        ]
+        old_tp = {t["batch_size"]: t["images_per_second"] for t in old["throughput"]}
+        for t in result["throughput"]:
+            if t["batch_size"] in old_tp:
+                metrics.append(
+                    (f"img/s lote {t['batch_size']}", old_tp[t["batch_size"]], t["images_per_second"], True)
+                )
+        print(f"\n📊 {result['backend']} vs {baseline['meta'].get('git_commit') or 'base'}")
+        for name, before, after, higher_is_better in metrics:
+            change = (after - before) / before if before else 0.0
+            worse = -change if higher_is_better else change
+            flag = "❌" if worse > max_regression else "  "
+            print(f"{flag} {name:<20}{before:>12.2f}{after:>12.2f}{change:>+10.1%}")
+            if worse > max_regression:
+                regressions.append(f"{result['backend']}: {name} {change:+.1%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=settings.MODEL_PATH, help="Modelo Keras .h5")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=["keras"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=list(BATCH_SIZES))
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--width", type=int, default=4000, help="Ancho de la foto de prueba")
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--output", default=None, help="Guardar resultados en JSON")
+    parser.add_argument("--compare", default=None, help="JSON anterior para comparar")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    parser.add_argument("--worker", nargs=2, metavar=("BACKEND", "PATH"), help=argparse.SUPPRESS)
+    parser.add_argument("--image", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        # Subproceso: medir un solo motor e imprimir JSON
+        backend, path = args.worker
+        print(json.dumps(run_backend(backend, path, args.batch_sizes, args.runs, args.image)))
+        return 0
+
+    paths, synthetic = prepare_models(args.model, args.backends)
+    image_path = os.path.join(tempfile.gettempdir(), "bench_inference.jpg")
+    with open(image_path, "wb") as f:
+        f.write(synthetic_jpeg(args.width, args.height))
+
+    results = []
+    for backend, path in paths.items():
+        print(f"⏱️ Midiendo {backend} ({path})...")
+        out = subprocess.run(
+            [sys.executable, __file__, "--worker", backend, path, "--image", image_path,
+             "--runs", str(args.runs), "--batch-sizes", *map(str, args.batch_sizes)],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "synthetic_model": synthetic,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "runtimes": _runtime_versions(),
+            "image_size": [args.width, args.height],
+            "fast_decode": settings.PREPROCESS_FAST_DECODE,
+            "runs": args.runs,
+        },
+        "results": results,
+    }
+
+    print(f"\n{'motor':<8}{'frío ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'prep ms':>9}{'prep %':>8}{'RSS MB':>9}")
+    for r in results:
+        print(
+            f"{r['backend']:<8}{r['cold_start']['total_ms']:>10.0f}"
+            f"{r['latency_ms']['p50']:>9.2f}{r['latency_ms']['p95']:>9.2f}"
+            f"{r['latency_ms']['p99']:>9.2f}{r['preprocess_ms']['p50']:>9.2f}"
+            f"{r['preprocess_share']:>8.0%}{r['peak_rss_mb']['total']:>9.0f}"
+        )
+    print(f"\n{'motor':<8}" + "".join(f"{'lote ' + str(b):>10}" for b in args.batch_sizes) + "   (img/s)")
+    for r in results:
+        print(f"{r['backend']:<8}" + "".join(f"{t['images_per_second']:>10.1f}" for t in r["throughput"]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📄 Resultados: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.max_regression)
+        if regressions:
+            print(f"\n❌ Regresiones (> {args.max_regression:.0%}): " + "; ".join(regressions))
+            return 1
+        print("\n✅ Sin regresiones")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
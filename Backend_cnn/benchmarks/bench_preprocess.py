@@ -0,0 +1,148 @@
+# benchmarks/bench_preprocess.py
+"""
+Micro-benchmark del preprocesamiento de imágenes: ruta original (decodificación
+completa + float64) contra la ruta rápida (JPEG draft + uint8 -> float32).
+
+Cada variante corre en un subproceso nuevo para que el pico de RSS medido
+sea solo suyo.
+
+Uso (desde Backend_cnn/):
+    python benchmarks/bench_preprocess.py
+    python benchmarks/bench_preprocess.py --width 4000 --height 3000 --runs 20
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ml.utils.decoding import load_image_array  # noqa: E402
+
+SIZE = (224, 224)
+VARIANTS = ("legacy", "fast")
+
+
+def legacy_preprocess(source):
+    """Preprocesamiento original de CopperCNN (antes del modo rápido)."""
+    img = Image.open(io.BytesIO(source))
+    img = img.convert("RGB")
+    img = img.resize(SIZE)
+    img_array = np.array(img) / 255.0
+    return np.expand_dims(img_array, axis=0)
+
+
+def fast_preprocess(source):
+    return load_image_array(source, SIZE, fast=True)
+
+
+def synthetic_jpeg(width, height, quality=90, seed=0):
+    """Foto sintética con gradientes y ruido (comprime como una foto real)."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack(
+        [x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)],
+        axis=-1,
+    )
+    noise = rng.integers(0, 40, size=(height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def peak_rss_mb():
+    # En Linux ru_maxrss se hereda a través de exec (arrastraría el pico del
+    # proceso padre); VmHWM es propio del proceso
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_variant(variant, image_path, runs):
+    with open(image_path, "rb") as f:
+        data = f.read()
+    fn = legacy_preprocess if variant == "legacy" else fast_preprocess
+
+    rss_before = peak_rss_mb()
+    fn(data)  # primera pasada fuera de la medición de tiempo
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        out = fn(data)
+        timings.append((time.perf_counter() - started) * 1000.0)
+
+    return {
+        "variant": variant,
+        "dtype": str(out.dtype),
+        "output_bytes": int(out.nbytes),
+        "ms_p50": float(np.percentile(timings, 50)),
+        "ms_p95": float(np.percentile(timings, 95)),
+        "peak_rss_delta_mb": round(peak_rss_mb() - rss_before, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--image", default=None, help="JPEG real en vez del sintético")
+    parser.add_argument("--output", default=None, help="Guardar resultados en JSON")
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.variant:
+        # Subproceso: medir una sola variante e imprimir JSON
+        print(json.dumps(run_variant(args.variant, args.image, args.runs)))
+        return 0
+
+    image_path = args.image
+    if image_path is None:
+        image_path = os.path.join(tempfile.gettempdir(), "bench_preprocess.jpg")
+        with open(image_path, "wb") as f:
+            f.write(synthetic_jpeg(args.width, args.height))
+
+    results = []
+    for variant in VARIANTS:
+        out = subprocess.run(
+            [sys.executable, __file__, "--variant", variant,
+             "--image", image_path, "--runs", str(args.runs)],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    with Image.open(image_path) as img:
+        print(f"🖼️ {image_path}: {img.size[0]}x{img.size[1]}, {os.path.getsize(image_path) / 1e6:.1f} MB")
+    print(f"{'variante':<10}{'p50 ms':>10}{'p95 ms':>10}{'pico RSS MB':>14}{'salida':>10}")
+    for r in results:
+        print(
+            f"{r['variant']:<10}{r['ms_p50']:>10.1f}{r['ms_p95']:>10.1f}"
+            f"{r['peak_rss_delta_mb']:>14.1f}{r['dtype']:>10}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+# benchmarks/tune_threads.py
+"""
+Autotuning de hilos de inferencia: barre procesos x hilos intra-op x
+hilos inter-op x tamaño de lote en este equipo y escribe el perfil de
+runtime recomendado (app.ml.models.runtime_profile), que CopperCNN, la
+API, los workers de la cola y el servidor de modelo aplican al arrancar.
+
+Cada configuración levanta `workers` subprocesos con el modelo cargado y
+los hace inferir a la vez, como varios workers de uvicorn en la misma
+máquina. Se mide el throughput total (img/s) y la latencia por lote
+(p50/p95/p99, lo que espera una petición). Se recomienda la de mayor
+throughput con p99 <= --max-p99-ms; si ninguna cumple, la de menor p99.
+
+Por defecto no se prueban combinaciones con más hilos que núcleos
+(procesos x intra-op > núcleos), que son justamente las que degradan la
+latencia bajo carga.
+
+Uso (desde Backend_cnn/):
+    python benchmarks/tune_threads.py
+    python benchmarks/tune_threads.py --max-p99-ms 300 --seconds 8
+    python benchmarks/tune_threads.py --workers 1 2 4 --intra 1 2 4 --inter 1 --batch-sizes 1 8 16
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_inference import _git_commit, _percentiles, _runtime_versions, prepare_models  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.ml.models.backends import BACKENDS  # noqa: E402
+from app.ml.models.runtime_profile import host_info  # noqa: E402
+
+IMG_SIZE = (224, 224)
+BATCH_SIZES = (1, 4, 8, 16)
+
+
+def _powers_of_two(limit):
+    values, value = [], 1
+    while value <= limit:
+        values.append(value)
+        value *= 2
+    if limit not in values:
+        values.append(limit)
+    return values
+
+
+def run_worker(backend, model_path, intra, inter):
+    """
+    Subproceso: carga el modelo y atiende órdenes por stdin, una por línea
+    ({"batch_size": B, "seconds": S} o {"stop": true}); responde con JSON.
+    """
+    from app.ml.models.backends import create_backend
+
+    model = create_backend(backend, model_path, num_threads=intra, inter_op_threads=inter)
+    model.load()
+    model.predict(np.zeros((1, *IMG_SIZE, 3), dtype=np.float32))
+    print(json.dumps({"ready": True}), flush=True)
+
+    for line in sys.stdin:
+        command = json.loads(line)
+        if command.get("stop"):
+            break
+        batch_size = int(command["batch_size"])
+        batch = np.random.default_rng(batch_size).random(
+            (batch_size, *IMG_SIZE, 3), dtype=np.float32
+        )
+        for _ in range(2):
+            model.predict(batch)
+        latencies = []
+        started = time.perf_counter()
+        deadline = started + float(command["seconds"])
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            model.predict(batch)
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+        elapsed = time.perf_counter() - started
+        print(
+            json.dumps({"batch_size": batch_size, "elapsed": elapsed, "latencies_ms": latencies}),
+            flush=True,
+        )
+    return 0
+
+
+def _start_workers(backend, model_path, workers, intra, inter):
+    env = {
+        **os.environ,
+        # Mismas variables que aplica el perfil, y sin perfil previo que interfiera
+        "OMP_NUM_THREADS": str(intra),
+        "TF_NUM_INTRAOP_THREADS": str(intra),
+        "TF_NUM_INTEROP_THREADS": str(inter),
+        "TF_CPP_MIN_LOG_LEVEL": "2",
+        "RUNTIME_PROFILE_ENABLED": "false",
+    }
+    processes = [
+        subprocess.Popen(
+            [sys.executable, __file__, "--worker", backend, model_path,
+             "--worker-threads", str(intra), str(inter)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            env=env,
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        # Las líneas que no son JSON son logs del runtime
+        while True:
+            line = process.stdout.readline()
+            if not line:
+                raise RuntimeError("Un worker terminó antes de cargar el modelo")
+            if line.startswith("{") and json.loads(line).get("ready"):
+                break
+    return processes
+
+
+def _read_result(process):
+    while True:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError("Un worker terminó durante la medición")
+        if line.startswith("{"):
+            return json.loads(line)
+
+
+def measure(backend, model_path, workers, intra, inter, batch_sizes, seconds):
+    """Mide una configuración (procesos, intra, inter) con cada tamaño de lote."""
+    processes = _start_workers(backend, model_path, workers, intra, inter)
+    results = []
+    try:
+        for batch_size in batch_sizes:
+            command = json.dumps({"batch_size": batch_size, "seconds": seconds}) + "\n"
+            # Todos arrancan a la vez: compiten por los núcleos como en producción
+            for process in processes:
+                process.stdin.write(command)
+                process.stdin.flush()
+            outputs = [_read_result(process) for process in processes]
+            latencies = [ms for out in outputs for ms in out["latencies_ms"]]
+            throughput = sum(
+                len(out["latencies_ms"]) * batch_size / out["elapsed"] for out in outputs
+            )
+            results.append(
+                {
+                    "workers": workers,
+                    "intra_op_threads": intra,
+                    "inter_op_threads": inter,
+                    "batch_size": batch_size,
+                    "images_per_second": round(throughput, 2),
+                    "batch_latency_ms": {k: round(v, 2) for k, v in _percentiles(latencies).items()},
+                    "batches": len(latencies),
+                }
+            )
+    finally:
+        for process in processes:
+            try:
+                process.stdin.write(json.dumps({"stop": True}) + "\n")
+                process.stdin.flush()
+            except OSError:
+                pass
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    return results
+
+
+def recommend(results, max_p99_ms):
+    within = [r for r in results if r["batch_latency_ms"]["p99"] <= max_p99_ms]
+    if within:
+        return max(within, key=lambda r: (r["images_per_second"], -r["batch_latency_ms"]["p99"]))
+    return min(results, key=lambda r: r["batch_latency_ms"]["p99"])
+
+
+def main(argv=None):
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=settings.MODEL_PATH, help="Modelo Keras .h5")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=settings.INFERENCE_BACKEND)
+    parser.add_argument("--workers", nargs="+", type=int, default=_powers_of_two(cpu_count))
+    parser.add_argument("--intra", nargs="+", type=int, default=_powers_of_two(cpu_count))
+    parser.add_argument("--inter", nargs="+", type=int, default=[1, 2])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=list(BATCH_SIZES))
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duración de cada medición")
+    parser.add_argument("--max-p99-ms", type=float, default=500.0,
+                        help="Latencia p99 por lote aceptable")
+    parser.add_argument("--allow-oversubscription", action="store_true",
+                        help="Probar también procesos x intra-op > núcleos")
+    parser.add_argument("--output", default=settings.RUNTIME_PROFILE_PATH)
+    parser.add_argument("--worker", nargs=2, metavar=("BACKEND", "PATH"), help=argparse.SUPPRESS)
+    parser.add_argument("--worker-threads", nargs=2, type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return run_worker(*args.worker, *args.worker_threads)
+
+    paths, synthetic = prepare_models(args.model, [args.backend])
+    model_path = paths[args.backend]
+    grid = [
+        (workers, intra, inter)
+        for workers in sorted(set(args.workers))
+        for intra in sorted(set(args.intra))
+        for inter in sorted(set(args.inter))
+        if args.allow_oversubscription or workers * intra <= cpu_count
+    ]
+    if not grid:
+        parser.error("Ninguna combinación cabe en los núcleos (ver --allow-oversubscription)")
+    print(
+        f"🔧 {len(grid)} configuraciones x {len(args.batch_sizes)} lotes, "
+        f"{args.seconds:g}s cada una ({cpu_count} núcleos, {args.backend})"
+    )
+
+    results = []
+    for workers, intra, inter in grid:
+        print(f"⏱️ {workers} procesos, {intra} intra-op, {inter} inter-op...")
+        try:
+            measured = measure(
+                args.backend, model_path, workers, intra, inter, args.batch_sizes, args.seconds
+            )
+        except Exception as e:
+            print(f"❌ Falló la configuración: {e}")
+            continue
+        for r in measured:
+            print(
+                f"   lote {r['batch_size']:>3}: {r['images_per_second']:>8.1f} img/s  "
+                f"p50 {r['batch_latency_ms']['p50']:>7.1f} ms  p99 {r['batch_latency_ms']['p99']:>7.1f} ms"
+            )
+        results.extend(measured)
+    if not results:
+        print("❌ No se pudo medir ninguna configuración")
+        return 1
+
+    best = recommend(results, args.max_p99_ms)
+    profile = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "host": host_info(),
+        "runtimes": _runtime_versions(),
+        "backend": args.backend,
+        "model_path": model_path,
+        "synthetic_model": synthetic,
+        "max_p99_ms": args.max_p99_ms,
+        "meets_latency_target": best["batch_latency_ms"]["p99"] <= args.max_p99_ms,
+        "recommended": {
+            "workers": best["workers"],
+            "intra_op_threads": best["intra_op_threads"],
+            "inter_op_threads": best["inter_op_threads"],
+            "batch_size": best["batch_size"],
+            "images_per_second": best["images_per_second"],
+            "batch_p99_ms": best["batch_latency_ms"]["p99"],
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    tmp_path = f"{args.output}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, args.output)
+
+    rec = profile["recommended"]
+    print(
+        f"\n✅ Recomendado: {rec['workers']} procesos x {rec['intra_op_threads']} hilos intra-op "
+        f"({rec['inter_op_threads']} inter-op), lotes de {rec['batch_size']}: "
+        f"{rec['images_per_second']:.1f} img/s, p99 {rec['batch_p99_ms']:.1f} ms"
+    )
+    if not profile["meets_latency_target"]:
+        print(f"⚠️ Ninguna configuración cumple p99 <= {args.max_p99_ms:.0f} ms")
+    print(f"📄 Perfil: {args.output} (se aplica al reiniciar la API, los workers y el servidor de modelo)")
+    print(f"   uvicorn app.main:app --workers {rec['workers']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
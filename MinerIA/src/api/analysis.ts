@@ -8,6 +8,8 @@ export interface AnalysisSummary {
   riskLevel: string;
   copperGrade: string;
   status: string;
+  // Miniatura chica (WebP/JPEG, caché larga); null si no hay hash de la imagen
+  thumbnailUrl?: string | null;
 }
 
 export interface AnalysisDetail {
@@ -22,15 +24,67 @@ export interface AnalysisDetail {
   metadata: Record<string, string | number>;
   imageUrl: string;
   status: string;
+  heatmap?: CopperHeatmap | null;
+  explanationUrl?: string | null;
+  thumbnailUrl?: string | null;
+}
+
+export interface CopperHeatmap {
+  rows: number;
+  cols: number;
+  values: number[][];
+  copperFraction: number;
 }
 
 export async function uploadAnalysis(
   file: File,
-  metadata: Record<string, string | number>
+  metadata: Record<string, string | number>,
+  options: { tiled?: boolean } = {}
 ): Promise<AnalysisDetail> {
   const form = new FormData();
   form.append("file", file);
   form.append("metadata", JSON.stringify(metadata));
+  if (options.tiled !== undefined) {
+    form.append("tiled", String(options.tiled));
+  }
+
+  const { data } = await apiClient.post("/analysis/upload", form, {
+    headers: {
+      "Content-Type": "multipart/form-data",
+    },
+  });
+
+  return data;
+}
+
+export interface AnalysisJob {
+  jobId: number;
+  status: "pendiente" | "en_proceso" | "completado" | "error";
+  imageStatus: "pendiente" | "procesada" | "error";
+  attempts: number;
+  queuePosition?: number | null;
+  error?: string | null;
+  createdAt?: string | null;
+  startedAt?: string | null;
+  finishedAt?: string | null;
+  analysisId?: number | null;
+  analysis?: AnalysisDetail | null;
+}
+
+// Subida asíncrona: el backend responde 202 con el id del trabajo y el
+// análisis se consulta luego con getAnalysisJob / waitForAnalysisJob.
+export async function uploadAnalysisAsync(
+  file: File,
+  metadata: Record<string, string | number>,
+  options: { tiled?: boolean } = {}
+): Promise<{ jobId: number; status: string; statusUrl: string }> {
+  const form = new FormData();
+  form.append("file", file);
+  form.append("metadata", JSON.stringify(metadata));
+  form.append("async_mode", "true");
+  if (options.tiled !== undefined) {
+    form.append("tiled", String(options.tiled));
+  }
 
   const { data } = await apiClient.post("/analysis/upload", form, {
     headers: {
@@ -41,6 +95,62 @@ export async function uploadAnalysis(
   return data;
 }
 
+export async function getAnalysisJob(jobId: number): Promise<AnalysisJob> {
+  const { data } = await apiClient.get(`/analysis/jobs/${jobId}`);
+  return data;
+}
+
+export async function waitForAnalysisJob(
+  jobId: number,
+  intervalMs = 2000
+): Promise<AnalysisJob> {
+  for (;;) {
+    const job = await getAnalysisJob(jobId);
+    if (job.status === "completado" || job.status === "error") {
+      return job;
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+}
+
+export interface BatchUploadItem {
+  filename: string;
+  ok: boolean;
+  error?: string | null;
+  analysis?: AnalysisDetail | null;
+}
+
+export interface BatchUploadResult {
+  batchId: string;
+  total: number;
+  processed: number;
+  failed: number;
+  seconds: number;
+  imagesPerSecond: number;
+  results: BatchUploadItem[];
+}
+
+// Sube varias fotos en una sola petición. `metadata` puede ser un objeto
+// común a todas o una lista con una entrada por archivo (mismo orden).
+export async function uploadAnalysisBatch(
+  files: File[],
+  metadata:
+    | Record<string, string | number>
+    | Record<string, string | number>[]
+): Promise<BatchUploadResult> {
+  const form = new FormData();
+  files.forEach((file) => form.append("files", file));
+  form.append("metadata", JSON.stringify(metadata));
+
+  const { data } = await apiClient.post("/analysis/upload-batch", form, {
+    headers: {
+      "Content-Type": "multipart/form-data",
+    },
+  });
+
+  return data;
+}
+
 export async function getAnalysisHistory(): Promise<AnalysisSummary[]> {
   const { data } = await apiClient.get("/analysis/history");
   return data;
@@ -52,3 +162,112 @@ export async function getAnalysisById(
   const { data } = await apiClient.get(`/analysis/${id}`);
   return data;
 }
+
+export interface SimilarAnalysis {
+  id: number;
+  similarity: number;
+  date: string;
+  zone: string;
+  category: string;
+  copperGrade: string;
+  status: string;
+  imageUrl: string;
+  thumbnailUrl?: string | null;
+}
+
+export interface SimilarAnalysesResult {
+  id: number;
+  modelVersion: string;
+  searchMs: number;
+  results: SimilarAnalysis[];
+}
+
+// Análisis del usuario más parecidos (embeddings del modelo)
+export async function getSimilarAnalyses(
+  id: string,
+  k = 10
+): Promise<SimilarAnalysesResult> {
+  const { data } = await apiClient.get(`/analysis/${id}/similar`, {
+    params: { k },
+  });
+  return data;
+}
+
+export interface AnalysisExplanation {
+  id: number;
+  status: "listo" | "pendiente" | "error";
+  url?: string | null;
+  modelVersion?: string | null;
+  error?: string | null;
+}
+
+// Mapa Grad-CAM del análisis. La primera vez responde "pendiente" (se
+// calcula en segundo plano); waitForAnalysisExplanation consulta hasta que
+// esté listo.
+export async function getAnalysisExplanation(
+  id: string
+): Promise<AnalysisExplanation> {
+  const { data } = await apiClient.get(`/analysis/${id}/explanation`);
+  return data;
+}
+
+export async function waitForAnalysisExplanation(
+  id: string,
+  intervalMs = 1500
+): Promise<AnalysisExplanation> {
+  for (;;) {
+    const explanation = await getAnalysisExplanation(id);
+    if (explanation.status !== "pendiente") {
+      return explanation;
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+}
+
+export type AnalysisEventType =
+  | "analysis.completed"
+  | "batch.progress"
+  | "batch.completed"
+  | "job.queued"
+  | "job.started"
+  | "job.retry"
+  | "job.completed"
+  | "job.failed";
+
+export interface AnalysisEvent {
+  id: string;
+  type: AnalysisEventType;
+  userId: number;
+  time: number;
+  data: Record<string, unknown>;
+}
+
+const EVENT_TYPES: AnalysisEventType[] = [
+  "analysis.completed",
+  "batch.progress",
+  "batch.completed",
+  "job.queued",
+  "job.started",
+  "job.retry",
+  "job.completed",
+  "job.failed",
+];
+
+// Canal SSE con el progreso de los análisis del usuario: reemplaza el
+// polling de /history y /jobs/{id}. EventSource no permite cabeceras, por
+// eso el token va en la query. Devuelve la función para cerrar el canal.
+export function subscribeAnalysisEvents(
+  onEvent: (event: AnalysisEvent) => void
+): () => void {
+  const token = localStorage.getItem("token") ?? "";
+  const url = `${apiClient.defaults.baseURL}/analysis/events?access_token=${encodeURIComponent(token)}`;
+  const source = new EventSource(url);
+
+  EVENT_TYPES.forEach((type) =>
+    source.addEventListener(type, (message) => {
+      onEvent(JSON.parse((message as MessageEvent).data));
+    })
+  );
+
+  return () => source.close();
+}
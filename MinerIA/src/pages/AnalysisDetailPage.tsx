@@ -64,11 +64,13 @@ export function AnalysisDetailPage() {
           ) : (
             <div className="bg-white rounded-xl border border-slate-200 p-4 space-y-4 text-sm">
               <div className="flex gap-4">
-                <img
-                  src={`${apiBase}${data.imageUrl}`}
-                  alt="Análisis"
-                  className="w-64 h-40 object-cover rounded-lg border border-slate-200"
-                />
+                <a href={`${apiBase}${data.imageUrl}`} target="_blank" rel="noreferrer">
+                  <img
+                    src={`${apiBase}${data.thumbnailUrl ?? data.imageUrl}`}
+                    alt="Análisis"
+                    className="w-64 h-40 object-cover rounded-lg border border-slate-200"
+                  />
+                </a>
                 <div className="space-y-1">
                   <h2 className="font-semibold text-slate-900">
                     {data.zone} · {data.copperGrade}
@@ -8,6 +8,7 @@ import type { AnalysisSummary } from "../api/analysis";
 import { getAnalysisHistory } from "../api/analysis";
 
 export function HistoryPage() {
+  const apiBase = import.meta.env.VITE_API_URL ?? "http://localhost:8000";
   const [rows, setRows] = useState<AnalysisSummary[]>([]);
 
   useEffect(() => {
@@ -28,7 +29,8 @@ export function HistoryPage() {
             <table className="w-full text-xs text-left">
               <thead className="border-b border-slate-200 text-slate-500">
                 <tr>
-                  <th className="py-2">Fecha</th>
+                  <th className="py-2"></th>
+                  <th>Fecha</th>
                   <th>Zona</th>
                   <th>Categoría</th>
                   <th>Riesgo</th>
@@ -41,7 +43,17 @@ export function HistoryPage() {
               <tbody>
                 {rows.map((r) => (
                   <tr key={r.id} className="border-b border-slate-100">
-                    <td className="py-2">{r.date}</td>
+                    <td className="py-2 pr-2">
+                      {r.thumbnailUrl && (
+                        <img
+                          src={`${apiBase}${r.thumbnailUrl}`}
+                          alt=""
+                          loading="lazy"
+                          className="w-12 h-8 object-cover rounded border border-slate-200"
+                        />
+                      )}
+                    </td>
+                    <td>{r.date}</td>
                     <td>{r.zone}</td>
                     <td>{r.category}</td>
                     <td>{r.riskLevel}</td>
@@ -61,7 +73,7 @@ export function HistoryPage() {
                 {rows.length === 0 && (
                   <tr>
                     <td
-                      colSpan={7}
+                      colSpan={8}
                       className="py-4 text-center text-slate-400"
                     >
                       No hay análisis registrados.